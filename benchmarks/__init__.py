@@ -0,0 +1,4 @@
+"""Benchmarks for lubed against local stand-ins of OBS and the git server.
+
+Run them from the repository root with `python -m benchmarks.run --help`.
+"""
@@ -0,0 +1,186 @@
+"""Local stand-in for the git server.
+
+A `git daemon` serves one bare repository per package below `pool/`. The
+repositories are symlinks to two template repositories, one with an old and one
+with a new commit, so that creating thousands of them is cheap. Connections go
+through a proxy that counts them and the bytes transferred.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Optional
+
+from lubed import Timestamp
+
+
+class FakeGitServer:
+    """Serve the repositories of `packages` on a random local port.
+
+    :param root: Directory for the repositories, should be empty
+    :param packages: Package names with the author time of their last commit
+    :param branch: Branch that holds the commit
+    """
+
+    def __init__(self, root: str, packages: Dict[str, Timestamp], branch: str):
+        self.root = root
+        self.packages = packages
+        self.branch = branch
+        self._daemon: Optional[subprocess.Popen] = None
+        self._proxy: Optional[_CountingProxy] = None
+
+    @property
+    def url(self) -> str:
+        return f"git://127.0.0.1:{self._proxy.port}"
+
+    @property
+    def requests(self) -> int:
+        return self._proxy.connections
+
+    @property
+    def bytes_sent(self) -> int:
+        return self._proxy.bytes_sent
+
+    def reset_counters(self) -> None:
+        self._proxy.reset_counters()
+
+    def start(self) -> "FakeGitServer":
+        pool = os.path.join(self.root, "pool")
+        os.makedirs(pool)
+        templates = {}
+        for commit_time in set(self.packages.values()):
+            templates[commit_time] = self._template(commit_time)
+        for name, commit_time in self.packages.items():
+            os.symlink(templates[commit_time], os.path.join(pool, f"{name}.git"))
+
+        port = _free_port()
+        self._daemon = subprocess.Popen(
+            [
+                "git",
+                "daemon",
+                "--reuseaddr",
+                "--export-all",
+                f"--base-path={self.root}",
+                "--listen=127.0.0.1",
+                f"--port={port}",
+                self.root,
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+        _wait_for_port(port)
+        self._proxy = _CountingProxy(port).start()
+        return self
+
+    def stop(self) -> None:
+        self._proxy.stop()
+        self._daemon.terminate()
+        self._daemon.wait()
+
+    def _template(self, commit_time: Timestamp) -> str:
+        repo_dir = os.path.join(self.root, "templates", f"{commit_time}.git")
+        subprocess.run(["git", "init", "-q", "--bare", repo_dir], check=True)
+
+        def git(*args, **kwargs) -> str:
+            return subprocess.run(
+                ["git", *args],
+                cwd=repo_dir,
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+                check=True,
+                **kwargs,
+            ).stdout.strip()
+
+        git("config", "uploadpack.allowFilter", "true")
+        tree = git("mktree", input="")
+        env = {
+            **os.environ,
+            "GIT_AUTHOR_NAME": "lubed",
+            "GIT_AUTHOR_EMAIL": "lubed@localhost",
+            "GIT_AUTHOR_DATE": f"{commit_time} +0000",
+            "GIT_COMMITTER_NAME": "lubed",
+            "GIT_COMMITTER_EMAIL": "lubed@localhost",
+            "GIT_COMMITTER_DATE": f"{commit_time} +0000",
+        }
+        commit = git("commit-tree", tree, "-m", "Update", env=env)
+        git("update-ref", f"refs/heads/{self.branch}", commit)
+        git("symbolic-ref", "HEAD", f"refs/heads/{self.branch}")
+        return repo_dir
+
+
+class _CountingProxy:
+    """Forward TCP connections to a local port and count the traffic."""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.connections = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._listener = socket.create_server(("127.0.0.1", 0), backlog=128)
+        self.port = self._listener.getsockname()[1]
+
+    def start(self) -> "_CountingProxy":
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._listener.close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.connections = 0
+            self.bytes_sent = 0
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            server = socket.create_connection(("127.0.0.1", self.target_port))
+            threading.Thread(
+                target=self._pipe, args=(client, server, False), daemon=True
+            ).start()
+            threading.Thread(
+                target=self._pipe, args=(server, client, True), daemon=True
+            ).start()
+
+    def _pipe(self, source: socket.socket, target: socket.socket, count: bool):
+        try:
+            while data := source.recv(65536):
+                target.sendall(data)
+                if count:
+                    with self._lock:
+                        self.bytes_sent += len(data)
+        except OSError:
+            pass
+        finally:
+            for s in (source, target):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            # Each socket is the source of exactly one pipe
+            source.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
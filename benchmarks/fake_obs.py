@@ -0,0 +1,182 @@
+"""Local stand-in for the OBS API.
+
+Only the routes that lubed uses are served, with synthetic projects and packages.
+Every response can be delayed to simulate the latency of the real server.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import http.server
+import re
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+
+from lubed import Timestamp
+
+# project -> package -> mtime of the newest file
+Projects = Dict[str, Dict[str, Timestamp]]
+
+
+class FakeOBS:
+    """Serve `projects` on a random local port until `stop` is called.
+
+    :param projects: Projects with their packages and modification times
+    :param latency: Seconds to wait before sending each response
+    :param files: Number of files listed per package
+    """
+
+    def __init__(self, projects: Projects, latency: float = 0.0, files: int = 20):
+        self.projects = projects
+        self.latency = latency
+        self.files = files
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server: Optional[http.server.ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOBS":
+        fake = self
+
+        class Handler(_Handler):
+            obs = fake
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def count(self, size: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def respond(self, path: str, query: Dict[str, List[str]]) -> Tuple[int, str]:
+        """Build the status code and XML body for a GET request."""
+        parts = [urllib.parse.unquote(part) for part in path.strip("/").split("/")]
+        if parts[0] == "source" and len(parts) == 2:
+            return self._project(parts[1], query)
+        if parts[0] == "source" and len(parts) == 3:
+            return self._package(parts[1], parts[2], query)
+        if parts == ["search", "project", "id"]:
+            return self._search_projects(query["match"][0])
+        if parts == ["search", "package", "id"]:
+            return self._search_packages(query["match"][0])
+        if parts == ["statistics", "latest_updated"]:
+            return self._latest_updated(query)
+        return 404, "<status code='unknown_route'/>"
+
+    def _project(self, project: str, query) -> Tuple[int, str]:
+        if project not in self.projects:
+            return 404, "<status code='unknown_project'/>"
+        packages = self.projects[project]
+        if query.get("view") == ["info"]:
+            names = query.get("package", sorted(packages))
+            infos = "".join(
+                self._sourceinfo(project, name) for name in names if name in packages
+            )
+            return 200, f"<sourceinfolist>{infos}</sourceinfolist>"
+        entries = "".join(f"<entry name={quoteattr(name)}/>" for name in packages)
+        return 200, f'<directory count="{len(packages)}">{entries}</directory>'
+
+    def _package(self, project: str, name: str, query) -> Tuple[int, str]:
+        if name not in self.projects.get(project, {}):
+            return 404, "<status code='unknown_package'/>"
+        if query.get("view") == ["info"]:
+            return 200, self._sourceinfo(project, name)
+        mtime = self.projects[project][name]
+        entries = "".join(
+            f'<entry name="file{i}.patch" md5="{_md5(project, name, i)}"'
+            f' size="{1000 + i}" mtime="{mtime - i * 3600}"/>'
+            for i in range(self.files)
+        )
+        srcmd5 = _md5(project, name, mtime)
+        return (
+            200,
+            f'<directory name={quoteattr(name)} srcmd5="{srcmd5}">{entries}</directory>',
+        )
+
+    def _sourceinfo(self, project: str, name: str) -> str:
+        srcmd5 = _md5(project, name, self.projects[project][name])
+        return f'<sourceinfo package={quoteattr(name)} srcmd5="{srcmd5}"/>'
+
+    def _search_projects(self, match: str) -> Tuple[int, str]:
+        prefix = re.search(r'starts_with\(@name, "([^"]*)"\)', match).group(1)
+        projects = "".join(
+            f"<project name={quoteattr(project)}/>"
+            for project in self.projects
+            if project.startswith(prefix)
+        )
+        return 200, f"<collection>{projects}</collection>"
+
+    def _search_packages(self, match: str) -> Tuple[int, str]:
+        prefix = re.search(r"starts_with\(@project, '([^']*)'\)", match)
+        exact = re.search(r"@project='([^']*)'", match)
+        names = set(re.findall(r"@name='([^']*)'", match))
+        packages = "".join(
+            f"<package name={quoteattr(name)} project={quoteattr(project)}/>"
+            for project, packages in self.projects.items()
+            if (prefix and project.startswith(prefix.group(1)))
+            or (exact and project == exact.group(1))
+            for name in packages
+            if name in names
+        )
+        return 200, f"<collection>{packages}</collection>"
+
+    def _latest_updated(self, query) -> Tuple[int, str]:
+        since = int(query["timelimit"][0])
+        project_filter = re.compile(query["prjfilter"][0])
+        package_filter = re.compile(query["pkgfilter"][0])
+        packages = "".join(
+            f"<package name={quoteattr(name)} project={quoteattr(project)}/>"
+            for project, packages in self.projects.items()
+            if project_filter.search(project)
+            for name, mtime in packages.items()
+            if mtime > since and package_filter.search(name)
+        )
+        return 200, f"<latest_updated>{packages}</latest_updated>"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+    obs: FakeOBS
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        parsed = urllib.parse.urlparse(self.path)
+        status, body = self.obs.respond(
+            parsed.path, urllib.parse.parse_qs(parsed.query)
+        )
+        data = body.encode("utf-8")
+        if self.obs.latency:
+            time.sleep(self.obs.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.obs.count(len(data))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def _md5(*parts) -> str:
+    return hashlib.md5("/".join(map(str, parts)).encode("utf-8")).hexdigest()
@@ -0,0 +1,297 @@
+"""Measure lubed against local stand-ins of OBS and the git server.
+
+For each origin count, synthetic projects are served by a fake OBS API and a git
+daemon, then every scenario runs in a fresh Python process, so that peak RSS and
+lru_caches of one scenario don't affect the next one.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from typing import Dict, List
+
+import click
+import rich.box
+import rich.console
+import rich.table
+
+from benchmarks.fake_git import FakeGitServer
+from benchmarks.fake_obs import FakeOBS, Projects
+
+SCENARIOS = ("updates", "not-in-conf", "subprojects-containing")
+BUNDLE_PROJECT = "Bench:bundle"
+GIT_PROJECT = "SUSE:SLFO:Bench"
+OBS_PROJECTS = ("Bench:Factory", "Bench:SLE-15:Update", "Bench:SLE-15:GA")
+SUBPROJECTS = 4
+# Time of the last execution, 1 in 10 origin packages was updated after it
+LAST_EXECUTION = 1700000000
+
+console = rich.console.Console()
+
+
+@click.command()
+@click.option(
+    "--origins",
+    default="100,1000,10000",
+    help="Comma-separated numbers of origin packages to benchmark.",
+)
+@click.option(
+    "--scenario",
+    "scenarios",
+    type=click.Choice(SCENARIOS),
+    multiple=True,
+    help="Scenario to run, can be used multiple times. Defaults to all.",
+)
+@click.option(
+    "--latency",
+    default=0.0,
+    help="Seconds the fake OBS API waits before each response.",
+)
+@click.option("--files", default=20, help="Number of files per OBS package.")
+@click.option(
+    "--git-share",
+    default=0.1,
+    help="Share of origin packages that are git-managed.",
+)
+@click.option(
+    "--search-packages",
+    default=100,
+    help="Number of packages to pass to subprojects-containing.",
+)
+@click.option(
+    "--bulk-queries",
+    default=False,
+    flag_value=True,
+    help="Set bulk_queries in the [obs] table.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Also write the results to this JSON file.",
+)
+def main(
+    origins,
+    scenarios,
+    latency,
+    files,
+    git_share,
+    search_packages,
+    bulk_queries,
+    output,
+):
+    """Benchmark lubed commands with synthetic origin packages."""
+    scenarios = scenarios or SCENARIOS
+    results = []
+    for count in (int(c) for c in origins.split(",")):
+        with tempfile.TemporaryDirectory() as tempdir:
+            origin_packages = _origins(count, git_share)
+            obs_server = FakeOBS(_projects(origin_packages), latency, files).start()
+            git_server = FakeGitServer(
+                os.path.join(tempdir, "git"),
+                {
+                    name: _mtime(i)
+                    for i, (project, name) in enumerate(origin_packages)
+                    if project == GIT_PROJECT
+                },
+                branch="slfo-bench",
+            ).start()
+            try:
+                config_path = os.path.join(tempdir, "config.toml")
+                _write_config(
+                    config_path,
+                    obs_server.url,
+                    git_server.url,
+                    origin_packages,
+                    bulk_queries,
+                )
+                for scenario in scenarios:
+                    obs_server.reset_counters()
+                    git_server.reset_counters()
+                    measured = _measure(
+                        scenario,
+                        config_path,
+                        [name for _, name in origin_packages[:search_packages]],
+                    )
+                    results.append(
+                        {
+                            "scenario": scenario,
+                            "origins": count,
+                            **measured,
+                            "obs_requests": obs_server.requests,
+                            "obs_bytes": obs_server.bytes_sent,
+                            "git_connections": git_server.requests,
+                            "git_bytes": git_server.bytes_sent,
+                        }
+                    )
+                    _print(results[-1])
+            finally:
+                git_server.stop()
+                obs_server.stop()
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    _print_table(results)
+
+
+def _origins(count: int, git_share: float) -> List[tuple]:
+    """Return (project, package) tuples, every 1/git_share-th one is git-managed."""
+    git_every = round(1 / git_share) if git_share else 0
+    origins = []
+    for i in range(count):
+        name = f"package-{i:05d}"
+        if git_every and i % git_every == 0:
+            origins.append((GIT_PROJECT, name))
+        else:
+            origins.append((OBS_PROJECTS[i % len(OBS_PROJECTS)], name))
+    return origins
+
+
+def _mtime(index: int) -> int:
+    if index % 10 == 0:
+        return LAST_EXECUTION + 3600
+    return LAST_EXECUTION - 86400
+
+
+def _projects(origin_packages: List[tuple]) -> Projects:
+    projects: Projects = {project: {} for project in OBS_PROJECTS}
+    for i, (project, name) in enumerate(origin_packages):
+        if project != GIT_PROJECT:
+            projects[project][name] = _mtime(i)
+
+    # The bundle contains all origins and a few packages that are not in the config
+    bundle_names = [_bundle_name(name) for _, name in origin_packages]
+    bundle_names += [f"extra-{i:05d}" for i in range(len(origin_packages) // 20)]
+    projects[BUNDLE_PROJECT] = dict.fromkeys(bundle_names, LAST_EXECUTION)
+    for i in range(SUBPROJECTS):
+        projects[f"{BUNDLE_PROJECT}:Sub{i}"] = dict.fromkeys(
+            [name for _, name in origin_packages[i::SUBPROJECTS]]
+            + bundle_names[i::SUBPROJECTS],
+            LAST_EXECUTION,
+        )
+    return projects
+
+
+def _bundle_name(name: str) -> str:
+    return f"saltbundle-{name}"
+
+
+def _write_config(
+    path: str,
+    api_url: str,
+    gitserver_url: str,
+    origin_packages: List[tuple],
+    bulk_queries: bool,
+) -> None:
+    # JSON strings are valid TOML basic strings
+    lines = [
+        "[obs]",
+        f"bundle_project = {json.dumps(BUNDLE_PROJECT)}",
+        f"api_baseurl = {json.dumps(api_url)}",
+        f"gitserver_baseurl = {json.dumps(gitserver_url)}",
+        f"git_managed_projects = [{json.dumps(GIT_PROJECT)}]",
+        f"bulk_queries = {json.dumps(bulk_queries)}",
+        "",
+        "[origins]",
+    ]
+    for project, name in origin_packages:
+        lines.append(
+            f"{json.dumps(_bundle_name(name))} = "
+            f"{{ project = {json.dumps(project)}, package = {json.dumps(name)} }}"
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _measure(scenario: str, config_path: str, packages: List[str]) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(
+        target=_run_scenario, args=(scenario, config_path, packages, queue)
+    )
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise click.ClickException(f"{scenario} failed: {result['error']}")
+    return result
+
+
+def _run_scenario(scenario, config_path, packages, queue):
+    """Run in a fresh process: execute `scenario` and report its measurements."""
+    # pylint: disable=import-outside-toplevel
+    from click.testing import CliRunner
+
+    from lubed import cli, config, core
+
+    os.environ.update({"OBSUSER": "bench", "OBSPASSWD": "bench"})
+    start = time.perf_counter()
+    try:
+        if scenario == "updates":
+            updates, failures = core.calculate_updated_packages(
+                LAST_EXECUTION, config.load(config_path)
+            )
+            details = f"{len(updates)} updates, {len(failures)} failures"
+        else:
+            args = ["--no-cache", scenario, "--config-path", config_path]
+            if scenario == "not-in-conf":
+                args.append("--search-subprojects")
+            else:
+                args.extend(packages)
+            result = CliRunner().invoke(cli.cli, args)
+            if result.exit_code != 0:
+                raise RuntimeError(result.output or repr(result.exception))
+            details = f"{len(result.output.splitlines())} lines of output"
+    except Exception as e:  # pylint: disable=broad-except
+        queue.put({"error": str(e)})
+        return
+    queue.put(
+        {
+            "wall_time": time.perf_counter() - start,
+            # KiB on Linux
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "details": details,
+        }
+    )
+
+
+def _print(result: Dict) -> None:
+    console.print(
+        f"{result['scenario']} with {result['origins']} origins: "
+        f"{result['wall_time']:.2f}s, {result['details']}"
+    )
+
+
+def _print_table(results: List[Dict]) -> None:
+    table = rich.table.Table(
+        "Scenario",
+        "Origins",
+        "Wall Time",
+        "OBS Requests",
+        "OBS Bytes",
+        "Git Connections",
+        "Git Bytes",
+        "Peak RSS",
+        title="Benchmark Results",
+        box=rich.box.SIMPLE,
+    )
+    for result in results:
+        table.add_row(
+            result["scenario"],
+            str(result["origins"]),
+            f"{result['wall_time']:.2f}s",
+            str(result["obs_requests"]),
+            f"{result['obs_bytes'] / 1024:.0f} KiB",
+            str(result["git_connections"]),
+            f"{result['git_bytes'] / 1024:.0f} KiB",
+            f"{result['peak_rss'] / 1024:.0f} MiB",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -5,7 +5,8 @@ from dataclasses import dataclass
 Timestamp = int
 
 
-@dataclass(frozen=True)
+# Configs can have thousands of origin packages, slots keep them small
+@dataclass(frozen=True, slots=True)
 class Package:
     project: str
     name: str
@@ -0,0 +1,139 @@
+"""Persistent cache for HTTP responses.
+
+Responses are stored in an SQLite database together with their ETag and
+Last-Modified headers, which are used to revalidate the cached copy with a
+conditional GET request.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# Entries that were not stored or revalidated for this long are evicted.
+DEFAULT_TTL = 14 * 24 * 60 * 60
+# Least recently used entries are evicted once all bodies exceed this size.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_path() -> pathlib.Path:
+    cache_home = os.getenv("XDG_CACHE_HOME", "~/.cache")
+    return pathlib.Path(cache_home).expanduser() / "lubed" / "http.sqlite"
+
+
+@dataclass(frozen=True)
+class Entry:
+    body: bytes
+    etag: str
+    last_modified: str
+
+
+class ResponseCache:
+    """SQLite backed response cache, safe to use from multiple threads.
+
+    The database is opened on first use, expired entries are evicted at that time.
+    Entries are also evicted whenever an insert takes the cache over `max_size`.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        ttl: int = DEFAULT_TTL,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._db: Optional[sqlite3.Connection] = None
+        # Total size of all bodies, as of the last eviction plus later inserts
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        query = "SELECT body, etag, last_modified FROM responses WHERE key = ?"
+        with self._lock:
+            row = self._conn().execute(query, (key,)).fetchone()
+        if row is None:
+            return None
+        return Entry(*row)
+
+    def put(self, key: str, entry: Entry) -> None:
+        now = int(time.time())
+        with self._lock, self._conn() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, entry.body, entry.etag, entry.last_modified, now, now),
+            )
+            # Replaced entries are counted twice until the next eviction recounts
+            self._size += len(entry.body)
+            if self._size > self.max_size:
+                self._evict(db)
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as revalidated."""
+        with self._lock, self._conn() as db:
+            db.execute(
+                "UPDATE responses SET validated = ?, accessed = ? WHERE key = ?",
+                (int(time.time()), int(time.time()), key),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn() as db:
+            db.execute("DELETE FROM responses")
+            self._size = 0
+        with self._lock:
+            self._conn().execute("VACUUM")
+
+    def evict(self) -> None:
+        """Remove expired entries, then the least recently used ones until the
+        total size is below `max_size`."""
+        with self._lock, self._conn() as db:
+            self._evict(db)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            with db:
+                db.execute(
+                    """CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        body BLOB NOT NULL,
+                        etag TEXT NOT NULL,
+                        last_modified TEXT NOT NULL,
+                        validated INTEGER NOT NULL,
+                        accessed INTEGER NOT NULL
+                    )"""
+                )
+                self._evict(db)
+            self._db = db
+        return self._db
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        db.execute(
+            "DELETE FROM responses WHERE validated < ?", (int(time.time()) - self.ttl,)
+        )
+        total = db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses")
+        self._size = total.fetchone()[0]
+        excess = self._size - self.max_size
+        if excess <= 0:
+            return
+        rows = db.execute(
+            "SELECT key, LENGTH(body) FROM responses ORDER BY accessed"
+        ).fetchall()
+        for key, size in rows:
+            if excess <= 0:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            excess -= size
+            self._size -= size
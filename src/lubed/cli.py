@@ -1,46 +1,144 @@
 """CLI entrypoint to lubed."""
 
 # SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Modules are imported by the commands that use them, so that short commands like
+# 'lubed init' don't load requests, rich or the GitHub clients, see tests/test_cli.py.
+# pylint: disable=import-outside-toplevel
+import functools
 import os
 import string
 import time
-from contextlib import suppress
+from contextlib import nullcontext, suppress
 from datetime import datetime
+from typing import Optional
 
 import click
-import rich.box
-import rich.console
-import rich.table
 
-from lubed import Timestamp, config, core, gh, obs
+from lubed import Timestamp, output
 
-console = rich.console.Console()
+
+@functools.cache
+def _console():
+    import rich.console
+
+    return rich.console.Console()
+
+
+@functools.cache
+def _stderr_console():
+    import rich.console
+
+    return rich.console.Console(stderr=True)
+
+
+def _diag_console():
+    """Console for errors and diagnostics, stderr if the command output is in a
+    machine-readable format."""
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and (ctx.obj or {}).get("output_format", "table") != "table":
+        return _stderr_console()
+    return _console()
+
+
+def _remember_format(ctx, _param, value):
+    ctx.ensure_object(dict)["output_format"] = value
+    return value
+
+
+_format_option = click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(output.FORMATS),
+    default="table",
+    callback=_remember_format,
+    help="Output format, see README.org for the fields of each format.",
+)
 
 
 @click.group()
-def cli():
-    ...
+@click.option(
+    "--no-cache",
+    default=False,
+    flag_value=True,
+    help="Do not use the persistent cache for OBS responses.",
+)
+@click.option(
+    "--profile",
+    default=False,
+    flag_value=True,
+    help="Print where the time was spent after the command finished.",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a trace of all remote calls to this file.",
+)
+@click.option(
+    "--trace-format",
+    type=click.Choice(["chrome", "otel"]),
+    default="chrome",
+    help="Format of --trace-file: Chrome trace events or OpenTelemetry JSON.",
+)
+@click.pass_context
+def cli(ctx, no_cache, profile, trace_file, trace_format):
+    ctx.ensure_object(dict)["no_cache"] = no_cache
+    if profile or trace_file:
+        from lubed import trace
+
+        trace.enable()
+        ctx.call_on_close(lambda: _finish_trace(profile, trace_file, trace_format))
+
+
+@cli.group(name="cache")
+def cache_group():
+    """Manage the persistent cache for OBS responses."""
+
+
+@cache_group.command()
+def clear():
+    """Remove all cached responses, parsed config files and resolved link chains."""
+    import shutil
+
+    from lubed import cache, config, links
+
+    response_cache = cache.ResponseCache(cache.default_path())
+    response_cache.clear()
+    response_cache.close()
+    shutil.rmtree(config.default_cache_dir(), ignore_errors=True)
+    with suppress(FileNotFoundError):
+        links.default_path().unlink()
+    _console().print(
+        f"Cleared {response_cache.path}, {config.default_cache_dir()} and "
+        f"{links.default_path()}"
+    )
 
 
 @cli.command()
 @click.option("--last-timestamp-file", type=click.Path(), default=".last_execution")
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    default=".lubed_state.json",
+    help="File containing the state of the last execution.",
+)
 @click.option(
     "--force",
     default=False,
     flag_value=True,
-    help="Override existing --last-timestamp-file",
-)
-def init(last_timestamp_file, force):
-    """Initialize the last-timestamp-file with the current time."""
-    with suppress(FileNotFoundError), open(
-        last_timestamp_file, "r", encoding="utf-8"
-    ) as f:
-        if f.read() and not force:
-            console.print(f"Use --force to override {last_timestamp_file}.")
-            exit(3)
+    help="Override existing --last-timestamp-file and --state-file",
+)
+def init(last_timestamp_file, state_file, force):
+    """Initialize the last-timestamp-file and state-file with the current time."""
+    from lubed import state
+
+    for path in (last_timestamp_file, state_file):
+        with suppress(FileNotFoundError), open(path, "r", encoding="utf-8") as f:
+            if f.read() and not force:
+                _console().print(f"Use --force to override {path}.")
+                exit(3)
     now = Timestamp(time.time())
-    with open(last_timestamp_file, "w", encoding="utf-8") as f:
-        f.write(str(now))
+    _save_state(state.StateStore(state_file), False, last_timestamp_file, now)
 
 
 @cli.command()
@@ -62,45 +160,83 @@ def init(last_timestamp_file, force):
     multiple=True,
     help="Exclude all subprojects that contain the specified string. Can be used multiple times.",
 )
-def not_in_conf(config_path, search_subprojects, exclude_subproject) -> None:
+@_format_option
+def not_in_conf(
+    config_path, search_subprojects, exclude_subproject, output_format
+) -> None:
     """List packages missing from the [origins] table in the config file."""
-    conf = config.load(config_path)
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lubed import config, core, obs, output
+
+    conf = _load_config(config_path)
     project_name = conf["obs"]["bundle_project"]
     api_url = conf["obs"]["api_baseurl"]
     try:
         credentials = config.credentials(api_url)
     except config.OSCError as e:
-        console.print(f"Can't fall back to oscrc for authentication:\n{e}")
+        _diag_console().print(f"Can't fall back to oscrc for authentication:\n{e}")
         exit(5)
 
-    with console.status("Gathering projects...", spinner="arc"):
+    with _status("Gathering projects...", output_format):
         projects = [project_name]
         if search_subprojects:
             projects.extend(obs.list_subprojects(project_name, credentials, api_url))
-
-    project_packages = {}
-    with console.status("Gathering packages...", spinner="arc"):
-        for project in projects:
-            if any(excluded in project for excluded in exclude_subproject):
-                continue
-            project_packages.setdefault(project, []).extend(
-                obs.list_packages(project, credentials, api_url)
-            )
-            if "venv-salt-minion" in project_packages[project]:
-                project_packages[project].remove("venv-salt-minion")
-
-    table = rich.table.Table(
-        title=f"Packages missing from {click.format_filename(config_path)}",
-        box=rich.box.SIMPLE,
+    # The subproject search also returns the project itself
+    projects = [
+        project
+        for project in dict.fromkeys(projects)
+        if not any(excluded in project for excluded in exclude_subproject)
+    ]
+
+    if output_format == "table":
+        import rich.box
+        import rich.live
+        import rich.table
+
+        table = rich.table.Table(
+            title=f"Packages missing from {click.format_filename(config_path)}",
+            box=rich.box.SIMPLE,
+        )
+        table.add_column("Project")
+        table.add_column("Package")
+        live = rich.live.Live(table, console=_console())
+        add_row = table.add_row
+    else:
+        writer = output.Writer(output_format, output.PACKAGE_FIELDS)
+        live = nullcontext()
+        add_row = writer.write
+
+    max_workers = conf.get("concurrency", {}).get(
+        "obs_requests", core.DEFAULT_CONCURRENCY["obs_requests"]
     )
-    table.add_column("Project")
-    table.add_column("Package")
 
-    for project, packages in project_packages.items():
-        for package in packages:
-            if package not in conf["origins"]:
-                table.add_row(project, package)
-    console.print(table)
+    def list_packages(project):
+        try:
+            return obs.list_packages(project, credentials, api_url)
+        except Exception as e:  # pylint: disable=broad-except
+            return e
+
+    failed = []
+    # Rows are added in the order of the projects, as soon as the package lists of
+    # a project and all projects before it arrived
+    with live, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for project, listed in zip(projects, executor.map(list_packages, projects)):
+            if isinstance(listed, Exception):
+                failed.append((project, listed))
+                continue
+            for package in sorted(listed):
+                if package != "venv-salt-minion" and package not in conf["origins"]:
+                    add_row(project, package)
+    if output_format != "table":
+        writer.close()
+    for project, e in failed:
+        # Project names can contain ":b:" and other emoji codes
+        _diag_console().print(
+            f"Could not list the packages of {project}: {e}", emoji=False, markup=False
+        )
+    if failed:
+        exit(1)
 
 
 @cli.command()
@@ -117,35 +253,85 @@ def not_in_conf(config_path, search_subprojects, exclude_subproject) -> None:
     help="Exclude all subprojects that contain the specified string. Can be used multiple times.",
 )
 @click.argument("packages", nargs=-1)
-def subprojects_containing(config_path, exclude_subproject, packages) -> None:
+@_format_option
+def subprojects_containing(
+    config_path, exclude_subproject, packages, output_format
+) -> None:
     """List all subprojects that contain the specified packages."""
-    conf = config.load(config_path)
+    from lubed import config, core, obs, output
+
+    conf = _load_config(config_path)
     project_name = conf["obs"]["bundle_project"]
     api_url = conf["obs"]["api_baseurl"]
     try:
         credentials = config.credentials(api_url)
     except config.OSCError as e:
-        console.print(f"Can't fall back to oscrc for authentication:\n{e}")
+        _diag_console().print(f"Can't fall back to oscrc for authentication:\n{e}")
         exit(5)
 
-    with console.status("Gathering projects...", spinner="arc"):
-        projects = [project_name] + obs.list_subprojects(
-            project_name, credentials, api_url
-        )
-
-    table = rich.table.Table(box=rich.box.SIMPLE)
-    table.add_column("Package")
-    table.add_column("Project")
-
-    with console.status("Checking projects for packages...", spinner="arc"):
-        for package in packages:
-            for project in projects:
-                if any(excluded in project for excluded in exclude_subproject):
-                    continue
+    with _status("Searching projects for packages...", output_format):
+        found = obs.projects_containing(packages, project_name, credentials, api_url)
+
+    if found is None:
+        with _status("Checking projects for packages...", output_format):
+            found = _probe_projects(
+                packages,
+                project_name,
+                exclude_subproject,
+                credentials,
+                api_url,
+                max_workers=conf.get("concurrency", {}).get(
+                    "obs_requests", core.DEFAULT_CONCURRENCY["obs_requests"]
+                ),
+            )
 
-                if obs.package_in_project(package, project, credentials, api_url):
-                    table.add_row(package, project)
-    console.print(table)
+    rows = [
+        (package, project)
+        for package in packages
+        for project in found[package]
+        if not any(excluded in project for excluded in exclude_subproject)
+    ]
+    if output_format == "table":
+        import rich.box
+        import rich.table
+
+        table = rich.table.Table(box=rich.box.SIMPLE)
+        table.add_column("Package")
+        table.add_column("Project")
+        for row in rows:
+            table.add_row(*row)
+        _console().print(table)
+    else:
+        writer = output.Writer(output_format, output.PACKAGE_FIELDS)
+        for package, project in rows:
+            writer.write(project, package)
+        writer.close()
+
+
+def _probe_projects(
+    packages, project_name, exclude_subproject, credentials, api_url, max_workers
+):
+    """Check every subproject for every package, concurrently."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from lubed import obs
+
+    projects = [project_name] + obs.list_subprojects(project_name, credentials, api_url)
+    probes = [
+        (package, project)
+        for package in packages
+        for project in projects
+        if not any(excluded in project for excluded in exclude_subproject)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as e:
+        contained = e.map(
+            lambda probe: obs.package_in_project(*probe, credentials, api_url), probes
+        )
+        found = {package: [] for package in packages}
+        for (package, project), is_contained in zip(probes, contained):
+            if is_contained:
+                found[package].append(project)
+    return found
 
 
 @cli.command()
@@ -155,6 +341,13 @@ def subprojects_containing(config_path, exclude_subproject, packages) -> None:
     default=".last_execution",
     help="File containing the last execution time in Unix time format.",
 )
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    default=".lubed_state.json",
+    help="File containing the state of the last execution. Created from "
+    "--last-timestamp-file if it doesn't exist.",
+)
 @click.option(
     "--config-path",
     type=click.Path(exists=True, dir_okay=False),
@@ -167,28 +360,119 @@ def subprojects_containing(config_path, exclude_subproject, packages) -> None:
     flag_value=True,
     help="Do not update the last execution timestamp.",
 )
-def updates(last_timestamp_file, config_path, no_update_timestamp) -> None:
+@click.option(
+    "--retry-failed",
+    default=False,
+    flag_value=True,
+    help="Only check packages that failed to check in previous executions. "
+    "Does not update the last execution timestamp.",
+)
+@click.option(
+    "--shard",
+    callback=lambda ctx, param, value: _parse_shard(value),
+    help="Only check the origins of the i-th of N shards, e.g. 2/4. Origins are "
+    "assigned to shards by a stable hash of their bundle package name. Does not "
+    "update the state file, see 'lubed merge'.",
+)
+@click.option(
+    "--results",
+    "results_file",
+    type=click.Path(dir_okay=False),
+    help="Also write the updates and failures to this file, see 'lubed merge'.",
+)
+@_format_option
+def updates(
+    last_timestamp_file,
+    state_file,
+    config_path,
+    no_update_timestamp,
+    retry_failed,
+    shard,
+    results_file,
+    output_format,
+) -> None:
     """List all packages that were updated in their origin since last execution."""
-    with open(last_timestamp_file, "r", encoding="utf-8") as f:
-        last_timestamp = Timestamp(f.read())
-    conf = config.load(config_path)
+    from lubed import config, core, output, results
+
+    state_store = _load_state(state_file, last_timestamp_file)
+    last_timestamp = state_store.last_execution
+    conf = _load_config(config_path)
     now = Timestamp(time.time())
 
-    with console.status("Checking for updates...", spinner="arc"):
+    writer = None
+    if output_format != "table":
+        writer = output.Writer(output_format, output.UPDATE_FIELDS)
+
+    sources = {}
+
+    def source_of(bundle_name):
+        source = sources.get(bundle_name)
+        return f"{source.project}/{source.name}" if source else ""
+
+    def on_result(status, row):
+        writer.write(status, *row, source_of(row[0]))
+
+    # Streamed as each check completes, JSON is written at once in the order of the
+    # config file
+    streaming = output_format in ("ndjson", "csv")
+
+    with _status("Checking for updates...", output_format):
         try:
             updated_pkgs, failures = core.calculate_updated_packages(
-                last_execution=last_timestamp, conf=conf
+                last_execution=last_timestamp,
+                conf=conf,
+                state=state_store,
+                retry_failed=retry_failed,
+                on_result=on_result if streaming else None,
+                shard=shard,
+                sources=sources,
             )
         except RuntimeError as e:
-            console.print(e)
+            _diag_console().print(e)
             exit(5)
 
-    _print_table(title="Packages Updated in Origin", packages=updated_pkgs)
+    if results_file:
+        checked = [
+            package
+            for bundle_name, package in config.origins(conf).items()
+            if shard is None or results.in_shard(bundle_name, shard)
+        ]
+        results.save(
+            results_file,
+            results.Results(
+                last_timestamp,
+                shard or (1, 1),
+                updated_pkgs,
+                failures,
+                checked_at=now,
+                packages=state_store.entries(checked),
+                cursor=state_store.next_cursor,
+            ),
+        )
 
-    if failures:
-        _print_table(title="Packages that Failed to Check", packages=failures)
+    if writer is None:
+        _print_table(
+            title="Packages Updated in Origin",
+            packages=updated_pkgs,
+            sources=[source_of(row[0]) for row in updated_pkgs] if sources else None,
+        )
 
-    _maybe_update_timestamp(no_update_timestamp, last_timestamp_file, now)
+        if failures:
+            _print_table(title="Packages that Failed to Check", packages=failures)
+
+        _print_retry_stats()
+    else:
+        if output_format == "json":
+            for row in updated_pkgs:
+                writer.write("updated", *row, source_of(row[0]))
+            for row in failures:
+                writer.write("failed", *row)
+        writer.close()
+    if shard is None:
+        # Shards are committed once, from their merged results
+        _save_state(
+            state_store, no_update_timestamp or retry_failed, last_timestamp_file, now
+        )
 
 
 @cli.command()
@@ -198,6 +482,13 @@ def updates(last_timestamp_file, config_path, no_update_timestamp) -> None:
     default=".last_execution",
     help="File containing the last execution time in Unix time format.",
 )
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    default=".lubed_state.json",
+    help="File containing the state of the last execution. Created from "
+    "--last-timestamp-file if it doesn't exist.",
+)
 @click.option(
     "--config-path",
     type=click.Path(exists=True, dir_okay=False),
@@ -215,11 +506,36 @@ def updates(last_timestamp_file, config_path, no_update_timestamp) -> None:
     flag_value=True,
     help="Do not update the last execution timestamp.",
 )
-def create_issue(last_timestamp_file, config_path, gh_token, no_update_timestamp):
+@click.option(
+    "--update-existing",
+    type=click.Choice(["off", "edit", "comment"]),
+    help="Update the open issue with the same title and labels instead of "
+    "creating a new one: edit its body, or edit it and comment with the new rows. "
+    "Defaults to update_existing in the [github.issue] table.",
+)
+@click.option(
+    "--results",
+    "results_files",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Take the updates from the result files of all shards instead of checking "
+    "for updates, see 'lubed merge'. Can be used multiple times.",
+)
+def create_issue(
+    last_timestamp_file,
+    state_file,
+    config_path,
+    gh_token,
+    no_update_timestamp,
+    update_existing,
+    results_files,
+):
     """Create a GitHub issue which includes the list of needed updates."""
-    with open(last_timestamp_file, "r", encoding="utf-8") as f:
-        last_timestamp = Timestamp(f.read())
-    conf = config.load(config_path)
+    from lubed import core, gh
+
+    state_store = _load_state(state_file, last_timestamp_file)
+    last_timestamp = state_store.last_execution
+    conf = _load_config(config_path)
     gh_repo = conf["github"]["repo"]
     gh_project_board_id = conf["github"]["project_board_id"]
     issue_title = conf["github"]["issue"]["title"]
@@ -228,55 +544,324 @@ def create_issue(last_timestamp_file, config_path, gh_token, no_update_timestamp
 
     now = Timestamp(time.time())
     now_human_readable = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%S")
-    last_execution_human_readable = datetime.utcfromtimestamp(last_timestamp).strftime(
-        "%Y-%m-%dT%H:%M:%S"
-    )
 
     if not gh_token:
-        console.print("Please provide a GitHub OAuth token")
+        _diag_console().print("Please provide a GitHub OAuth token")
         exit(4)
 
-    with console.status("Checking for updates...", spinner="arc"):
-        try:
-            updated_pkgs, failures = core.calculate_updated_packages(
-                last_execution=last_timestamp, conf=conf
+    if results_files:
+        merged = _merge_results(results_files, conf)
+        last_timestamp = merged.last_execution
+        updated_pkgs, failures = merged.updates, merged.failures
+        now = _apply_results(state_store, merged, now)
+    else:
+        with _console().status("Checking for updates...", spinner="arc"):
+            try:
+                updated_pkgs, failures = core.calculate_updated_packages(
+                    last_execution=last_timestamp, conf=conf, state=state_store
+                )
+            except RuntimeError as e:
+                _diag_console().print(e)
+                exit(5)
+        _print_retry_stats()
+
+    if update_existing is None:
+        update_existing = conf["github"]["issue"].get("update_existing", "off")
+    existing = None
+    if update_existing != "off":
+        with _console().status("Searching for an open issue...", spinner="arc"):
+            existing = gh.find_open_issue(
+                gh_repo, issue_title, gh_token, label_names=issue_labels
             )
-        except RuntimeError as e:
-            console.print(e)
-            exit(5)
 
-    issue_body = issue_body_template.substitute(
-        {
-            "last_execution": last_execution_human_readable,
-            "updates": gh.format_updates_md(updated_pkgs, failures),
-            "last_execution_ts": last_timestamp,
-            "now": now_human_readable,
-        }
+    def render_body(snapshot):
+        since = datetime.utcfromtimestamp(snapshot.since).strftime("%Y-%m-%dT%H:%M:%S")
+        body = issue_body_template.substitute(
+            {
+                "last_execution": since,
+                "updates": gh.format_updates_md(snapshot.updates, snapshot.failures),
+                "last_execution_ts": snapshot.since,
+                "now": now_human_readable,
+            }
+        )
+        return gh.embed_snapshot(body, snapshot)
+
+    if existing is None:
+        snapshot = gh.Snapshot(last_timestamp, updated_pkgs, failures)
+        with _console().status("Creating issue...", spinner="arc"):
+            issue = gh.create_issue_in_board(
+                repo_name=gh_repo,
+                title=issue_title,
+                body=render_body(snapshot),
+                label_names=issue_labels,
+                gh_token=gh_token,
+                board_id=gh_project_board_id,
+            )
+        _console().print(f"View the issue at {issue.html_url}")
+    else:
+        # Issues without a snapshot, e.g. created by older versions, are treated as
+        # empty and cover the updates since this run's last execution.
+        previous = gh.extract_snapshot(existing.body)
+        if previous is None:
+            previous = gh.Snapshot(last_timestamp)
+        merged, delta = gh.merge_snapshot(previous, updated_pkgs, failures)
+        if not delta and merged.failures == previous.failures:
+            _console().print(f"No new updates for the issue at {existing.html_url}")
+        else:
+            comment = ""
+            if update_existing == "comment":
+                comment = gh.format_updates_md(delta.updates, delta.failures)
+                comment = f"New at {now_human_readable}:\n\n{comment}"
+            with _console().status("Updating issue...", spinner="arc"):
+                gh.update_issue(existing, render_body(merged), gh_token, comment)
+            _console().print(f"Updated the issue at {existing.html_url}")
+    _save_state(state_store, no_update_timestamp, last_timestamp_file, now)
+
+
+@cli.command()
+@click.option(
+    "--config-path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=os.path.dirname(__file__) + "/config.toml",
+    help="Config file location, TOML format. Rows are listed in its order.",
+)
+@click.option(
+    "--results",
+    "results_file",
+    type=click.Path(dir_okay=False),
+    help="Also write the merged updates and failures to this file.",
+)
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    help="Commit the merged results to this state file, like an unsharded "
+    "'lubed updates' run.",
+)
+@click.option(
+    "--last-timestamp-file",
+    type=click.Path(),
+    default=".last_execution",
+    help="File containing the last execution time in Unix time format.",
+)
+@click.option(
+    "--no-update-timestamp",
+    default=False,
+    flag_value=True,
+    help="Do not update the last execution timestamp in --state-file.",
+)
+@_format_option
+@click.argument("results_files", nargs=-1, required=True, type=click.Path(exists=True))
+def merge(
+    config_path,
+    results_file,
+    state_file,
+    last_timestamp_file,
+    no_update_timestamp,
+    output_format,
+    results_files,
+) -> None:
+    """Combine the result files of all shards of 'lubed updates --shard'."""
+    from lubed import output, results
+
+    merged = _merge_results(results_files, _load_config(config_path))
+    if results_file:
+        results.save(results_file, merged)
+    if state_file:
+        state_store = _load_state(state_file, last_timestamp_file)
+        now = _apply_results(state_store, merged, Timestamp(time.time()))
+        _save_state(state_store, no_update_timestamp, last_timestamp_file, now)
+
+    if output_format == "table":
+        _print_table(title="Packages Updated in Origin", packages=merged.updates)
+        if merged.failures:
+            _print_table(
+                title="Packages that Failed to Check", packages=merged.failures
+            )
+    else:
+        writer = output.Writer(output_format, output.UPDATE_FIELDS)
+        for row in merged.updates:
+            writer.write("updated", *row)
+        for row in merged.failures:
+            writer.write("failed", *row)
+        writer.close()
+
+
+def _parse_shard(value):
+    from lubed import results
+
+    if value is None:
+        return None
+    try:
+        return results.parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+def _apply_results(state_store, merged, now):
+    """Take the package states and feed cursor of merged shard results into
+    `state_store`.
+
+    :return: The time to commit as the last execution
+    """
+    if merged.last_execution != state_store.last_execution:
+        _diag_console().print(
+            f"The results were checked against the last execution "
+            f"{merged.last_execution}, the state file is at "
+            f"{state_store.last_execution}."
+        )
+    state_store.update(merged.packages)
+    if merged.cursor is not None:
+        state_store.next_cursor = merged.cursor
+    return merged.checked_at or now
+
+
+def _merge_results(results_files, conf):
+    from lubed import config, results
+
+    try:
+        return results.merge(
+            (results.load(path) for path in results_files),
+            order=config.origins(conf),
+        )
+    except results.ResultsError as e:
+        _diag_console().print(e)
+        exit(5)
+
+
+@cli.command()
+@click.option(
+    "--last-timestamp-file",
+    type=click.Path(),
+    default=".last_execution",
+    help="File containing the last execution time in Unix time format.",
+)
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False),
+    default=".lubed_state.json",
+    help="File containing the state of the last execution, it's only read.",
+)
+@click.option(
+    "--config-path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=os.path.dirname(__file__) + "/config.toml",
+    help="Config file location, TOML format",
+)
+@click.option(
+    "--interval",
+    type=click.IntRange(min=1),
+    default=900,
+    help="Seconds between the start of two checks.",
+)
+@click.option("--address", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", type=int, default=9464, help="Port to listen on.")
+def serve(last_timestamp_file, state_file, config_path, interval, address, port):
+    """Check for updates periodically and expose the results as Prometheus metrics.
+
+    Updates are counted since the last execution of 'lubed updates' or 'lubed
+    create-issue', the state file is not changed.
+    """
+    from lubed import config, core, metrics, obs, state, trace
+
+    _load_state(state_file, last_timestamp_file)
+    conf = _load_config(config_path)
+    origins = config.origins(conf)
+    collected = metrics.Metrics()
+    server = metrics.start_server(collected, address, port)
+    _console().print(
+        f"Serving metrics on http://{address}:{server.server_port}/metrics"
     )
 
-    with console.status("Creating issue...", spinner="arc"):
-        issue = gh.create_issue_in_board(
-            repo_name=gh_repo,
-            title=issue_title,
-            body=issue_body,
-            label_names=issue_labels,
-            gh_token=gh_token,
-            board_id=gh_project_board_id,
+    try:
+        while True:
+            started = time.monotonic()
+            obs.clear_caches()
+            trace.enable()
+            try:
+                state_store = state.StateStore.load(state_file, last_timestamp_file)
+                updated_pkgs, failures = core.calculate_updated_packages(
+                    last_execution=state_store.last_execution,
+                    conf=conf,
+                    state=state_store,
+                )
+            except (OSError, RuntimeError) as e:
+                _diag_console().print(f"Check failed: {e}")
+                collected.record_error()
+            else:
+                collected.record_cycle(
+                    [package.project for package in origins.values()],
+                    updated_pkgs,
+                    failures,
+                    trace.spans(),
+                    time.monotonic() - started,
+                )
+                _console().print(
+                    f"{datetime.now():%Y-%m-%dT%H:%M:%S}: {len(updated_pkgs)} "
+                    f"updates, {len(failures)} failures"
+                )
+            finally:
+                trace.disable()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        _print_retry_stats()
+
+
+def _status(message: str, output_format: str):
+    """Show a spinner while the block runs, only with table output."""
+    if output_format != "table":
+        return nullcontext()
+    return _console().status(message, spinner="arc")
+
+
+def _load_config(config_path):
+    from lubed import cache, config, links, ratelimit, retry, transport
+
+    no_cache = click.get_current_context().obj["no_cache"]
+    try:
+        conf = config.load(
+            config_path, cache_dir=None if no_cache else config.default_cache_dir()
+        )
+    except config.ConfigError as e:
+        _diag_console().print(f"Invalid config file {config_path}: {e}")
+        exit(2)
+    retry.configure(**conf.get("retry", {}))
+    ratelimit.configure(**conf.get("rate_limit", {}))
+    if not no_cache:
+        links.use_cache(links.default_path())
+        transport.use_cache(
+            cache.ResponseCache(cache.default_path(), **conf.get("cache", {}))
         )
+    return conf
+
+
+def _load_state(state_file, last_timestamp_file):
+    from lubed import state
+
+    try:
+        return state.StateStore.load(state_file, last_timestamp_file)
+    except FileNotFoundError:
+        _diag_console().print(f"{state_file} not found, please run 'lubed init' first.")
+        exit(3)
 
-    console.print(f"View the issue at {issue.html_url}")
-    _maybe_update_timestamp(no_update_timestamp, last_timestamp_file, now)
 
+def _save_state(state_store, no_update_timestamp, last_timestamp_file, current_time):
+    if not no_update_timestamp:
+        # Written before the state file, the state file is only overridden by
+        # timestamp files that are modified later.
+        with open(last_timestamp_file, "w", encoding="utf-8") as f:
+            f.write(str(current_time))
+        state_store.commit(current_time)
 
-def _maybe_update_timestamp(no_update_timestamp, last_timestamp_file, current_time):
-    if no_update_timestamp:
-        exit(0)
+    state_store.save()
 
-    with open(last_timestamp_file, "w", encoding="utf-8") as f:
-        f.write(str(current_time))
 
+def _print_table(title: str, packages: list, sources: Optional[list] = None):
+    import rich.box
+    import rich.table
 
-def _print_table(title: str, packages: list):
     table = rich.table.Table(
         "Bundle Package Name",
         "Origin Project Name",
@@ -284,7 +869,127 @@ def _print_table(title: str, packages: list):
         title=title,
         box=rich.box.SIMPLE,
     )
-    for package in packages:
-        table.add_row(*package)
+    if sources is not None:
+        table.add_column("Changed Source")
+    for index, package in enumerate(packages):
+        table.add_row(*package, *([sources[index]] if sources is not None else []))
+
+    _console().print(table)
+
+
+def _print_retry_stats():
+    import statistics
+
+    import rich.box
+    import rich.table
+
+    from lubed import retry
 
-    console.print(table)
+    stats = retry.stats()
+    if not any(s.retries or s.rejected for s in stats.values()):
+        return
+
+    table = rich.table.Table(
+        "Host",
+        "Calls",
+        "Retries",
+        "Failures",
+        "Rejected",
+        "Median Latency",
+        "Max Latency",
+        title="Remote Calls",
+        box=rich.box.SIMPLE,
+    )
+    for host, host_stats in sorted(stats.items()):
+        latencies = host_stats.latencies or [0.0]
+        table.add_row(
+            host,
+            str(host_stats.calls),
+            str(host_stats.retries),
+            str(host_stats.failures),
+            str(host_stats.rejected),
+            f"{statistics.median(latencies):.2f}s",
+            f"{max(latencies):.2f}s",
+        )
+    _diag_console().print(table)
+
+
+def _finish_trace(profile: bool, trace_file: str, trace_format: str):
+    from lubed import trace
+
+    trace.disable()
+    if trace_file:
+        if trace_format == "otel":
+            trace.export_otel(trace_file)
+        else:
+            trace.export_chrome(trace_file)
+    if profile:
+        _print_profile(trace.spans())
+
+
+def _print_profile(spans):
+    import rich.box
+    import rich.table
+
+    from lubed import trace
+
+    groups = {}
+    for span in spans:
+        name = span.name
+        if name == "check":
+            name = f"check ({span.attributes['backend']})"
+        groups.setdefault(name, []).append(span)
+
+    table = rich.table.Table(
+        "Operation",
+        "Calls",
+        "Total",
+        "p50",
+        "p95",
+        "Max",
+        "Bytes",
+        "Cache Hits",
+        "Errors",
+        title="Profile",
+        box=rich.box.SIMPLE,
+    )
+    for name, group in sorted(groups.items()):
+        durations = [span.duration / 1e9 for span in group]
+        table.add_row(
+            name,
+            str(len(group)),
+            f"{sum(durations):.2f}s",
+            f"{trace.percentile(durations, 50):.3f}s",
+            f"{trace.percentile(durations, 95):.3f}s",
+            f"{max(durations):.3f}s",
+            str(sum(span.attributes.get("bytes", 0) for span in group)),
+            str(
+                sum(
+                    span.attributes.get("cache") in ("memory", "revalidated")
+                    for span in group
+                )
+            ),
+            str(sum("error" in span.attributes for span in group)),
+        )
+    _diag_console().print(table)
+
+    checks = sorted(
+        (span for span in spans if span.name == "check"),
+        key=lambda span: span.duration,
+        reverse=True,
+    )
+    if checks:
+        table = rich.table.Table(
+            "Origin Package",
+            "Backend",
+            "Duration",
+            title="Slowest Packages",
+            box=rich.box.SIMPLE,
+        )
+        for span in checks[:10]:
+            table.add_row(
+                span.attributes["package"],
+                span.attributes["backend"],
+                f"{span.duration / 1e9:.3f}s",
+            )
+        _diag_console().print(table)
@@ -1,28 +1,159 @@
 """Interface to lubed configuration.
 
-Most users of this module only need two functions:
+Most users of this module only need three functions:
 - load(<filename>) to obtain the full config
+- origins(<config>) to obtain the origin packages of the config
 - credentials(<apiurl>) to obtain OBS credentials for an API server
 """
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import base64
+import bz2
 import configparser
+import functools
+import hashlib
+import json
 import os
 import pathlib
+import tempfile
+import urllib.parse
+from collections.abc import Mapping
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
 
 import tomli
 
-from lubed import OBSCredentials
+from lubed import OBSCredentials, Package, trace
 
 
-def load(filename: str) -> dict:
-    """Read a TOML config file."""
-    if os.path.exists(filename):
+class ConfigError(Exception):
+    ...
+
+
+def default_cache_dir() -> pathlib.Path:
+    """Directory of parsed config files, see `load`."""
+    cache_home = os.getenv("XDG_CACHE_HOME", "~/.cache")
+    return pathlib.Path(cache_home).expanduser() / "lubed" / "config"
+
+
+def load(filename: str, cache_dir: Optional[pathlib.Path] = None) -> dict:
+    """Read and validate a TOML config file.
+
+    With a `cache_dir`, the parsed config is stored there as JSON. Later calls return
+    it without parsing and validating the TOML again, as long as the file's
+    modification time and size, or else its content, are unchanged.
+
+    :raises ConfigError: The [origins] table is invalid
+    """
+    if not os.path.exists(filename):
+        return {}
+    if cache_dir is None:
         with open(filename, "rb") as f:
-            return tomli.load(f)
+            return _validated(tomli.load(f))
+
+    cache_file = cache_dir / (
+        hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest() + ".json"
+    )
+    stat = os.stat(filename)
+    cached = _read_cached(cache_file)
+    if (cached.get("mtime_ns"), cached.get("size")) == (stat.st_mtime_ns, stat.st_size):
+        return cached["config"]
+
+    with open(filename, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if cached.get("sha256") == digest:
+        conf = cached["config"]
     else:
+        conf = _validated(tomli.loads(content.decode("utf-8")))
+    _write_cached(
+        cache_file,
+        {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "config": conf,
+        },
+    )
+    return conf
+
+
+def _validated(conf: dict) -> dict:
+    for bundle_name, origin in conf.get("origins", {}).items():
+        if not isinstance(origin, dict) or not all(
+            isinstance(origin.get(key), str) for key in ("project", "package")
+        ):
+            raise ConfigError(
+                f"[origins.{bundle_name}] needs a project and a package string"
+            )
+    return conf
+
+
+def _read_cached(cache_file: pathlib.Path) -> dict:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
         return {}
+    return cached if isinstance(cached, dict) else {}
+
+
+def _write_cached(cache_file: pathlib.Path, cached: dict) -> None:
+    # Written to a temporary file first, concurrent readers never see partial files.
+    # Configs that JSON can't represent, e.g. with TOML dates, are not cached.
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(cached)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=cache_file.parent, delete=False
+        ) as f:
+            f.write(data)
+        os.replace(f.name, cache_file)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+class Origins(Mapping):
+    """The [origins] table, compiled to packages.
+
+    Maps bundle package names to :class:`lubed.Package`, in the order of the config
+    file. Packages are also grouped by their origin project in `by_project`.
+    """
+
+    __slots__ = ("_packages", "by_project", "git_managed_projects")
+
+    def __init__(self, conf: dict):
+        self.git_managed_projects: FrozenSet[str] = frozenset(
+            conf.get("obs", {}).get("git_managed_projects", ())
+        )
+        self._packages: Dict[str, Package] = {
+            bundle_name: Package(
+                project=origin["project"],
+                name=origin["package"],
+                git_managed=origin["project"] in self.git_managed_projects,
+            )
+            for bundle_name, origin in conf.get("origins", {}).items()
+        }
+        by_project: Dict[str, List[Package]] = {}
+        for package in self._packages.values():
+            by_project.setdefault(package.project, []).append(package)
+        self.by_project: Dict[str, Tuple[Package, ...]] = {
+            project: tuple(packages) for project, packages in by_project.items()
+        }
+
+    def __getitem__(self, bundle_name: str) -> Package:
+        return self._packages[bundle_name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._packages)
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+
+def origins(conf: dict) -> Origins:
+    """Compile the [origins] table of `conf`."""
+    return Origins(conf)
 
 
 def credentials(apiurl: str) -> OBSCredentials:
@@ -32,8 +163,13 @@ def credentials(apiurl: str) -> OBSCredentials:
     - OBSUSER for the username
     - OBSPASSWD for the password
 
-    Reading from an oscrc only works if the password is listed in clear text. It's
-    recommended to use environment variables.
+    Passwords in an oscrc are read if they are listed in clear text, obfuscated, or
+    stored in a keyring by osc's keyring credentials manager. The keyring is only used
+    if the optional `keyring` package is installed, e.g. with the `lubed[keyring]`
+    extra. It's recommended to use environment variables.
+
+    Credentials are resolved once per process and shared by all backends, until the
+    environment variables or the oscrc change.
 
     Args:
       apiurl: OBS API url, used to read the credentials from the correct section in an
@@ -43,13 +179,33 @@ def credentials(apiurl: str) -> OBSCredentials:
     Raises:
       OSCError
     """
-    obs_username = os.getenv("OBSUSER")
-    obs_password = os.getenv("OBSPASSWD")
-    if not obs_username:
-        obs_username = oscrc(apiurl, "user")
+    oscrc_path = _oscrc_path()
+    return _credentials(
+        apiurl,
+        os.getenv("OBSUSER"),
+        os.getenv("OBSPASSWD"),
+        str(oscrc_path) if oscrc_path else None,
+        _mtime_ns(oscrc_path),
+    )
+
+
+@functools.lru_cache
+def _credentials(
+    apiurl: str,
+    obs_username: Optional[str],
+    obs_password: Optional[str],
+    oscrc_path: Optional[str],
+    oscrc_mtime_ns: int,
+) -> OBSCredentials:
+    with trace.span("config.credentials", apiurl=apiurl) as attributes:
+        attributes["source"] = "environment"
+        if not obs_username:
+            obs_username = oscrc(apiurl, "user")
+            attributes["source"] = "oscrc"
 
-    if not obs_password:
-        obs_password = oscrc(apiurl, "pass")
+        if not obs_password:
+            obs_password = _oscrc_password(apiurl, obs_username)
+            attributes["source"] = "oscrc"
 
     return OBSCredentials(obs_username, obs_password)
 
@@ -59,6 +215,76 @@ class OSCError(Exception):
 
 
 def oscrc(apiurl: str, key: str) -> str:
+    """Read `key` from the section of `apiurl` in the first oscrc that exists.
+
+    Raises:
+      OSCError
+    """
+    try:
+        return _oscrc_section(apiurl)[key].strip()
+    except KeyError as e:
+        raise OSCError(f"Key '{e}' not found in config.") from e
+
+
+def _oscrc_password(apiurl: str, username: str) -> str:
+    """Read the password of `username` like osc's credentials manager would."""
+    section = _oscrc_section(apiurl)
+    manager, _, backend = section.get("credentials_mgr_class", "").partition(":")
+    if manager.endswith(".KeyringCredentialsManager"):
+        return _keyring_password(apiurl, username, backend)
+    if manager.endswith(".ObfuscatedConfigFileCredentialsManager"):
+        try:
+            return _deobfuscate(section["pass"].strip())
+        except KeyError as e:
+            raise OSCError(f"Key '{e}' not found in config.") from e
+    if "passx" in section:
+        # Written by old osc versions
+        return _deobfuscate(section["passx"].strip())
+    return oscrc(apiurl, "pass")
+
+
+def _keyring_password(apiurl: str, username: str, backend: str) -> str:
+    """Read the password of `username` from the keyring `backend` osc stored it in.
+
+    :param backend: Keyring class, e.g. "keyring.backends.SecretService.Keyring", the
+        default keyring is used if it's empty
+    """
+    try:
+        import keyring.core
+    except ImportError as e:
+        raise OSCError(
+            "Install the keyring package to read passwords from it, "
+            "e.g. with lubed[keyring]."
+        ) from e
+    try:
+        store = keyring.core.load_keyring(backend) if backend else keyring.get_keyring()
+    except (ImportError, AttributeError) as e:
+        raise OSCError(f"Could not load keyring backend '{backend}': {e}") from e
+    # osc stores the password with the host name of the API as service name
+    password = store.get_password(urllib.parse.urlparse(apiurl).netloc, username)
+    if password is None:
+        raise OSCError(f"No password for '{username}' found in the keyring.")
+    return password
+
+
+def _deobfuscate(value: str) -> str:
+    try:
+        return bz2.decompress(base64.b64decode(value)).decode("utf-8")
+    except (ValueError, OSError) as e:
+        raise OSCError(f"Could not read obfuscated password: {e}") from e
+
+
+def _oscrc_section(apiurl: str) -> Mapping:
+    path = _oscrc_path()
+    if path is None:
+        raise OSCError("Could not find oscrc file.")
+    try:
+        return _parse_oscrc(str(path), _mtime_ns(path))[apiurl]
+    except KeyError as e:
+        raise OSCError(f"Key '{e}' not found in config.") from e
+
+
+def _oscrc_path() -> Optional[pathlib.Path]:
     for file in (
         os.getenv("OSC_CONFIG"),
         "~/.oscrc",
@@ -69,12 +295,21 @@ def oscrc(apiurl: str, key: str) -> str:
 
         p = pathlib.Path(file).expanduser()
         if p.exists():
-            with p.open(encoding="utf-8"):
-                osc_config = configparser.ConfigParser()
-                osc_config.read(p)
-                try:
-                    return osc_config[apiurl][key].strip()
-                except KeyError as e:
-                    raise OSCError(f"Key '{e}' not found in config.") from e
-    else:
-        raise OSCError("Could not find oscrc file.")
+            return p
+    return None
+
+
+def _mtime_ns(path: Optional[pathlib.Path]) -> int:
+    try:
+        return path.stat().st_mtime_ns if path else 0
+    except OSError:
+        return 0
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_oscrc(path: str, mtime_ns: int) -> configparser.ConfigParser:
+    """Parse an oscrc once per modification, `mtime_ns` is only part of the key."""
+    osc_config = configparser.ConfigParser(interpolation=None)
+    with open(path, encoding="utf-8") as f:
+        osc_config.read_file(f)
+    return osc_config
@@ -1,13 +1,80 @@
 """Core logic to compute the list of updated dependencies."""
 
-from lubed import Package, config, git, obs
+import itertools
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
 
+from lubed import (
+    Package,
+    Timestamp,
+    config,
+    feed,
+    git,
+    links,
+    obs,
+    results,
+    trace,
+    transport,
+)
 
-def calculate_updated_packages(last_execution, conf):
+# Used for every key that is missing from the [concurrency] table.
+DEFAULT_CONCURRENCY = {
+    "workers": 16,
+    "obs_requests": 8,
+    "git_clones": 4,
+    "per_host": 8,
+}
+
+
+def calculate_updated_packages(
+    last_execution,
+    conf,
+    state=None,
+    retry_failed=False,
+    on_result=None,
+    shard=None,
+    sources=None,
+):
+    """Compute which origin packages were updated since the last execution.
+
+    If a `state` store is passed, the result of each check is recorded in it. Packages
+    whose fingerprint, i.e. the srcmd5 of an OBS package or the commit SHA of a
+    git-managed package, did not change since the last recorded check are not
+    checked again. With `change_detection = "revision"` in the [obs] table, packages
+    are considered updated if their fingerprint differs from the one recorded at the
+    last execution, file modification times are only used for new packages.
+
+    With `enabled = true` in the [feed] table and a `state`, only packages that show
+    up in the change feeds since the last run are checked, see :mod:`lubed.feed`.
+    The results of all other packages are taken from the state.
+
+    With `resolve_links = true` in the [obs] table, OBS packages are checked through
+    the chain of packages their sources come from, see :mod:`lubed.links`.
+
+    :param last_execution: Unix timestamp of the last execution
+    :param conf: lubed configuration
+    :param state: Optional :class:`lubed.state.StateStore`
+    :param retry_failed: Only check packages that failed in the last run, needs `state`
+    :param on_result: Called with "updated" or "failed" and the row of the package as
+        soon as a package check found an update or failed, in the calling thread
+    :param shard: Only check the origins of this shard, see :mod:`lubed.results`
+    :param sources: With `resolve_links`, filled with the bundle package names of
+        updated packages and the package of their chain that changed, if it's not
+        the origin package itself
+    :return: Tuple (updates, failures), lists of
+        (bundle package name, origin project name, origin package name)
+    """
     api_url = conf["obs"]["api_baseurl"]
     gitserver_url = conf["obs"]["gitserver_baseurl"]
-    git_managed_projects = conf["obs"]["git_managed_projects"]
-    origins = conf["origins"]
+    git_backend = conf["obs"].get("git_backend", "clone")
+    git_mirror_dir = conf["obs"].get("git_mirror_dir", "")
+    change_detection = conf["obs"].get("change_detection", "mtime")
+    resolve_links = conf["obs"].get("resolve_links", False)
     try:
         credentials = config.credentials(api_url)
     except config.OSCError as e:
@@ -16,31 +83,286 @@ def calculate_updated_packages(last_execution, conf):
         ) from e
     updates = []
     failures = []
-    packages = {
-        bundle_name: Package(
-            project=p["project"],
-            name=p["package"],
-            git_managed=p["project"] in git_managed_projects,
+    origins = config.origins(conf)
+    packages = dict(origins)
+    by_project = origins.by_project
+    if state is not None:
+        if retry_failed:
+            packages = {
+                bundle_name: package
+                for bundle_name, package in packages.items()
+                if state.failed(package)
+            }
+        else:
+            state.prune(set(packages.values()))
+    if shard is not None:
+        # Filtered after pruning, the state keeps the results of the other shards
+        packages = {
+            bundle_name: package
+            for bundle_name, package in packages.items()
+            if results.in_shard(bundle_name, shard)
+        }
+        selected = set(packages.values())
+        by_project = {
+            project: [p for p in project_packages if p in selected]
+            for project, project_packages in by_project.items()
+        }
+
+    feed_settings = conf.get("feed", {})
+    use_feed = feed_settings.get("enabled", False) and state is not None
+    use_feed = use_feed and not retry_failed
+    feed_read_at = Timestamp(time.time()) - feed.CURSOR_MARGIN
+    touched = None
+    if use_feed and state.cursor:
+        with trace.span("feed", since=state.cursor):
+            touched = feed.touched_packages(
+                since=state.cursor,
+                by_project=by_project,
+                credentials=credentials,
+                api_url=api_url,
+                gitserver_url=feed_settings.get("gitea_url") or gitserver_url,
+                events_file=feed_settings.get("events_file", ""),
+            )
+
+    limits = _Limits(conf.get("concurrency", {}))
+    transport.configure(max_in_flight=limits.obs_requests)
+    resolver = None
+    if resolve_links:
+        resolver = links.Resolver(
+            credentials,
+            api_url,
+            ttl=conf["obs"].get("link_cache_ttl", links.DEFAULT_TTL),
         )
-        for bundle_name, p in origins.items()
-    }
 
-    for bundle_name, package in packages.items():
-        func = obs.package_was_updated
+    unchanged = set()
+    prefetched = {}
+    if conf["obs"].get("bulk_queries", False):
+        obs_packages = [
+            p
+            for p in packages.values()
+            if not p.git_managed and (touched is None or p in touched)
+        ]
+        # Revisions are compared by the source MD5s, which cover the expanded
+        # sources of links, without modification times or resolved chains
+        by_revision = change_detection == "revision" and state is not None
+        if resolver is not None and not by_revision:
+            # The bulk queries only see the files of the origin package itself
+            with ThreadPoolExecutor(max_workers=limits.obs_requests) as executor:
+                chains = dict(
+                    zip(obs_packages, executor.map(resolver.chain, obs_packages))
+                )
+            obs_packages = [p for p in obs_packages if chains[p] == (p,)]
+        if not by_revision:
+            unchanged = obs.unchanged_packages(
+                last_check=last_execution,
+                packages=obs_packages,
+                credentials=credentials,
+                api_url=api_url,
+            )
+        if state is not None:
+            prefetched = obs.fingerprints(
+                [p for p in obs_packages if p not in unchanged],
+                credentials=credentials,
+                api_url=api_url,
+            )
+
+    def mtime(package: Package) -> Tuple[Timestamp, bool]:
+        if resolver is not None and not package.git_managed:
+            return resolver.mtime(package)
+        if package.git_managed:
+            return git.package_mtime(
+                package,
+                gitserver_url=gitserver_url,
+                backend=git_backend,
+                mirror_dir=git_mirror_dir,
+            )
+        return obs.package_mtime(package, credentials=credentials, api_url=api_url)
+
+    def fingerprint(package: Package) -> str:
         if package.git_managed:
-            func = git.package_was_updated
-
-        updated, err = func(
-            last_check=last_execution,
-            package=package,
-            credentials=credentials,
-            api_url=api_url,
-            gitserver_url=gitserver_url,
+            if git_backend == "clone":
+                return git.fingerprint(package, gitserver_url=gitserver_url)
+            return ""
+        if package in prefetched:
+            return prefetched[package]
+        return obs.fingerprint(package, credentials=credentials, api_url=api_url)
+
+    def linkless(package: Package) -> bool:
+        return resolver.chain(package) == (package,)
+
+    def check(package: Package) -> Tuple[bool, bool]:
+        if package in unchanged:
+            if state is not None:
+                # Checked in bulk, the previous fingerprint and mtime still hold
+                previous = state.get(package)
+                state.record(
+                    package,
+                    previous.fingerprint,
+                    previous.mtime,
+                    Timestamp(time.time()),
+                    False,
+                )
+            return False, False
+
+        if state is None:
+            newest, err = mtime(package)
+            return not err and newest > last_execution, err
+
+        checked_at = Timestamp(time.time())
+        previous = state.get(package)
+        if (
+            touched is not None
+            and package not in touched
+            and not previous.errors
+            # The feeds don't show changes of link targets
+            and (resolver is None or package.git_managed or linkless(package))
+        ):
+            # Not changed since the last run, the previous result still holds
+            updated = None
+            if (
+                change_detection == "revision"
+                and previous.fingerprint
+                and previous.baseline
+            ):
+                updated = previous.fingerprint != previous.baseline
+            elif previous.mtime >= 0:
+                updated = previous.mtime > last_execution
+            if updated is not None:
+                state.record(
+                    package, previous.fingerprint, previous.mtime, checked_at, False
+                )
+                return updated, False
+
+        current = fingerprint(package)
+        if change_detection == "revision" and current and previous.baseline:
+            # The stored mtime is only valid for the stored fingerprint, -1 marks it
+            # as unknown
+            newest = previous.mtime if current == previous.fingerprint else -1
+            state.record(package, current, newest, checked_at, False)
+            return current != previous.baseline, False
+
+        if (
+            current
+            and current == previous.fingerprint
+            and previous.mtime >= 0
+            and not previous.errors
+        ):
+            newest, err = previous.mtime, False
+        else:
+            newest, err = mtime(package)
+        state.record(package, current, newest, checked_at, err)
+        return not err and newest > last_execution, err
+
+    bundle_names = list(packages)
+
+    def report(index: int, result: Tuple[bool, bool]) -> None:
+        updated, err = result
+        package = packages[bundle_names[index]]
+        if updated and not err and resolver is not None and sources is not None:
+            source = resolver.changed_source(package, last_execution)
+            if source is not None and source != package:
+                sources[bundle_names[index]] = source
+        if on_result is not None and (err or updated):
+            row = (bundle_names[index], package.project, package.name)
+            on_result("failed" if err else "updated", row)
+
+    checked = _run_checks(
+        list(packages.values()),
+        check,
+        limits,
+        hosts={
+            "obs": urllib.parse.urlparse(api_url).netloc,
+            "git": urllib.parse.urlparse(gitserver_url).netloc,
+        },
+        on_result=report,
+    )
+    if resolver is not None:
+        resolver.save()
+
+    if use_feed and (touched is not None or not state.cursor):
+        # Only moved on when the run is committed, like the last execution time
+        state.next_cursor = feed_read_at
+
+    if git_mirror_dir and git_backend == "clone" and not retry_failed:
+        # All origins, the mirrors of the other shards are kept
+        git.prune_mirror(
+            os.path.expanduser(git_mirror_dir),
+            [p for p in dict(origins).values() if p.git_managed],
         )
 
+    for (bundle_name, package), (updated, err) in zip(packages.items(), checked):
         if err:
             failures.append((bundle_name, package.project, package.name))
         elif updated:
             updates.append((bundle_name, package.project, package.name))
 
     return updates, failures
+
+
+class _Limits:
+    """Bound the number of concurrent checks per backend and per host."""
+
+    def __init__(self, settings: dict):
+        settings = {**DEFAULT_CONCURRENCY, **settings}
+        self.workers = settings["workers"]
+        self.obs_requests = settings["obs_requests"]
+        self._backends = {
+            "obs": threading.BoundedSemaphore(settings["obs_requests"]),
+            "git": threading.BoundedSemaphore(settings["git_clones"]),
+        }
+        self._per_host = settings["per_host"]
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, backend: str, host: str):
+        with self._lock:
+            host_semaphore = self._hosts.setdefault(
+                host, threading.BoundedSemaphore(self._per_host)
+            )
+        with self._backends[backend], host_semaphore:
+            yield
+
+
+def _run_checks(
+    packages: List[Package],
+    check: Callable[[Package], Tuple[bool, bool]],
+    limits: _Limits,
+    hosts: Dict[str, str],
+    on_result: Optional[Callable[[int, Tuple[bool, bool]], None]] = None,
+) -> List[Tuple[bool, bool]]:
+    """Run `check` for all packages concurrently.
+
+    Checks are submitted round-robin across hosts, so that a long queue for one
+    server does not delay the checks against another one. The results are returned
+    in the same order as `packages`, `on_result` is called with the index of the
+    package and its result as soon as each check completes.
+    """
+
+    def run(package: Package) -> Tuple[bool, bool]:
+        backend = "git" if package.git_managed else "obs"
+        with limits.slot(backend, hosts[backend]), trace.span(
+            "check", package=f"{package.project}/{package.name}", backend=backend
+        ):
+            return check(package)
+
+    by_host: Dict[str, List[int]] = {}
+    for index, package in enumerate(packages):
+        backend = "git" if package.git_managed else "obs"
+        by_host.setdefault(hosts[backend], []).append(index)
+    order = [
+        index
+        for indices in itertools.zip_longest(*by_host.values())
+        for index in indices
+        if index is not None
+    ]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=limits.workers) as executor:
+        futures = {executor.submit(run, packages[index]): index for index in order}
+        for future in as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            if on_result is not None:
+                on_result(index, results[index])
+    return [results[index] for index in range(len(packages))]
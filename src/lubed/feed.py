@@ -0,0 +1,92 @@
+"""Find origin packages that changed since the last run from change feeds.
+
+Instead of checking every origin package, the change feeds of the servers are read
+from a cursor, the time they were last read: the latest updates statistic of each
+OBS origin project and the activity feed of the pool organization on the git
+server. The statistics only cover packages that exist in the origin project itself,
+packages inherited through project links are always checked. As a local stand-in
+for these feeds, e.g. for testing or for events collected from the OBS message bus,
+a JSON lines file with one
+{"time": <Unix time>, "project": <OBS project>, "package": <package>} object per
+change can be used instead.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import logging
+from typing import Iterable, Mapping, Optional, Set
+
+from lubed import OBSCredentials, Package, Timestamp, git, obs
+
+# The cursor is moved to this many seconds before the feeds were read, changes
+# that show up in a feed late are picked up by the next run.
+CURSOR_MARGIN = 300
+
+
+def touched_packages(
+    since: Timestamp,
+    by_project: Mapping[str, Iterable[Package]],
+    credentials: OBSCredentials,
+    api_url: str,
+    gitserver_url: str,
+    events_file: str = "",
+) -> Optional[Set[Package]]:
+    """Find the packages that changed since the cursor.
+
+    :param since: Cursor, Unix timestamp
+    :param by_project: Origin packages grouped by their project, like
+        :attr:`lubed.config.Origins.by_project`
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server
+    :param gitserver_url: Base URL of the Gitea server with the pool organization
+    :param events_file: JSON lines file to read instead of the server feeds
+    :return: Packages of `by_project` that changed, None if a feed could not be read
+    """
+    packages = [p for project_packages in by_project.values() for p in project_packages]
+    if events_file:
+        return _touched_by_events(since, packages, events_file)
+
+    touched = set()
+    for project, project_packages in sorted(by_project.items()):
+        project_packages = [p for p in project_packages if not p.git_managed]
+        if not project_packages:
+            continue
+        changed = obs.changed_packages(project, since, credentials, api_url)
+        if changed is None:
+            return None
+        # Packages inherited from linked projects don't show up in the statistics
+        # of the project, they always count as touched
+        present = obs.packages_in_project(
+            project, (p.name for p in project_packages), credentials, api_url
+        )
+        if present is None:
+            return None
+        touched.update(
+            p for p in project_packages if p.name in changed or p.name not in present
+        )
+
+    git_packages = [p for p in packages if p.git_managed]
+    if git_packages:
+        pushed = git.pushed_packages(since, git_packages, gitserver_url)
+        if pushed is None:
+            return None
+        touched.update(pushed)
+    return touched
+
+
+def _touched_by_events(
+    since: Timestamp, packages: Iterable[Package], events_file: str
+) -> Optional[Set[Package]]:
+    changed = set()
+    try:
+        with open(events_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["time"] >= since:
+                    changed.add((event["project"], event["package"]))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.error("Could not read the events file '%s': %s", events_file, e)
+        return None
+    return {p for p in packages if (p.project, p.name) in changed}
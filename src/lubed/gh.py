@@ -1,12 +1,53 @@
 """Interact with GitHub and create issues"""
 
 # SPDX-License-Identifier: GPL-3.0-or-later
+import functools
+import json
+import re
 import textwrap
-from typing import Any, Dict, List
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
 
 import github
 from gql import Client, gql
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql.client import SyncClientSession
+from gql.transport.exceptions import TransportServerError
+from gql.transport.requests import RequestsHTTPTransport
+
+from lubed import ratelimit
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+# Rate limit buckets, GitHub has separate quotas for the REST and GraphQL APIs
+REST_HOST = "https://api.github.com"
+GRAPHQL_HOST = GRAPHQL_URL
+# Seconds to wait for GitHub to answer
+TIMEOUT = 60
+
+# Queries are parsed once. The schema is not fetched from GitHub, it's large and
+# only needed to validate queries locally.
+_ADD_TO_BOARD = gql(
+    """
+    mutation($issue_id: ID!, $board_id: ID!) {
+      addProjectV2ItemById(input:{contentId:$issue_id,projectId:$board_id}) {
+        item {
+          id
+        }
+      }
+    }
+    """
+)
+_ISSUE_NODE_ID = gql(
+    """
+    query getIssueId ($num: Int!, $owner: String!, $repo: String!) {
+      repository(owner: $owner, name: $repo) {
+        issue(number: $num) {
+          id
+        }
+      }
+    }
+    """
+)
 
 
 def assign_issue_to_board(
@@ -21,21 +62,10 @@ def assign_issue_to_board(
     :param gh_token: GitHub OAuth token.
     :returns: GraphQL execution result.
     """
-    client = _get_gql_client(gh_token)
-    link_issue_project_gql = gql(
-        """
-    mutation($issue_id: ID!, $board_id: ID!) {
-      addProjectV2ItemById(input:{contentId:$issue_id,projectId:$board_id}) {
-        item {
-          id
-        }
-      }
-    }
-    """
-    )
-    return client.execute(
-        link_issue_project_gql,
-        variable_values={
+    return _execute(
+        _get_gql_session(gh_token),
+        _ADD_TO_BOARD,
+        {
             "issue_id": issue_id,
             "board_id": board_id,
         },
@@ -45,31 +75,148 @@ def assign_issue_to_board(
 def get_issue_node_id(issue_num: int, repo_name: str, gh_token: str) -> str:
     """Get Issue node ID based on the issue's number within a project.
 
+    Issues created with `create_issue_in_board` don't need this, the node ID is part
+    of the REST response.
+
     :param issue_num: Number of the issue in a repository (visible in the issue URL).
     :param repo_name: "owner/repo" of the GitHub repo of the issue.
     :param gh_token: GitHub OAuth token.
     :returns: Issue Node ID useful for Github GraphQL API queries.
     """
-    client = _get_gql_client(gh_token)
-    issue_number_to_id = gql(
-        """
-    query getIssueId ($num: Int!, $owner: String!, $repo: String!) {
-      repository(owner: $owner, name: $repo) {
-        issue(number: $num) {
-          id
-        }
-      }
-    }
+    owner, repo = repo_name.split("/")
+    resp = _execute(
+        _get_gql_session(gh_token),
+        _ISSUE_NODE_ID,
+        {"owner": owner, "repo": repo, "num": issue_num},
+    )
+
+    return resp["repository"]["issue"]["id"]
+
+
+# (bundle package name, origin project name, origin package name)
+Row = Tuple[str, str, str]
+
+# The rows of a tracking issue are embedded in its body as a hidden HTML comment, so
+# that the next run can tell which rows are new without parsing the table.
+_SNAPSHOT_RE = re.compile(r"<!-- lubed-snapshot: (.*?) -->", re.DOTALL)
+
+
+@dataclass
+class Snapshot:
+    """Rows of a tracking issue.
+
+    :param since: Unix time of the last execution that the issue started from
     """
+
+    since: int = 0
+    updates: List[Row] = field(default_factory=list)
+    failures: List[Row] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.updates or self.failures)
+
+
+def embed_snapshot(body: str, snapshot: Snapshot) -> str:
+    """Append `snapshot` to an issue body, invisible in the rendered issue."""
+    data = json.dumps(
+        {
+            "since": snapshot.since,
+            "updates": snapshot.updates,
+            "failures": snapshot.failures,
+        },
+        separators=(",", ":"),
     )
+    return f"{body.rstrip()}\n\n<!-- lubed-snapshot: {data} -->\n"
 
-    owner, repo = repo_name.split("/")
-    resp = client.execute(
-        issue_number_to_id,
-        variable_values={"owner": owner, "repo": repo, "num": issue_num},
+
+def extract_snapshot(body: Optional[str]) -> Optional[Snapshot]:
+    """Read the snapshot embedded with `embed_snapshot`.
+
+    :returns: The snapshot, None if the body doesn't contain a valid one
+    """
+    match = _SNAPSHOT_RE.search(body or "")
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(1))
+        return Snapshot(
+            since=int(data["since"]),
+            updates=[tuple(row) for row in data["updates"]],
+            failures=[tuple(row) for row in data["failures"]],
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def merge_snapshot(
+    previous: Snapshot, updates: List[Row], failures: List[Row]
+) -> Tuple[Snapshot, Snapshot]:
+    """Add the results of a run to the rows of an open tracking issue.
+
+    Updates stay in the issue until it's closed, so the updates of the run are added
+    to the previous ones. Failures are replaced by the failures of the run, they
+    are usually temporary. No requests are made.
+
+    :param previous: Snapshot of the open issue
+    :param updates: Packages that need an update
+    :param failures: Packages that failed to check
+    :returns: The merged snapshot and the delta, the updates and failures that are
+        not in `previous`
+    """
+    known_updates = set(previous.updates)
+    new_updates = [row for row in _unique(updates) if row not in known_updates]
+    known_failures = set(previous.failures)
+    failures = _unique(failures)
+    merged = Snapshot(
+        since=previous.since,
+        updates=previous.updates + new_updates,
+        failures=failures,
     )
+    delta = Snapshot(
+        since=previous.since,
+        updates=new_updates,
+        failures=[row for row in failures if row not in known_failures],
+    )
+    return merged, delta
 
-    return resp["repository"]["issue"]["id"]
+
+def find_open_issue(
+    repo_name: str, title: str, gh_token: str, label_names: List[str] = None
+):
+    """Find the open issue with `title` and `label_names` with one search request.
+
+    :param repo_name: "owner/repo" of the GitHub repo of the issue.
+    :param title: Issue title, it must match exactly.
+    :param gh_token: GitHub OAuth token.
+    :param label_names: Labels the issue must have.
+    :returns: The most recently created :class:`github.Issue.Issue`, or None
+    """
+    query = f'repo:{repo_name} is:issue is:open in:title "{title}"'
+    for label in label_names or []:
+        query += f' label:"{label}"'
+    client = _get_github_client(gh_token)
+    results = client.search_issues(query, sort="created", order="desc")
+    # Only the first page is fetched, the title search matches few issues.
+    for issue in _rest_call(client, results.get_page, 0):
+        if issue.title == title:
+            return issue
+    return None
+
+
+def update_issue(issue, body: str, gh_token: str, comment: str = ""):
+    """Replace the body of `issue` and optionally comment on it.
+
+    :param issue: :class:`github.Issue.Issue` to update.
+    :param body: New issue body.
+    :param gh_token: GitHub OAuth token.
+    :param comment: Comment to add, none is added if it's empty.
+    :returns: `issue`
+    """
+    client = _get_github_client(gh_token)
+    _rest_call(client, issue.edit, body=body)
+    if comment:
+        _rest_call(client, issue.create_comment, comment)
+    return issue
 
 
 def create_issue_in_board(
@@ -82,6 +229,9 @@ def create_issue_in_board(
 ):
     """Create an issue and add it to a column on a project board.
 
+    This takes two requests: one to create the issue, which also returns its node
+    ID, and one to add it to the board.
+
     :param repo_name: "owner/repo" of the GitHub repo that the issues will be created in.
     :param title: Issue title.
     :param body: Issue body.
@@ -92,33 +242,39 @@ def create_issue_in_board(
     :returns: :class:`github.Issue.Issue`
 
     """
-    client = github.Github(gh_token)
-
     issue = _create_issue(
         repo_name,
         title,
         body,
-        client,
+        _get_github_client(gh_token),
         label_names,
     )
 
-    issue_node_id = get_issue_node_id(issue.number, repo_name, gh_token)
-    assign_issue_to_board(issue_node_id, board_id, gh_token)
+    assign_issue_to_board(issue.raw_data["node_id"], board_id, gh_token)
 
     return issue
 
 
-def _get_gql_client(gh_token: str):
-    return Client(
-        transport=AIOHTTPTransport(
-            url="https://api.github.com/graphql",
+# Clients are reused per token, each keeps a pool of connections to GitHub.
+@functools.lru_cache
+def _get_github_client(gh_token: str) -> github.Github:
+    return github.Github(gh_token, timeout=TIMEOUT)
+
+
+@functools.lru_cache
+def _get_gql_session(gh_token: str) -> SyncClientSession:
+    client = Client(
+        transport=RequestsHTTPTransport(
+            url=GRAPHQL_URL,
             headers={
                 "Authorization": f"bearer {gh_token}",
                 "Accept": "application/vnd.github.bane-preview+json",
             },
+            timeout=TIMEOUT,
         ),
-        fetch_schema_from_transport=True,
+        fetch_schema_from_transport=False,
     )
+    return client.connect_sync()
 
 
 def _create_issue(
@@ -131,9 +287,65 @@ def _create_issue(
     if label_names is None:
         label_names = []
 
-    repo = client.get_repo(repo_name)
-    labels = [repo.get_label(l) for l in label_names]
-    return repo.create_issue(title=title, body=body, labels=labels)
+    # Labels are passed by name, a lazy repository is not fetched before the issue
+    # is created.
+    repo = client.get_repo(repo_name, lazy=True)
+    return _rest_call(
+        client, repo.create_issue, title=title, body=body, labels=label_names
+    )
+
+
+def _rest_call(client: github.Github, func, *args, **kwargs):
+    """Make a PyGithub call of `client` within the REST API rate limit.
+
+    The client records the X-RateLimit headers of every response. After each
+    successful call, the rate is set to spread the remaining quota until it resets.
+    """
+    ratelimit.bucket(REST_HOST).acquire()
+    try:
+        result = func(*args, **kwargs)
+    except github.GithubException as e:
+        headers = e.headers or {}
+        # Secondary rate limits are reported with 403
+        throttled = isinstance(e, github.RateLimitExceededException) or e.status == 429
+        ratelimit.observe(
+            REST_HOST,
+            429 if throttled else e.status,
+            headers,
+            ratelimit.parse_retry_after(headers.get("retry-after")),
+        )
+        raise
+    # Known after the first response, reading it then doesn't send a request
+    remaining, _ = client.rate_limiting
+    if remaining >= 0:
+        ratelimit.bucket(REST_HOST).quota(
+            remaining, client.rate_limiting_resettime - time.time()
+        )
+    else:
+        ratelimit.bucket(REST_HOST).succeeded()
+    return result
+
+
+def _execute(session: SyncClientSession, document, variable_values: Dict[str, Any]):
+    """Execute a GraphQL document within the GraphQL API rate limit."""
+    ratelimit.bucket(GRAPHQL_HOST).acquire()
+    try:
+        result = session.execute(document, variable_values=variable_values)
+    except TransportServerError as e:
+        headers = session.transport.response_headers or {}
+        ratelimit.observe(
+            GRAPHQL_HOST,
+            e.code,
+            headers,
+            ratelimit.parse_retry_after(headers.get("Retry-After")),
+        )
+        raise
+    ratelimit.observe(GRAPHQL_HOST, 200, session.transport.response_headers or {})
+    return result
+
+
+def _unique(rows: List[Row]) -> List[Row]:
+    return list(dict.fromkeys(tuple(row) for row in rows))
 
 
 def format_updates_md(updates, failures):
@@ -1,12 +1,50 @@
 """Git-based package information"""
 
+import fcntl
 import logging
+import os
 import shutil
 import subprocess
 import tempfile
-from typing import Tuple
+import urllib.parse
+from contextlib import contextmanager, suppress
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
 
-from lubed import OBSCredentials, Package, Timestamp
+import requests
+
+from lubed import (
+    OBSCredentials,
+    Package,
+    Timestamp,
+    ratelimit,
+    retry,
+    trace,
+    transport,
+)
+
+# Pages of the Gitea activity feed read before falling back to checking all packages
+FEED_MAX_PAGES = 20
+FEED_PAGE_SIZE = 50
+
+# Parts of git error messages that hint at network problems
+_TRANSIENT_ERRORS = (
+    "Could not resolve host",
+    "Connection refused",
+    "Connection reset",
+    "Connection timed out",
+    "Operation timed out",
+    "The requested URL returned error: 429",
+    "The requested URL returned error: 5",
+    "RPC failed",
+    "early EOF",
+    "unexpected disconnect",
+)
+# Parts of git error messages that mean the server throttles the client
+_THROTTLE_ERRORS = (
+    "The requested URL returned error: 429",
+    "The requested URL returned error: 503",
+)
 
 
 def package_was_updated(
@@ -15,18 +53,21 @@ def package_was_updated(
     credentials: OBSCredentials,
     api_url: str = "",
     gitserver_url: str = "https://src.opensuse.org",
+    backend: str = "clone",
+    mirror_dir: str = "",
 ) -> Tuple[bool, bool]:
     """Check if a git-managed OBS package was updated since a known timestamp.
 
     The OBS package is considered updated if the last commit is newer than the known
-    timestamp. To obtain the author time of the last commit, the last commit in the
-    repository is cloned to a temporary directory.
+    timestamp, see `package_mtime`.
 
     :param last_check: Unix timestamp of the last check
     :param package: OBS package to check
     :param credentials: Not used, just for API compatibility
     :param api_url: Not used, just for API compatibility
     :param gitserver_url: Base URL of the git server, defaults to https://src.opensuse.org
+    :param backend: "clone" to clone the last commit, "api" to use the Gitea API
+    :param mirror_dir: Directory of persistent bare repositories, "" to disable
     :return: Tuple (bool, bool)
         - package_updated: True if package was updated, False otherwise
         - err: True if an error occured during the check, False otherwise
@@ -34,65 +75,294 @@ def package_was_updated(
     """
     del credentials, api_url  # not used
 
-    newer, err = False, True
+    commit_time, err = package_mtime(package, gitserver_url, backend, mirror_dir)
+    return not err and commit_time > last_check, err
+
+
+def package_mtime(
+    package: Package,
+    gitserver_url: str = "https://src.opensuse.org",
+    backend: str = "clone",
+    mirror_dir: str = "",
+) -> Tuple[Timestamp, bool]:
+    """Get the author time of the last commit of a git-managed OBS package.
+
+    To obtain the author time of the last commit, either only the last commit object
+    is cloned to a temporary directory, without trees, blobs or a checkout, or the
+    branch is queried with the Gitea API of the git server.
+
+    If `mirror_dir` is set, the clone backend keeps a bare repository per package in
+    that directory and only fetches the package branch on later checks.
+
+    :param package: OBS package to check
+    :param gitserver_url: Base URL of the git server, defaults to https://src.opensuse.org
+    :param backend: "clone" to clone the last commit, "api" to use the Gitea API
+    :param mirror_dir: Directory of persistent bare repositories, "" to disable
+    :return: Tuple (Timestamp, bool)
+        - mtime: Unix timestamp of the last commit, -1 on errors
+        - err: True if an error occured during the check, False otherwise
+    """
+    if backend == "api":
+        commit_time = _api_last_commit_time(gitserver_url, package)
+        return commit_time, commit_time < 0
 
     if not shutil.which("git"):
         raise RuntimeError(
             "'git' not found. Please check that it's available in $PATH."
         )
 
+    if mirror_dir:
+        commit_time = _mirror_last_commit_time(mirror_dir, gitserver_url, package)
+        return commit_time, commit_time < 0
+
     with tempfile.TemporaryDirectory() as tempdir:
         repo_dir = _shallow_clone(gitserver_url, package, tempdir)
         if not repo_dir:
-            return newer, err
+            return -1, True
+
+        commit_time = _last_commit_time(repo_dir)
+        return commit_time, commit_time < 0
+
+
+def fingerprint(package: Package, gitserver_url: str = "https://src.opensuse.org"):
+    """Get the SHA of the last commit of a git-managed OBS package.
+
+    Only the refs of the remote repository are listed, nothing is cloned.
+
+    :param package: OBS package to check
+    :param gitserver_url: Base URL of the git server, defaults to https://src.opensuse.org
+    :return: Commit SHA, "" on errors
+    """
+    git_url = f"{gitserver_url}/pool/{package.name}"
+    with trace.span("git.ls_remote", package=package.name):
+        completed = _run_remote(
+            ["git", "ls-remote", git_url, f"refs/heads/{_branch(package)}"], git_url
+        )
+    if completed.returncode != 0 or not completed.stdout:
+        logging.error("Could not list the refs of '%s'.", git_url)
+        return ""
+    return completed.stdout.split()[0]
+
+
+def pushed_packages(
+    since: Timestamp,
+    packages: Iterable[Package],
+    gitserver_url: str = "https://src.opensuse.org",
+) -> Optional[Set[Package]]:
+    """Find git-managed packages whose branch was pushed to since a known timestamp.
+
+    The activity feed of the pool organization is read with the Gitea API, newest
+    activities first, until an activity older than `since` is reached. Activities
+    that are not about a branch, e.g. creating a repository, match all packages of
+    the repository.
+
+    :param since: Unix timestamp
+    :param packages: Git-managed OBS packages
+    :param gitserver_url: Base URL of the git server, defaults to https://src.opensuse.org
+    :return: Subset of `packages`, None if the feed could not be read completely
+    """
+    pushed = _pushed_branches(since, gitserver_url)
+    if pushed is None:
+        return None
+    return {
+        package
+        for package in packages
+        if (package.name, "") in pushed or (package.name, _branch(package)) in pushed
+    }
 
-        if _last_commit_time(repo_dir) > last_check:
-            newer, err = True, False
-        else:
-            newer, err = False, False
 
-    return newer, err
+def _pushed_branches(
+    since: Timestamp, gitserver_url: str
+) -> Optional[Set[Tuple[str, str]]]:
+    pushed = set()
+    for page in range(1, FEED_MAX_PAGES + 1):
+        url = (
+            f"{gitserver_url}/api/v1/orgs/pool/activities/feeds"
+            f"?limit={FEED_PAGE_SIZE}&page={page}"
+        )
+        try:
+            with trace.span("git.feed", page=page):
+                activities = transport.get(url).json()
+            for activity in activities:
+                created = datetime.fromisoformat(activity["created"]).timestamp()
+                if created < since:
+                    return pushed
+                ref = activity.get("ref_name") or ""
+                pushed.add((activity["repo"]["name"], ref.removeprefix("refs/heads/")))
+        except (requests.RequestException, KeyError, TypeError, ValueError):
+            logging.error("Could not read the activity feed '%s'.", url)
+            return None
+        if len(activities) < FEED_PAGE_SIZE:
+            return pushed
+
+    logging.info("More activity since %s than fits in the feed pages.", since)
+    return None
 
 
 def _shallow_clone(gitserver_url: str, package: Package, working_directory):
-    """Shallow clone a package."""
+    """Clone only the last commit object of a package into a bare repository.
 
-    # Project: SUSE:SLFO:Main uses slfo-main branch in pool/<package>
-    branch = package.project.replace("SUSE:", "").replace(":", "-").lower()
+    Trees and blobs are skipped with a partial clone filter, so only a few KB are
+    transferred and nothing is checked out. Servers that don't support filters send
+    the full tree of the last commit instead.
+    """
     git_url = f"{gitserver_url}/pool/{package.name}"
     cmd = [
         "git",
         "clone",
+        "--bare",
         "--depth=1",
-        f"--branch={branch}",
+        "--filter=tree:0",
+        "--single-branch",
+        f"--branch={_branch(package)}",
         git_url,
     ]
-    completed = subprocess.run(
-        cmd,
-        cwd=working_directory,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
-        check=False,
-    )
+    with trace.span("git.clone", package=package.name):
+        completed = _run_remote(cmd, git_url, cwd=working_directory)
     if completed.returncode == 0:
-        return f"{working_directory}/{package.name}"
+        return f"{working_directory}/{package.name}.git"
 
     logging.error("Could not clone '%s'.", git_url)
     return ""
 
 
-def _last_commit_time(repo_dir: str) -> Timestamp:
+def prune_mirror(mirror_dir: str, packages: Iterable[Package]) -> None:
+    """Remove mirrored repositories of packages that are not in `packages`."""
+    keep = {f"{package.name}.git" for package in packages}
+    with suppress(FileNotFoundError):
+        for entry in os.listdir(mirror_dir):
+            if not entry.endswith(".git") or entry in keep:
+                continue
+            repo_dir = os.path.join(mirror_dir, entry)
+            # The lock file stays, another process may be waiting on it already
+            with _locked(repo_dir):
+                shutil.rmtree(repo_dir, ignore_errors=True)
+
+
+def _mirror_last_commit_time(
+    mirror_dir: str, gitserver_url: str, package: Package
+) -> Timestamp:
+    """Update the mirror of a package and read the last commit time of its branch.
+
+    New mirrors are created like in `_shallow_clone`, existing ones only fetch the
+    tip of the package branch. A lock file per repository serializes concurrent
+    checks of packages sharing a repository, also across lubed processes.
+    """
+    git_url = f"{gitserver_url}/pool/{package.name}"
+    branch = _branch(package)
+    ref = f"refs/heads/{branch}"
+    repo_dir = os.path.join(os.path.expanduser(mirror_dir), f"{package.name}.git")
+    os.makedirs(os.path.dirname(repo_dir), exist_ok=True)
+
+    with _locked(repo_dir):
+        exists = os.path.isdir(repo_dir)
+        if exists:
+            cmd = ["git", "fetch", "--depth=1", "origin", f"+{ref}:{ref}"]
+            cwd = repo_dir
+        else:
+            cmd = [
+                "git",
+                "clone",
+                "--bare",
+                "--depth=1",
+                "--filter=tree:0",
+                "--single-branch",
+                f"--branch={branch}",
+                git_url,
+                repo_dir,
+            ]
+            cwd = None
+        with trace.span("git.fetch", package=package.name, new=not exists):
+            completed = _run_remote(cmd, git_url, cwd=cwd)
+        if completed.returncode != 0:
+            logging.error("Could not fetch '%s' from '%s'.", ref, git_url)
+            return -1
+
+        return _last_commit_time(repo_dir, ref)
+
+
+@contextmanager
+def _locked(repo_dir: str):
+    with open(f"{repo_dir}.lock", "w", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _run_remote(
+    cmd: List[str], git_url: str, cwd: Optional[str] = None
+) -> subprocess.CompletedProcess:
+    """Run a git command that talks to the git server.
+
+    Network failures are retried, see :mod:`lubed.retry`. If the command still
+    fails, the returned process has a non-zero return code.
+    """
+
+    parsed = urllib.parse.urlparse(git_url)
+    host = f"{parsed.scheme}://{parsed.netloc}"
+    limiter = ratelimit.bucket(host)
+
+    def run_once():
+        limiter.acquire()
+        completed = subprocess.run(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            check=False,
+        )
+        if any(message in completed.stderr for message in _THROTTLE_ERRORS):
+            limiter.throttled()
+        elif completed.returncode == 0:
+            limiter.succeeded()
+        if completed.returncode != 0 and any(
+            message in completed.stderr for message in _TRANSIENT_ERRORS
+        ):
+            raise retry.TransientError(completed.stderr.strip())
+        return completed
+
+    try:
+        return retry.call(host, run_once)
+    except (retry.TransientError, retry.CircuitOpenError) as e:
+        return subprocess.CompletedProcess(cmd, 128, "", str(e))
+
+
+def _last_commit_time(repo_dir: str, ref: str = "HEAD") -> Timestamp:
     # %at is for author time
-    cmd = ["git", "log", "-1", "--format=%at"]
-    completed = subprocess.run(
-        cmd,
-        cwd=repo_dir,
-        stdout=subprocess.PIPE,
-        env={"GIT_PAGER": ""},
-        encoding="utf-8",
-        check=False,
-    )
+    cmd = ["git", "log", "-1", "--format=%at", ref]
+    with trace.span("git.commit_time", repo=os.path.basename(repo_dir)):
+        completed = subprocess.run(
+            cmd,
+            cwd=repo_dir,
+            stdout=subprocess.PIPE,
+            env={"GIT_PAGER": ""},
+            encoding="utf-8",
+            check=False,
+        )
     if completed.returncode == 0:
         return int(completed.stdout.strip())
     return -1
+
+
+def _api_last_commit_time(gitserver_url: str, package: Package) -> Timestamp:
+    """Read the author time of the last commit on the package branch via Gitea."""
+    url = (
+        f"{gitserver_url}/api/v1/repos/pool/{urllib.parse.quote(package.name)}"
+        f"/branches/{urllib.parse.quote(_branch(package))}"
+    )
+    try:
+        with trace.span("git.api", package=package.name):
+            response = transport.get(url)
+        timestamp = response.json()["commit"]["timestamp"]
+        return Timestamp(datetime.fromisoformat(timestamp).timestamp())
+    except (requests.RequestException, KeyError, ValueError):
+        logging.error("Could not query the last commit of '%s'.", url)
+        return -1
+
+
+def _branch(package: Package) -> str:
+    # Project: SUSE:SLFO:Main uses slfo-main branch in pool/<package>
+    return package.project.replace("SUSE:", "").replace(":", "-").lower()
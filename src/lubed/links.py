@@ -0,0 +1,177 @@
+"""Resolve OBS origin packages to the sources they are built from.
+
+An origin package can be inherited from another project through project links, and
+it can be a source link to another package, which in turn can be inherited or a
+link. The chain of packages whose files make up the sources of an origin is resolved
+once and kept in a JSON file, see `use_cache`. Origins that share upstream
+packages, e.g. several bundle packages built from python311, need only one check
+per package in the chain.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from lubed import OBSCredentials, Package, Timestamp, obs
+
+T = TypeVar("T")
+
+# Links are followed this deep, deeper chains are cut off
+MAX_DEPTH = 10
+# Seconds a resolved chain is used before it's resolved again
+DEFAULT_TTL = 24 * 60 * 60
+
+Chain = Tuple[Package, ...]
+
+_cache_path: Optional[pathlib.Path] = None
+
+
+def default_path() -> pathlib.Path:
+    cache_home = os.getenv("XDG_CACHE_HOME", "~/.cache")
+    return pathlib.Path(cache_home).expanduser() / "lubed" / "links.json"
+
+
+def use_cache(path: Optional[pathlib.Path]) -> None:
+    """Keep resolved chains in `path`, or only in memory with None."""
+    global _cache_path
+    _cache_path = path
+
+
+class Resolver:
+    """Resolve and check origin packages through their link chains.
+
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server
+    :param ttl: Seconds a chain from the cache file is used
+    """
+
+    def __init__(
+        self, credentials: OBSCredentials, api_url: str, ttl: int = DEFAULT_TTL
+    ):
+        self.credentials = credentials
+        self.api_url = api_url
+        self.ttl = ttl
+        self._chains: Dict[Package, Chain] = {}
+        self._mtimes: Dict[Package, Tuple[Timestamp, bool]] = {}
+        self._locks: Dict[Tuple[str, Package], threading.Lock] = {}
+        self._lock = threading.Lock()
+        # package key -> {"resolved_at": <Unix time>, "chain": [[project, name]]}
+        self._cached: Dict[str, dict] = {}
+        self._changed = False
+        if _cache_path is not None:
+            self._cached = _read(_cache_path).get(api_url, {})
+
+    def chain(self, package: Package) -> Chain:
+        """Packages whose files make up the sources of `package`, starting with the
+        package in the project that contains it. Resolved at most once per run."""
+        return self._once("chain", self._chains, package, self._resolve)
+
+    def mtime(self, package: Package) -> Tuple[Timestamp, bool]:
+        """Newest modification time of all files in the chain of `package`.
+
+        Each package of a chain is only requested once, even if many origins share
+        it.
+
+        :return:
+            - mtime: Unix timestamp of the newest file, -1 if there are none
+            - err: True if a package of the chain could not be checked
+        """
+        newest, err = -1, False
+        for node in self.chain(package):
+            node_mtime, node_err = self._once(
+                "mtime",
+                self._mtimes,
+                node,
+                lambda n: obs.package_mtime(n, self.credentials, self.api_url),
+            )
+            newest, err = max(newest, node_mtime), err or node_err
+        return newest, err
+
+    def changed_source(self, package: Package, since: Timestamp) -> Optional[Package]:
+        """The package of the chain with the newest change after `since`, if it was
+        checked during this run."""
+        changed = [
+            (self._mtimes[node][0], node)
+            for node in self._chains.get(package, ())
+            if node in self._mtimes and self._mtimes[node][0] > since
+        ]
+        return max(changed, key=lambda c: c[0])[1] if changed else None
+
+    def save(self) -> None:
+        """Write newly resolved chains to the cache file."""
+        if _cache_path is None or not self._changed:
+            return
+        data = _read(_cache_path)
+        data[self.api_url] = self._cached
+        _write(_cache_path, data)
+
+    def _resolve(self, package: Package) -> Chain:
+        key = f"{package.project}/{package.name}"
+        cached = self._cached.get(key)
+        if cached and time.time() - cached["resolved_at"] < self.ttl:
+            return tuple(
+                Package(project=project, name=name, git_managed=False)
+                for project, name in cached["chain"]
+            )
+
+        nodes = []
+        current = package
+        for _ in range(MAX_DEPTH):
+            resolved = obs.resolve_link(current, self.credentials, self.api_url)
+            if resolved is None:
+                # Checked like without links, resolved again by the next run
+                logging.warning("Could not resolve the links of %s", key)
+                return (package,)
+            physical, target = resolved
+            if physical in nodes:
+                break
+            nodes.append(physical)
+            if target is None or target in nodes:
+                break
+            current = target
+
+        with self._lock:
+            self._cached[key] = {
+                "resolved_at": int(time.time()),
+                "chain": [[node.project, node.name] for node in nodes],
+            }
+            self._changed = True
+        return tuple(nodes)
+
+    def _once(
+        self, kind: str, memo: Dict[Package, T], package: Package, func: Callable
+    ) -> T:
+        """Call `func` once per package, concurrent callers wait for the result."""
+        with self._lock:
+            lock = self._locks.setdefault((kind, package), threading.Lock())
+        with lock:
+            if package not in memo:
+                memo[package] = func(package)
+            return memo[package]
+
+
+def _read(path: pathlib.Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write(path: pathlib.Path, data: dict) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=path.parent, delete=False
+        ) as f:
+            json.dump(data, f)
+        os.replace(f.name, path)
+    except OSError as e:
+        logging.warning("Could not write %s: %s", path, e)
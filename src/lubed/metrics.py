@@ -0,0 +1,235 @@
+"""Prometheus metrics of periodic update checks, see `lubed serve`.
+
+The metrics are rendered in the Prometheus text exposition format, which
+OpenMetrics scrapers accept as well.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import bisect
+import http.server
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lubed import retry, trace
+
+# Upper bounds of the check duration histogram buckets, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (bundle package name, origin project name, origin package name)
+Result = Tuple[str, str, str]
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+
+
+class Metrics:
+    """Results of the last check cycle and counters across all cycles."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origins: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}
+        self._failed: Dict[str, int] = {}
+        self._failures_total: Counter = Counter()
+        self._durations: Dict[str, _Histogram] = {}
+        self._cycles = 0
+        self._cycle_errors = 0
+        self._cycle_duration = 0.0
+        self._last_success: Optional[float] = None
+
+    def record_cycle(
+        self,
+        origin_projects: Iterable[str],
+        updates: List[Result],
+        failures: List[Result],
+        spans: List[trace.Span],
+        duration: float,
+    ) -> None:
+        """Store the results of a successful check cycle.
+
+        :param origin_projects: Origin project of every checked package
+        :param updates: Packages that need an update
+        :param failures: Packages that failed to check
+        :param spans: Spans recorded during the cycle, the "check" spans are used
+        :param duration: Seconds the cycle took
+        """
+        with self._lock:
+            self._origins = dict(Counter(origin_projects))
+            self._pending = dict(Counter(project for _, project, _ in updates))
+            self._failed = dict(Counter(project for _, project, _ in failures))
+            self._failures_total.update(project for _, project, _ in failures)
+            for span in spans:
+                if span.name == "check":
+                    backend = span.attributes["backend"]
+                    histogram = self._durations.setdefault(backend, _Histogram())
+                    histogram.observe(span.duration / 1e9)
+            self._cycles += 1
+            self._cycle_duration = duration
+            self._last_success = time.time()
+
+    def record_error(self) -> None:
+        """Count a check cycle that could not run at all."""
+        with self._lock:
+            self._cycles += 1
+            self._cycle_errors += 1
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            _gauge(
+                lines,
+                "lubed_origin_packages",
+                "Origin packages in the configuration.",
+                {("origin_project", p): n for p, n in self._origins.items()},
+            )
+            _gauge(
+                lines,
+                "lubed_packages_pending_update",
+                "Packages updated in their origin since the last execution.",
+                {("origin_project", p): self._pending.get(p, 0) for p in self._origins},
+            )
+            _gauge(
+                lines,
+                "lubed_packages_failed",
+                "Packages that failed to check in the last cycle.",
+                {("origin_project", p): self._failed.get(p, 0) for p in self._origins},
+            )
+            _counter(
+                lines,
+                "lubed_check_failures_total",
+                "Failed package checks.",
+                {("origin_project", p): n for p, n in self._failures_total.items()},
+            )
+            lines.append(
+                "# HELP lubed_check_duration_seconds Duration of package checks."
+            )
+            lines.append("# TYPE lubed_check_duration_seconds histogram")
+            for backend, histogram in sorted(self._durations.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'lubed_check_duration_seconds_bucket{{backend="{backend}",'
+                        f'le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'lubed_check_duration_seconds_sum{{backend="{backend}"}} '
+                    f"{histogram.total}"
+                )
+                lines.append(
+                    f'lubed_check_duration_seconds_count{{backend="{backend}"}} '
+                    f"{cumulative}"
+                )
+            _counter(lines, "lubed_cycles_total", "Check cycles.", {(): self._cycles})
+            _counter(
+                lines,
+                "lubed_cycle_errors_total",
+                "Check cycles that could not run.",
+                {(): self._cycle_errors},
+            )
+            _gauge(
+                lines,
+                "lubed_cycle_duration_seconds",
+                "Duration of the last successful check cycle.",
+                {(): self._cycle_duration},
+            )
+            if self._last_success is not None:
+                _gauge(
+                    lines,
+                    "lubed_last_success_timestamp_seconds",
+                    "Unix time of the last successful check cycle.",
+                    {(): self._last_success},
+                )
+                _gauge(
+                    lines,
+                    "lubed_last_success_age_seconds",
+                    "Seconds since the last successful check cycle.",
+                    {(): time.time() - self._last_success},
+                )
+
+        host_stats = retry.stats()
+        _counter(
+            lines,
+            "lubed_remote_calls_total",
+            "Calls to remote hosts, without retries.",
+            {("host", h): s.calls for h, s in host_stats.items()},
+        )
+        _counter(
+            lines,
+            "lubed_remote_retries_total",
+            "Retried calls to remote hosts.",
+            {("host", h): s.retries for h, s in host_stats.items()},
+        )
+        _counter(
+            lines,
+            "lubed_remote_failures_total",
+            "Calls to remote hosts that failed after all retries.",
+            {("host", h): s.failures for h, s in host_stats.items()},
+        )
+        _counter(
+            lines,
+            "lubed_remote_rejected_total",
+            "Calls to remote hosts rejected by an open circuit breaker.",
+            {("host", h): s.rejected for h, s in host_stats.items()},
+        )
+        return "\n".join(lines) + "\n"
+
+
+def start_server(
+    metrics: Metrics, address: str = "127.0.0.1", port: int = 9464
+) -> http.server.ThreadingHTTPServer:
+    """Serve `metrics` on /metrics in a background thread.
+
+    :return: The server, `server.server_port` is the port it listens on
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _gauge(lines: List[str], name: str, help_text: str, samples: Dict) -> None:
+    _metric(lines, name, "gauge", help_text, samples)
+
+
+def _counter(lines: List[str], name: str, help_text: str, samples: Dict) -> None:
+    _metric(lines, name, "counter", help_text, samples)
+
+
+def _metric(
+    lines: List[str], name: str, kind: str, help_text: str, samples: Dict
+) -> None:
+    """Append a metric, `samples` maps (label, value) tuples, or (), to values."""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for label, value in sorted(samples.items()):
+        if label:
+            escaped = label[1].replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{name}{{{label[0]}="{escaped}"}} {value}')
+        else:
+            lines.append(f"{name} {value}")
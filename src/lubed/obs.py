@@ -1,14 +1,49 @@
 """OBS API mini client."""
 
 # SPDX-License-Identifier: GPL-3.0-or-later
+import datetime
 import functools
+import io
+import math
+import re
+import time
 import urllib.parse
-from typing import List, Tuple
+from contextlib import contextmanager
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from xml.etree import ElementTree
+from xml.parsers import expat
 
 import requests
+import urllib3
 
-from lubed import OBSCredentials, Package, Timestamp
+from lubed import OBSCredentials, Package, Timestamp, trace, transport
+
+# Number of packages that are queried together in bulk requests, keeps URLs short.
+BULK_CHUNK_SIZE = 50
+# Entries requested from /statistics/latest_updated for a whole project
+LATEST_UPDATED_LIMIT = 5000
+
+# Response bodies are read while they are parsed, reading can fail as well
+_STREAM_ERRORS = (
+    requests.RequestException,
+    urllib3.exceptions.HTTPError,
+    ElementTree.ParseError,
+)
+
+XMLSource = Union[str, BinaryIO]
+
+_XML_ERROR_NO_ELEMENTS = expat.errors.codes[expat.errors.XML_ERROR_NO_ELEMENTS]
 
 
 def list_packages(
@@ -23,14 +58,14 @@ def list_packages(
     :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
     :return: List of package names
     """
-    response_text = _query_packages_list(
-        project_name=project_name,
-        credentials=credentials,
-        api_url=api_url,
+    return list(
+        _query_packages_list(
+            project_name=project_name,
+            credentials=credentials,
+            api_url=api_url,
+        )
     )
 
-    return _parse_packages_list(response_text)
-
 
 def package_was_updated(
     last_check: Timestamp,
@@ -51,17 +86,89 @@ def package_was_updated(
         - err: True if an error occurred during the verification, False otherwise
     """
     del gitserver_url  # not used
-    response_text, err = _query_package(
+    timestamps, err = _query_package(
         package=package,
         credentials=credentials,
         api_url=api_url,
     )
 
-    timestamps = _extract_package_timestamps(response_text)
-
     return _any_timestamp_is_newer(timestamps, last_check), err
 
 
+def package_mtime(
+    package: Package,
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Tuple[Timestamp, bool]:
+    """Get the newest modification time of all files in an OBS package.
+
+    :param package: OBS package to check
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return:
+        - mtime: Unix timestamp of the newest file, -1 if there are none
+        - err: True if an error occurred during the verification, False otherwise
+    """
+    timestamps, err = _query_package(
+        package=package,
+        credentials=credentials,
+        api_url=api_url,
+    )
+
+    return max(timestamps, default=-1), err
+
+
+def fingerprint(
+    package: Package,
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> str:
+    """Get the source MD5 of an OBS package.
+
+    The source info is only a few hundred bytes, in contrast to the full file list.
+
+    :param package: OBS package to check
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: srcmd5 of the current revision, "" on errors
+    """
+    url = f"{api_url}/source/{package.project}/{package.name}?view=info"
+    try:
+        return _query_sourceinfo(url, credentials).get(package.name, "")
+    except requests.RequestException:
+        return ""
+
+
+def fingerprints(
+    packages: Iterable[Package],
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Dict[Package, str]:
+    """Get the source MD5s of many OBS packages, with one request per project.
+
+    Packages that are missing from the result, e.g. because they are inherited from a
+    linked project, need to be queried with `fingerprint`.
+
+    :param packages: OBS packages to check
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: Mapping of packages to the srcmd5 of their current revision
+    """
+    result = {}
+    for project, chunk in _chunks_by_project(packages):
+        params = urllib.parse.urlencode(
+            [("view", "info")] + [("package", p.name) for p in chunk]
+        )
+        try:
+            srcmd5s = _query_sourceinfo(
+                f"{api_url}/source/{project}?{params}", credentials
+            )
+        except requests.RequestException:
+            continue
+        result.update({p: srcmd5s[p.name] for p in chunk if p.name in srcmd5s})
+    return result
+
+
 def list_subprojects(
     project_name: str,
     credentials: OBSCredentials,
@@ -74,91 +181,434 @@ def list_subprojects(
     :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
     :return: List of package names
     """
-    response_text = _query_subprojects_list(
-        project_name=project_name,
-        credentials=credentials,
-        api_url=api_url,
+    return list(
+        _query_subprojects_list(
+            project_name=project_name,
+            credentials=credentials,
+            api_url=api_url,
+        )
     )
 
-    return _parse_subprojects_list(response_text)
-
 
 def package_in_project(
     package_name: str, project_name: str, credentials: OBSCredentials, api_url: str
 ) -> bool:
-    return _query_package(
+    """Check if an OBS package exists in a project, including inherited packages."""
+    return not _query_package(
         Package(name=package_name, project=project_name, git_managed=False),
         credentials,
         api_url,
     )[1]
 
 
-@functools.lru_cache
-def _query_subprojects_list(
-    project_name: str, credentials: OBSCredentials, api_url: str
-):
+def projects_containing(
+    package_names: Iterable[str],
+    project_name: str,
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Optional[Dict[str, List[str]]]:
+    """Find the subprojects of an OBS project that contain packages, in one request.
+
+    Only packages that exist in a project itself are found, packages inherited from
+    linked projects are not.
+
+    :param package_names: Names of OBS packages
+    :param project_name: Name of the OBS project, which is included in the search
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: Mapping of package names to the sorted names of the projects that
+        contain them, None if the search failed
+    """
+    package_names = list(package_names)
+    if not package_names:
+        return {}
+
     try:
-        url = f"{api_url}/search/project/id?match=" + urllib.parse.quote(
-            f'starts_with(@name, "{project_name}")'
+        found = _search_packages(
+            f"starts_with(@project, '{project_name}')",
+            package_names,
+            credentials,
+            api_url,
         )
-        response = requests.get(url, auth=credentials.as_tuple())
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException:
-        return ""
+    except _STREAM_ERRORS:
+        return None
+
+    result: Dict[str, List[str]] = {name: [] for name in package_names}
+    for project, name in sorted(found):
+        if name in result:
+            result[name].append(project)
+    return result
+
+
+def changed_packages(
+    project_name: str,
+    since: Timestamp,
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Optional[Set[str]]:
+    """List the packages of a project that changed since a known timestamp.
+
+    :param project_name: Name of the OBS project
+    :param since: Unix timestamp
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: Names of the changed packages, None if the query failed or the project
+        had too many changes to list
+    """
+    try:
+        return _latest_updated(project_name, None, since, credentials, api_url)
+    except _STREAM_ERRORS:
+        return None
+
+
+def packages_in_project(
+    project_name: str,
+    package_names: Iterable[str],
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Optional[Set[str]]:
+    """Find the packages that exist in a project itself, not through project links.
+
+    :param project_name: Name of the OBS project
+    :param package_names: Names of the packages to look for
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: Subset of `package_names`, None if the search failed
+    """
+    names = sorted(set(package_names))
+    present = set()
+    for start in range(0, len(names), BULK_CHUNK_SIZE):
+        chunk = names[start : start + BULK_CHUNK_SIZE]
+        try:
+            found = _search_packages(
+                f"@project='{project_name}'", chunk, credentials, api_url
+            )
+        except _STREAM_ERRORS:
+            return None
+        present.update(name for _, name in found)
+    return present
+
+
+def unchanged_packages(
+    last_check: Timestamp,
+    packages: Iterable[Package],
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Set[Package]:
+    """Find packages that were not changed since a known timestamp, in bulk.
+
+    Packages are grouped by project. For each group, one search request finds the
+    packages that exist in the project itself, and one statistics request lists
+    those that were changed since `last_check`. Packages that exist but were not
+    changed are returned. All other packages, e.g. those inherited from a linked
+    project or those that failed to query, are not included and need to be checked
+    with `package_was_updated`.
+
+    :param last_check: Unix timestamp of the last check
+    :param packages: OBS packages to check
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: Set of packages that were not changed since last_check
+    """
+    unchanged = set()
+    for project, chunk in _chunks_by_project(packages):
+        names = sorted({p.name for p in chunk})
+        try:
+            present = {
+                name
+                for _, name in _search_packages(
+                    f"@project='{project}'", names, credentials, api_url
+                )
+            }
+            changed = _latest_updated(project, names, last_check, credentials, api_url)
+        except _STREAM_ERRORS:
+            continue
+        if changed is None:
+            continue
+        unchanged.update(
+            p for p in chunk if p.name in present and p.name not in changed
+        )
+    return unchanged
+
+
+def resolve_link(
+    package: Package,
+    credentials: OBSCredentials,
+    api_url: str = "https://api.opensuse.org",
+) -> Optional[Tuple[Package, Optional[Package]]]:
+    """Find where the sources of an OBS package are, with two requests.
+
+    The package's meta data names the project that really contains the package,
+    which differs from `package.project` if the package is inherited through project
+    links. The file list of that package names the target of its source link, if
+    the package is a link, e.g. a branch with patches on top of another package.
+
+    :param package: OBS package
+    :param credentials: OBS API credentials
+    :param api_url: Base URL of the OBS API server, defaults to https://api.opensuse.org
+    :return: None if a query failed, otherwise
+        - The package in the project that contains it
+        - The target of its source link, None if it's not a link
+    """
+    try:
+        with trace.span("obs.meta", package=f"{package.project}/{package.name}"):
+            response = transport.get(
+                f"{api_url}/source/{package.project}/{package.name}/_meta",
+                auth=credentials.as_tuple(),
+            )
+        meta = ElementTree.fromstring(response.text).attrib
+        physical = Package(
+            project=meta.get("project", package.project),
+            name=meta.get("name", package.name),
+            git_managed=False,
+        )
+
+        url = f"{api_url}/source/{physical.project}/{physical.name}"
+        with trace.span(
+            "obs.link", package=f"{physical.project}/{physical.name}"
+        ), transport.stream(url, auth=credentials.as_tuple()) as body:
+            link = next(_iter_children(body, "linkinfo"), None)
+    except _STREAM_ERRORS:
+        return None
+    if link is None:
+        return physical, None
+    return physical, Package(
+        project=link["project"],
+        name=link.get("package", physical.name),
+        git_managed=False,
+    )
+
+
+def clear_caches() -> None:
+    """Forget project listings and file lists that were fetched before.
+
+    Long-running processes need to call this before checking for updates again.
+    Responses are still revalidated with the persistent cache, if it's in use.
+    """
+    _fetch_subprojects_list.cache_clear()
+    _fetch_packages_list.cache_clear()
+    _fetch_package_timestamps.cache_clear()
+
+
+def _query_subprojects_list(
+    project_name: str, credentials: OBSCredentials, api_url: str
+) -> Tuple[str, ...]:
+    with _traced("obs.list_subprojects", project=project_name) as attributes:
+        try:
+            return _fetch_subprojects_list(project_name, credentials, api_url)
+        except _STREAM_ERRORS as e:
+            attributes["error"] = type(e).__name__
+            return ()
+
+
+# The _fetch_* functions raise on errors, so that only successful results are cached.
+@functools.lru_cache
+def _fetch_subprojects_list(
+    project_name: str, credentials: OBSCredentials, api_url: str
+) -> Tuple[str, ...]:
+    url = f"{api_url}/search/project/id?match=" + urllib.parse.quote(
+        f'starts_with(@name, "{project_name}")'
+    )
+    with transport.stream(url, auth=credentials.as_tuple()) as body:
+        return tuple(_parse_subprojects_list(body))
 
 
 def _any_timestamp_is_newer(timestamps: List[Timestamp], base: Timestamp):
     return any(ts > base for ts in timestamps)
 
 
-@functools.lru_cache
 def _query_packages_list(
     project_name: str, credentials: OBSCredentials, api_url: str
-) -> str:
-    try:
-        url = f"{api_url}/source/{project_name}"
-        response = requests.get(url, auth=credentials.as_tuple())
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException:
-        return ""
+) -> Tuple[str, ...]:
+    with _traced("obs.list_packages", project=project_name) as attributes:
+        try:
+            return _fetch_packages_list(project_name, credentials, api_url)
+        except _STREAM_ERRORS as e:
+            attributes["error"] = type(e).__name__
+            return ()
+
 
+@functools.lru_cache
+def _fetch_packages_list(
+    project_name: str, credentials: OBSCredentials, api_url: str
+) -> Tuple[str, ...]:
+    url = f"{api_url}/source/{project_name}"
+    with transport.stream(url, auth=credentials.as_tuple()) as body:
+        return tuple(_parse_packages_list(body))
 
-def _parse_packages_list(response_text: str) -> List[str]:
-    if not response_text:
-        return []
 
-    root = ElementTree.fromstring(response_text)
-    return [package.attrib["name"] for package in root.findall("./entry")]
+def _parse_packages_list(source: XMLSource) -> List[str]:
+    return [entry["name"] for entry in _iter_children(source, "entry")]
 
 
-def _parse_subprojects_list(response_text: str) -> List[str]:
-    if not response_text:
-        return []
+def _parse_subprojects_list(source: XMLSource) -> List[str]:
+    return [project["name"] for project in _iter_children(source, "project")]
 
-    root = ElementTree.fromstring(response_text)
-    return [package.attrib["name"] for package in root.findall("./project")]
 
+def _extract_package_timestamps(source: XMLSource) -> List[Timestamp]:
+    return [Timestamp(entry["mtime"]) for entry in _iter_children(source, "entry")]
 
-def _extract_package_timestamps(response_text) -> List[Timestamp]:
-    if not response_text:
-        return []
 
-    root = ElementTree.fromstring(response_text)
-    return [Timestamp(package.attrib["mtime"]) for package in root.findall("./entry")]
+def _iter_children(source: XMLSource, tag: str) -> Iterator[Dict[str, str]]:
+    """Parse XML incrementally and yield the attributes of the root's `tag` children.
+
+    Parsed elements are discarded right away, so memory use doesn't depend on the
+    size of the document.
+    """
+    if isinstance(source, str):
+        if not source:
+            return
+        source = io.StringIO(source)
+
+    depth = 0
+    root = None
+    try:
+        for event, element in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth == 1:
+                if element.tag == tag:
+                    yield element.attrib
+                root.clear()
+    except ElementTree.ParseError as e:
+        # An empty body has no children, like an empty string
+        if root is not None or e.code != _XML_ERROR_NO_ELEMENTS:
+            raise
 
 
-@functools.lru_cache
 def _query_package(
     package: Package,
     credentials: OBSCredentials,
     api_url: str,
-) -> Tuple[str, bool]:
+) -> Tuple[Tuple[Timestamp, ...], bool]:
+    with _traced(
+        "obs.package", package=f"{package.project}/{package.name}"
+    ) as attributes:
+        try:
+            return _fetch_package_timestamps(package, credentials, api_url), False
+        except _STREAM_ERRORS as e:
+            attributes["error"] = type(e).__name__
+            return (), True
+
+
+@contextmanager
+def _traced(name: str, **attributes) -> Iterator[Dict[str, Any]]:
+    """Trace a query of an lru_cache'd _fetch_* function. The transport sets the
+    cache attribute for each request, without one the result was memoized."""
+    with trace.span(name, **attributes) as span_attributes:
+        try:
+            yield span_attributes
+        finally:
+            span_attributes.setdefault("cache", "memory")
+
+
+@functools.lru_cache
+def _fetch_package_timestamps(
+    package: Package,
+    credentials: OBSCredentials,
+    api_url: str,
+) -> Tuple[Timestamp, ...]:
+    url = f"{api_url}/source/{package.project}/{package.name}"
+    with transport.stream(url, auth=credentials.as_tuple()) as body:
+        return tuple(_extract_package_timestamps(body))
+
+
+def _chunks_by_project(
+    packages: Iterable[Package],
+) -> Iterator[Tuple[str, List[Package]]]:
+    by_project: Dict[str, List[Package]] = {}
+    for package in packages:
+        by_project.setdefault(package.project, []).append(package)
+
+    for project, project_packages in by_project.items():
+        for start in range(0, len(project_packages), BULK_CHUNK_SIZE):
+            yield project, project_packages[start : start + BULK_CHUNK_SIZE]
+
+
+def _query_sourceinfo(url: str, credentials: OBSCredentials) -> Dict[str, str]:
+    with trace.span("obs.sourceinfo", url=url):
+        response = transport.get(url, auth=credentials.as_tuple())
+    root = ElementTree.fromstring(response.text)
+    return {
+        info.attrib["package"]: info.attrib["srcmd5"]
+        for info in root.iter("sourceinfo")
+        if "srcmd5" in info.attrib and info.find("error") is None
+    }
+
+
+def _search_packages(
+    project_match: str,
+    package_names: Iterable[str],
+    credentials: OBSCredentials,
+    api_url: str,
+) -> List[Tuple[str, str]]:
+    """Search packages by name, return (project, package) tuples."""
+    names = " or ".join(f"@name='{name}'" for name in package_names)
+    url = f"{api_url}/search/package/id?match=" + urllib.parse.quote(
+        f"{project_match} and ({names})"
+    )
+    with trace.span("obs.search", url=url), transport.stream(
+        url, auth=credentials.as_tuple()
+    ) as body:
+        return [
+            (package["project"], package["name"])
+            for package in _iter_children(body, "package")
+        ]
+
+
+def _latest_updated(
+    project_name: str,
+    package_names: Optional[List[str]],
+    since: Timestamp,
+    credentials: OBSCredentials,
+    api_url: str,
+) -> Optional[Set[str]]:
+    """Names of packages in a project that changed since `since`. Without
+    `package_names`, all packages of the project are considered.
+
+    OBS takes the time limit in days and lists at most `limit` entries. The entries
+    are filtered by their update time here. None is returned if the listing was cut
+    off by the limit.
+    """
+    days = max(1, math.ceil((time.time() - since) / (24 * 60 * 60)))
+    if package_names is not None:
+        limit = len(package_names) + 1
+    else:
+        limit = LATEST_UPDATED_LIMIT
+    params = {
+        "timelimit": days,
+        "limit": limit,
+        "prjfilter": f"^{re.escape(project_name)}$",
+    }
+    if package_names is not None:
+        params["pkgfilter"] = "^(" + "|".join(map(re.escape, package_names)) + ")$"
+    params = urllib.parse.urlencode(params)
+    url = f"{api_url}/statistics/latest_updated?{params}"
+    with trace.span("obs.latest_updated", project=project_name):
+        response = transport.get(url, auth=credentials.as_tuple())
+    root = ElementTree.fromstring(response.text)
+    if len(root) >= limit:
+        return None
+    return {
+        package.attrib["name"]
+        for package in root.findall("./package")
+        if package.attrib.get("project") == project_name
+        and _updated_at(package.attrib.get("updated", "")) > since
+    }
+
+
+def _updated_at(value: str) -> float:
+    """Unix timestamp of an `updated` attribute, infinity if it can't be parsed, so
+    that the package counts as changed."""
     try:
-        url = f"{api_url}/source/{package.project}/{package.name}"
-        response = requests.get(url, auth=credentials.as_tuple())
-        response.raise_for_status()
-        return response.text, False
-    except requests.RequestException:
-        return "", True
+        updated = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return math.inf
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=datetime.timezone.utc)
+    return updated.timestamp()
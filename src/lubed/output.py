@@ -0,0 +1,76 @@
+"""Machine-readable output of command results.
+
+Every command writes records with a fixed set of fields, in one of these formats:
+
+- json: a single array of objects, written when the command is done
+- ndjson: one object per line, written as soon as the record is known
+- csv: a header line with the field names, then one line per record
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import csv
+import json
+import sys
+from typing import Any, Dict, List, Sequence, TextIO
+
+FORMATS = ("table", "json", "ndjson", "csv")
+
+# Fields of the records written by each command
+UPDATE_FIELDS = (
+    "status",
+    "bundle_package",
+    "origin_project",
+    "origin_package",
+    # "project/package" whose change made the update, see `resolve_links`
+    "changed_source",
+)
+PACKAGE_FIELDS = ("project", "package")
+
+
+class Writer:
+    """Write records in a machine-readable format.
+
+    :param output_format: One of "json", "ndjson" or "csv"
+    :param fields: Names of the fields of every record, in the order of CSV columns
+    :param stream: Where to write the records, stdout by default
+    """
+
+    def __init__(
+        self, output_format: str, fields: Sequence[str], stream: TextIO = None
+    ):
+        if output_format not in FORMATS[1:]:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.output_format = output_format
+        self.fields = tuple(fields)
+        self.stream = stream or sys.stdout
+        self._records: List[Dict[str, Any]] = []
+        self._csv = None
+
+    def write(self, *values) -> None:
+        """Write a record, `values` are in the order of `fields`. Missing values at
+        the end are empty."""
+        record = dict(zip(self.fields, values + ("",) * len(self.fields)))
+        if self.output_format == "json":
+            self._records.append(record)
+            return
+        if self.output_format == "ndjson":
+            self.stream.write(json.dumps(record) + "\n")
+        else:
+            if self._csv is None:
+                self._csv = csv.DictWriter(
+                    self.stream, fieldnames=self.fields, lineterminator="\n"
+                )
+                self._csv.writeheader()
+            self._csv.writerow(record)
+        # Consumers of a pipe can act on each record right away
+        self.stream.flush()
+
+    def close(self) -> None:
+        """Finish the output. JSON is only written here, so is the CSV header if
+        there were no records."""
+        if self.output_format == "json":
+            json.dump(self._records, self.stream, indent=2)
+            self.stream.write("\n")
+        elif self.output_format == "csv" and self._csv is None:
+            csv.writer(self.stream, lineterminator="\n").writerow(self.fields)
+        self.stream.flush()
@@ -0,0 +1,203 @@
+"""Adaptive per-host rate limits for remote calls.
+
+Every OBS, git and GitHub call takes a token from the bucket of its host first.
+Buckets refill at the configured rate. That rate adapts to the servers: it's cut
+when a server throttles with 429 or 503, and it grows back slowly with every
+successful call. Servers that announce their quota, like GitHub with
+X-RateLimit-Remaining and X-RateLimit-Reset, cap it to what's left of the quota.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import collections
+import email.utils
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional
+
+# Status codes of responses that mean the server throttles the client
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+@dataclass
+class Settings:
+    # Calls per second per host, 0 means no limit until a server throttles
+    rate: float = 0.0
+    # Calls that can be made at once after a pause
+    burst: int = 10
+    # The rate is never cut below this
+    min_rate: float = 0.2
+    # Factor the rate is multiplied with when a server throttles
+    backoff: float = 0.5
+    # Calls per second the rate grows with each successful call, up to `rate`
+    increase: float = 0.05
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts to throttling by the server.
+
+    :param rate: Initial and highest rate in calls per second, 0 for unlimited
+    :param settings: Burst size and how the rate adapts
+    """
+
+    def __init__(self, rate: float, settings: Settings):
+        self.max_rate = rate or math.inf
+        self.rate = self.max_rate
+        self.settings = settings
+        self._tokens = float(settings.burst)
+        self._updated = _clock()
+        self._paused_until = 0.0
+        # Start times of the latest calls, to measure the rate while unlimited
+        self._recent = collections.deque(maxlen=64)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Wait for a token.
+
+        :return: Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = _clock()
+                delay = self._paused_until - now
+                if delay <= 0:
+                    self._refill(now)
+                    # Rounding errors must not leave a token just short of 1
+                    if self._tokens >= 1 - 1e-9:
+                        self._tokens -= 1
+                        self._recent.append(now)
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+            _sleep(delay)
+            waited += delay
+
+    def throttled(self, retry_after: Optional[float] = None) -> None:
+        """Cut the rate after the server throttled a call.
+
+        :param retry_after: Seconds the server asked to wait, no calls are made until
+            then
+        """
+        with self._lock:
+            now = _clock()
+            self._refill(now)
+            rate = min(self.rate, self._observed_rate(now))
+            self.rate = max(self.settings.min_rate, rate * self.settings.backoff)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+        logging.info("Throttled, limiting calls to %.2f per second", self.rate)
+
+    def succeeded(self) -> None:
+        """Let the rate grow back after a successful call."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(_clock())
+                self.rate = min(self.max_rate, self.rate + self.settings.increase)
+
+    def quota(self, remaining: int, reset_in: float) -> None:
+        """Spread the calls that are left of the server's quota until it resets.
+
+        :param remaining: Calls left in the current quota window
+        :param reset_in: Seconds until the quota window resets
+        """
+        with self._lock:
+            now = _clock()
+            self._refill(now)
+            reset_in = max(reset_in, 1.0)
+            if remaining <= 0:
+                self._paused_until = max(self._paused_until, now + reset_in)
+                return
+            self.rate = min(self.max_rate, max(remaining / reset_in, 1 / reset_in))
+            self._tokens = min(self._tokens, float(remaining))
+
+    def _refill(self, now: float) -> None:
+        if math.isinf(self.rate):
+            self._tokens = float(self.settings.burst)
+        else:
+            elapsed = now - self._updated
+            self._tokens = min(
+                float(self.settings.burst), self._tokens + elapsed * self.rate
+            )
+        self._updated = now
+
+    def _observed_rate(self, now: float) -> float:
+        if len(self._recent) >= 2 and now > self._recent[0]:
+            return len(self._recent) / (now - self._recent[0])
+        return self.rate if math.isfinite(self.rate) else float(self.settings.burst)
+
+
+_settings = Settings()
+_host_rates: Dict[str, float] = {}
+_buckets: Dict[str, TokenBucket] = {}
+_lock = threading.Lock()
+_sleep = time.sleep
+_clock = time.monotonic
+
+
+def configure(hosts: Optional[Mapping[str, float]] = None, **settings) -> None:
+    """Replace the settings, e.g. with the [rate_limit] table of the config file.
+
+    :param hosts: Rates of single hosts, e.g. {"https://api.github.com": 10}, that
+        replace the default `rate`
+    :param settings: Fields of :class:`Settings`
+    """
+    global _settings, _host_rates
+    with _lock:
+        _settings = Settings(**settings)
+        _host_rates = dict(hosts or {})
+        _buckets.clear()
+
+
+def bucket(host: str) -> TokenBucket:
+    """Return the bucket of `host`, "<scheme>://<netloc>"."""
+    with _lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(
+                _host_rates.get(host, _settings.rate), _settings
+            )
+        return _buckets[host]
+
+
+def observe(
+    host: str, status: Optional[int], headers: Mapping[str, str], retry_after=None
+) -> None:
+    """Adapt the rate of `host` to a response.
+
+    :param host: Host that answered
+    :param status: HTTP status code, None if the call failed without a response
+    :param headers: Response headers, the X-RateLimit headers are used
+    :param retry_after: Seconds the server asked to wait with Retry-After
+    """
+    limiter = bucket(host)
+    if status in THROTTLE_STATUS_CODES:
+        limiter.throttled(retry_after)
+        return
+    headers = {key.lower(): value for key, value in headers.items()}
+    remaining = headers.get("x-ratelimit-remaining")
+    reset = headers.get("x-ratelimit-reset")
+    if remaining is not None and reset is not None:
+        try:
+            # The reset time is a Unix timestamp
+            limiter.quota(int(remaining), float(reset) - time.time())
+            return
+        except ValueError:
+            pass
+    if status is not None and status < 400:
+        limiter.succeeded()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, seconds or an HTTP date."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,139 @@
+"""Results of update checks that are stored in files and merged later.
+
+Checks can be split into shards, e.g. across CI runners, with `lubed updates
+--shard i/N --results <file>`. `lubed merge` combines the result files of all shards.
+
+Sharded runs don't move the last execution time on, they all check against the same
+one. The result files carry what each shard recorded in the state file, and the
+state is committed once from the merged results.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lubed import Timestamp
+
+# (bundle package name, origin project name, origin package name)
+Row = Tuple[str, str, str]
+# (index, count), the index starts at 1
+Shard = Tuple[int, int]
+
+FORMAT_VERSION = 1
+
+
+class ResultsError(Exception):
+    ...
+
+
+@dataclass
+class Results:
+    last_execution: Timestamp
+    shard: Shard = (1, 1)
+    updates: List[Row] = field(default_factory=list)
+    failures: List[Row] = field(default_factory=list)
+    # Time the checks started, the next last execution time; 0 if unknown
+    checked_at: Timestamp = 0
+    # State file entries of the checked packages, see `StateStore.entries`
+    packages: Dict[str, dict] = field(default_factory=dict)
+    # Position the change feeds were read to, None without feeds
+    cursor: Optional[Timestamp] = None
+
+
+def parse_shard(spec: str) -> Shard:
+    """Parse "i/N", the i-th of N shards, starting at 1."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError as e:
+        raise ValueError(f"'{spec}' is not of the form i/N") from e
+    if not 1 <= index <= count:
+        raise ValueError(f"'{spec}' is not of the form i/N with 1 <= i <= N")
+    return index, count
+
+
+def in_shard(bundle_name: str, shard: Shard) -> bool:
+    """Whether the origin of `bundle_name` is checked by `shard`.
+
+    The hash is stable across hosts and Python versions, unlike `hash`.
+    """
+    index, count = shard
+    return zlib.crc32(bundle_name.encode("utf-8")) % count == index - 1
+
+
+def save(path: str, results: Results) -> None:
+    data = {
+        "version": FORMAT_VERSION,
+        "last_execution": results.last_execution,
+        "shard": list(results.shard),
+        "updates": results.updates,
+        "failures": results.failures,
+        "checked_at": results.checked_at,
+        "packages": results.packages,
+        "cursor": results.cursor,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def load(path: str) -> Results:
+    """Read a results file written by `save`.
+
+    :raises ResultsError: The file can't be read or has an unknown format
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["version"] != FORMAT_VERSION:
+            raise ResultsError(f"{path}: unknown format version {data['version']}")
+        return Results(
+            last_execution=data["last_execution"],
+            shard=tuple(data["shard"]),
+            updates=[tuple(row) for row in data["updates"]],
+            failures=[tuple(row) for row in data["failures"]],
+            checked_at=data.get("checked_at", 0),
+            packages=data.get("packages", {}),
+            cursor=data.get("cursor"),
+        )
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ResultsError(f"Could not read {path}: {e}") from e
+
+
+def merge(partial: Iterable[Results], order: Optional[Iterable[str]] = None) -> Results:
+    """Combine the results of all shards of one run.
+
+    :param partial: Results of every shard, each exactly once
+    :param order: Bundle package names, rows are sorted in this order. Rows of other
+        packages are sorted by name and come last.
+    :raises ResultsError: Shards are missing, duplicated, or from different runs
+    """
+    partial = list(partial)
+    if not partial:
+        raise ResultsError("No results to merge")
+    count = partial[0].shard[1]
+    shards = sorted(r.shard for r in partial)
+    expected = [(index, count) for index in range(1, count + 1)]
+    if shards != expected:
+        found = ", ".join(f"{index}/{n}" for index, n in shards)
+        raise ResultsError(f"Expected shards 1/{count} to {count}/{count}, got {found}")
+    if len({r.last_execution for r in partial}) > 1:
+        raise ResultsError("Results were checked against different last executions")
+
+    positions = {name: position for position, name in enumerate(order or ())}
+
+    def key(row: Row):
+        return (positions.get(row[0], len(positions)), row[0])
+
+    # The earliest shard decides, changes after it started are seen by the next run
+    checked_at = [r.checked_at for r in partial if r.checked_at]
+    cursors = [r.cursor for r in partial if r.cursor is not None]
+    return Results(
+        last_execution=partial[0].last_execution,
+        shard=(1, 1),
+        updates=sorted((row for r in partial for row in r.updates), key=key),
+        failures=sorted((row for r in partial for row in r.failures), key=key),
+        checked_at=min(checked_at, default=0),
+        packages={k: v for r in partial for k, v in r.packages.items()},
+        cursor=min(cursors) if len(cursors) == len(partial) else None,
+    )
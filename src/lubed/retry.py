@@ -0,0 +1,190 @@
+"""Retries with backoff and per-host circuit breakers for remote calls.
+
+All remote calls, OBS and Gitea API requests as well as git network operations, go
+through `call`. Failed attempts that look transient are retried with jittered
+exponential backoff, or after the delay the server asked for with Retry-After. A
+host that keeps failing trips its circuit breaker, then calls to it fail right away
+until the breaker allows a trial call again.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import dataclasses
+import logging
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Server-requested delays above this are not waited for, the call fails instead.
+MAX_RETRY_AFTER = 300
+# Latencies kept per host, the counters cover all calls of a long-running process
+LATENCY_SAMPLES = 1000
+
+
+class TransientError(Exception):
+    """A failure that is worth retrying."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+@dataclass
+class Policy:
+    attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    # Consecutive failed attempts that open the circuit breaker of a host
+    failure_threshold: int = 8
+    # Seconds until an open circuit breaker allows a trial call
+    reset_timeout: float = 60.0
+
+
+@dataclass
+class HostStats:
+    calls: int = 0
+    retries: int = 0
+    failures: int = 0
+    rejected: int = 0
+    # The most recent LATENCY_SAMPLES
+    latencies: Deque[float] = field(
+        default_factory=lambda: deque(maxlen=LATENCY_SAMPLES)
+    )
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call may be made. Once the reset timeout passed after opening,
+        calls are allowed again until the next failure re-opens the breaker."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+_policy = Policy()
+_breakers: Dict[str, CircuitBreaker] = {}
+_stats: Dict[str, HostStats] = {}
+_lock = threading.Lock()
+_sleep = time.sleep
+
+
+def configure(**settings) -> None:
+    """Replace the retry policy, e.g. with the [retry] table of the config file.
+
+    Circuit breakers and statistics are reset.
+    """
+    global _policy
+    with _lock:
+        _policy = Policy(**settings)
+        _breakers.clear()
+        _stats.clear()
+
+
+def call(
+    host: str,
+    func: Callable[[], T],
+    is_transient: Callable[[Exception], bool] = lambda e: isinstance(e, TransientError),
+    retry_after: Callable[[Exception], Optional[float]] = lambda e: getattr(
+        e, "retry_after", None
+    ),
+) -> T:
+    """Call `func`, retrying transient failures.
+
+    :param host: Remote host, used for the circuit breaker and statistics
+    :param func: Function that makes the remote call
+    :param is_transient: Decides if an exception raised by `func` is worth retrying
+    :param retry_after: Returns the delay the server asked for, or None
+    :return: Return value of `func`
+    :raises CircuitOpenError: The circuit breaker of `host` is open
+    :raises Exception: The last exception raised by `func`
+    """
+    with _lock:
+        policy = _policy
+        breaker = _breakers.setdefault(
+            host, CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+        )
+        stats = _stats.setdefault(host, HostStats())
+
+    for attempt in range(policy.attempts):
+        if not breaker.allow():
+            with _lock:
+                stats.rejected += 1
+            raise CircuitOpenError(f"Too many failures, not calling {host} for now.")
+
+        start = time.monotonic()
+        try:
+            result = func()
+        except Exception as e:  # pylint: disable=broad-except
+            _record(stats, time.monotonic() - start, attempt)
+            if not is_transient(e):
+                breaker.record_success()  # the host answered
+                with _lock:
+                    stats.failures += 1
+                raise
+            breaker.record_failure()
+            delay = retry_after(e)
+            if attempt + 1 == policy.attempts or (
+                delay is not None and delay > MAX_RETRY_AFTER
+            ):
+                with _lock:
+                    stats.failures += 1
+                raise
+            if delay is None:
+                delay = random.uniform(
+                    0, min(policy.max_delay, policy.base_delay * 2**attempt)
+                )
+            logging.info("Retrying call to %s in %.1fs: %s", host, delay, e)
+            _sleep(delay)
+        else:
+            _record(stats, time.monotonic() - start, attempt)
+            breaker.record_success()
+            return result
+
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+def stats() -> Dict[str, HostStats]:
+    """Copies of the statistics per host since the last `configure`."""
+    with _lock:
+        return {
+            host: dataclasses.replace(
+                host_stats, latencies=deque(host_stats.latencies, LATENCY_SAMPLES)
+            )
+            for host, host_stats in _stats.items()
+        }
+
+
+def _record(stats: HostStats, latency: float, attempt: int) -> None:
+    with _lock:
+        stats.latencies.append(latency)
+        if attempt == 0:
+            stats.calls += 1
+        else:
+            stats.retries += 1
@@ -0,0 +1,177 @@
+"""Persistent state of lubed runs.
+
+The state file records the time of the last execution and, for each origin package,
+what was seen during the last check. This allows skipping packages that did not
+change and re-checking only packages that failed.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import dataclasses
+import json
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set
+
+from lubed import Package, Timestamp
+
+VERSION = 1
+
+
+@dataclass
+class PackageState:
+    # Cheap identifier of the package content, e.g. a commit SHA; "" if unknown
+    fingerprint: str = ""
+    # Newest modification time seen for this fingerprint
+    mtime: Timestamp = -1
+    last_checked: Timestamp = 0
+    # Number of consecutive failed checks
+    errors: int = 0
+    # Fingerprint at the time of the last execution
+    baseline: str = ""
+
+
+class StateStore:
+    """Per-package state, safe to update from multiple threads."""
+
+    def __init__(
+        self,
+        path: str,
+        last_execution: Timestamp = 0,
+        packages: Optional[Dict[str, PackageState]] = None,
+        cursor: Timestamp = 0,
+    ):
+        self.path = path
+        self.last_execution = last_execution
+        self.packages = packages if packages is not None else {}
+        # Time up to which change feeds were read, see lubed.feed
+        self.cursor = cursor
+        # Cursor of the current run, it replaces `cursor` on `commit`
+        self.next_cursor: Optional[Timestamp] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, legacy_timestamp_file: str = "") -> "StateStore":
+        """Read the state file.
+
+        A timestamp file written by older lubed versions is migrated if the state
+        file does not exist yet. The timestamp file also takes precedence if it was
+        modified after the state file, e.g. to re-run lubed for a given time range.
+
+        :raises FileNotFoundError: Neither the state file nor the timestamp file exist
+        """
+        legacy_timestamp = None
+        if legacy_timestamp_file and os.path.exists(legacy_timestamp_file):
+            if not os.path.exists(path) or os.path.getmtime(
+                legacy_timestamp_file
+            ) > os.path.getmtime(path):
+                with open(legacy_timestamp_file, "r", encoding="utf-8") as f:
+                    legacy_timestamp = Timestamp(f.read())
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            if legacy_timestamp is None:
+                raise
+            return cls(path, legacy_timestamp)
+
+        packages = {
+            key: PackageState(**value) for key, value in data["packages"].items()
+        }
+        last_execution = data["last_execution"]
+        if legacy_timestamp is not None:
+            last_execution = legacy_timestamp
+        return cls(path, last_execution, packages, data.get("cursor", 0))
+
+    def get(self, package: Package) -> PackageState:
+        with self._lock:
+            return self.packages.get(_key(package), PackageState())
+
+    def record(
+        self,
+        package: Package,
+        fingerprint: str,
+        mtime: Timestamp,
+        checked_at: Timestamp,
+        err: bool,
+    ) -> None:
+        """Store the result of a check. Failed checks keep the previous values."""
+        with self._lock:
+            previous = self.packages.get(_key(package), PackageState())
+            if err:
+                self.packages[_key(package)] = dataclasses.replace(
+                    previous, last_checked=checked_at, errors=previous.errors + 1
+                )
+            else:
+                self.packages[_key(package)] = dataclasses.replace(
+                    previous,
+                    fingerprint=fingerprint,
+                    mtime=mtime,
+                    last_checked=checked_at,
+                    errors=0,
+                )
+
+    def entries(self, packages: Iterable[Package]) -> Dict[str, dict]:
+        """The entries of `packages`, to store them elsewhere, see `update`."""
+        keys = {_key(package) for package in packages}
+        with self._lock:
+            return {
+                key: dataclasses.asdict(value)
+                for key, value in self.packages.items()
+                if key in keys
+            }
+
+    def update(self, entries: Dict[str, dict]) -> None:
+        """Replace the state of packages with entries returned by `entries`."""
+        with self._lock:
+            for key, value in entries.items():
+                self.packages[key] = PackageState(**value)
+
+    def failed(self, package: Package) -> bool:
+        return self.get(package).errors > 0
+
+    def commit(self, last_execution: Timestamp) -> None:
+        """Set the last execution time and use the current fingerprints and feed
+        cursor as the baseline for the next execution."""
+        with self._lock:
+            self.last_execution = last_execution
+            if self.next_cursor is not None:
+                self.cursor = self.next_cursor
+                self.next_cursor = None
+            for package_state in self.packages.values():
+                if package_state.fingerprint:
+                    package_state.baseline = package_state.fingerprint
+
+    def prune(self, packages: Set[Package]) -> None:
+        """Forget packages that are not in `packages`."""
+        keep = {_key(package) for package in packages}
+        with self._lock:
+            for key in set(self.packages) - keep:
+                del self.packages[key]
+
+    def save(self) -> None:
+        """Write the state file atomically."""
+        with self._lock:
+            data = {
+                "version": VERSION,
+                "last_execution": self.last_execution,
+                "cursor": self.cursor,
+                "packages": {
+                    key: dataclasses.asdict(value)
+                    for key, value in sorted(self.packages.items())
+                },
+            }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, delete=False
+        ) as f:
+            json.dump(data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.path)
+
+
+def _key(package: Package) -> str:
+    return f"{package.project}/{package.name}"
@@ -0,0 +1,190 @@
+"""Lightweight tracing of remote calls and other slow operations.
+
+Code that might be slow wraps itself in `span`. Spans are only recorded after
+`enable` was called, otherwise `span` and `annotate` do next to nothing. Recorded
+spans can be summarized or exported in the Chrome trace event format or as
+OpenTelemetry (OTLP) JSON.
+"""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: str
+    # Unix time in nanoseconds
+    start: int
+    duration: int = 0
+    thread_id: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+_enabled = False
+_trace_id = ""
+_spans: List[Span] = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable() -> None:
+    """Start recording spans, previously recorded spans are discarded."""
+    global _enabled, _trace_id
+    with _lock:
+        _spans.clear()
+        _trace_id = secrets.token_hex(16)
+        _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def spans() -> List[Span]:
+    with _lock:
+        return list(_spans)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict[str, Any]]:
+    """Record the duration of the block as a span.
+
+    :param name: Span name, the part before the first dot is used as the backend
+    :param attributes: Initial span attributes, e.g. the package name
+    :return: Attributes of the span, can be extended within the block
+    """
+    if not _enabled:
+        yield attributes
+        return
+
+    stack = _stack()
+    current = Span(
+        name=name,
+        span_id=secrets.token_hex(8),
+        parent_id=stack[-1].span_id if stack else "",
+        start=time.time_ns(),
+        thread_id=threading.get_ident(),
+        attributes=attributes,
+    )
+    stack.append(current)
+    start = time.perf_counter_ns()
+    try:
+        yield current.attributes
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter_ns() - start
+        stack.pop()
+        with _lock:
+            _spans.append(current)
+
+
+def annotate(**attributes) -> None:
+    """Add attributes to the innermost span of the current thread.
+
+    Integer values are added to existing values, e.g. byte counts of several
+    requests within one span.
+    """
+    stack = _stack() if _enabled else []
+    if not stack:
+        return
+    current = stack[-1].attributes
+    for key, value in attributes.items():
+        if isinstance(value, int) and isinstance(current.get(key), int):
+            current[key] += value
+        else:
+            current[key] = value
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, `q` between 0 and 100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def export_chrome(path: str) -> None:
+    """Write the recorded spans in the Chrome trace event format, which can be
+    viewed with chrome://tracing or https://ui.perfetto.dev."""
+    pid = os.getpid()
+    events = [
+        {
+            "name": s.name,
+            "cat": s.name.split(".")[0],
+            "ph": "X",
+            "ts": s.start / 1000,
+            "dur": s.duration / 1000,
+            "pid": pid,
+            "tid": s.thread_id,
+            "args": s.attributes,
+        }
+        for s in spans()
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def export_otel(path: str) -> None:
+    """Write the recorded spans as OTLP JSON, as accepted by OpenTelemetry
+    collectors."""
+    otel_spans = [
+        {
+            "traceId": _trace_id,
+            "spanId": s.span_id,
+            "parentSpanId": s.parent_id,
+            "name": s.name,
+            "kind": 1 if s.name == "check" else 3,  # internal or client
+            "startTimeUnixNano": str(s.start),
+            "endTimeUnixNano": str(s.start + s.duration),
+            "attributes": [
+                {"key": key, "value": _otel_value(value)}
+                for key, value in s.attributes.items()
+            ],
+            "status": {"code": 2 if "error" in s.attributes else 0},
+        }
+        for s in spans()
+    ]
+    data = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": "lubed"}}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "lubed"}, "spans": otel_spans}],
+            }
+        ]
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def _otel_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _stack() -> List[Span]:
+    stack: Optional[List[Span]] = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
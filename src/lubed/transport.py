@@ -0,0 +1,298 @@
+"""Pooled HTTP sessions shared by all API clients."""
+
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+import logging
+import tempfile
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+import requests
+import requests.adapters
+import urllib3
+
+from lubed import cache, ratelimit, retry, trace
+
+# Seconds to wait for the server to send data before giving up.
+TIMEOUT = 60
+# Responses with these status codes are retried
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Streamed bodies that are cached are copied to a file once they exceed this size
+SPOOL_SIZE = 1024 * 1024
+
+_max_in_flight = 8
+_sessions: Dict[str, requests.Session] = {}
+_in_flight: Dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+_cache: Optional[cache.ResponseCache] = None
+
+
+def configure(max_in_flight: int) -> None:
+    """Set the maximum number of concurrent requests per host.
+
+    Sessions that were created before are closed, the next request creates a new one
+    with a connection pool that fits `max_in_flight`. Nothing changes if the limit is
+    the same as before, so that repeated checks keep their connections.
+    """
+    global _max_in_flight
+    with _lock:
+        if max_in_flight == _max_in_flight:
+            return
+        _max_in_flight = max_in_flight
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+        _in_flight.clear()
+
+
+def use_cache(response_cache: Optional[cache.ResponseCache]) -> None:
+    """Revalidate responses against `response_cache`, or disable caching with None."""
+    global _cache
+    _cache = response_cache
+
+
+def session(url: str) -> requests.Session:
+    """Return the keep-alive session used for the host of `url`."""
+    host = _host(url)
+    with _lock:
+        if host not in _sessions:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=_max_in_flight
+            )
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _sessions[host] = s
+        return _sessions[host]
+
+
+def get(
+    url: str, auth: Optional[Tuple[str, str]] = None, **kwargs
+) -> requests.Response:
+    """Send a GET request through the pooled session of the URL's host.
+
+    If a response cache is in use, cached responses are revalidated with a
+    conditional request and returned if the server answers with 304 Not Modified.
+
+    :param url: Full URL
+    :param auth: (username, password) for HTTP basic auth
+    :param kwargs: Passed to :meth:`requests.Session.get`
+    :return: Response with a successful status code
+    :raises requests.RequestException: The request failed or returned an error status
+    """
+    response_cache = _cache
+    if response_cache is None or kwargs.get("stream"):
+        trace.annotate(cache="off", requests=1)
+        response = _send(url, auth, **kwargs)
+        if not kwargs.get("stream"):
+            trace.annotate(bytes=len(response.content))
+        return response
+
+    key = _cache_key(url, auth)
+    entry = response_cache.get(key)
+    headers = _conditional_headers(entry, kwargs.pop("headers", None))
+
+    trace.annotate(cache="miss", requests=1)
+    response = _send(url, auth, headers=headers, **kwargs)
+
+    if response.status_code == 304 and entry is not None:
+        trace.annotate(cache="revalidated")
+        response_cache.touch(key)
+        response.status_code = 200
+        response._content = entry.body  # pylint: disable=protected-access
+        response.encoding = response.encoding or "utf-8"
+        return response
+
+    trace.annotate(bytes=len(response.content))
+    etag = response.headers.get("ETag", "")
+    last_modified = response.headers.get("Last-Modified", "")
+    if etag or last_modified:
+        response_cache.put(key, cache.Entry(response.content, etag, last_modified))
+    return response
+
+
+@contextmanager
+def stream(
+    url: str, auth: Optional[Tuple[str, str]] = None, **kwargs
+) -> Iterator[BinaryIO]:
+    """Send a GET request and provide the response body as a file object.
+
+    The body is read from the connection while it's consumed and never held in
+    memory as a whole. With a response cache, the body is copied to a temporary file
+    while it's read, and stored in the cache once it was consumed. Cached responses
+    are revalidated like in `get`. The request counts against the limit of requests
+    in flight until the context is left.
+
+    :param url: Full URL
+    :param auth: (username, password) for HTTP basic auth
+    :param kwargs: Passed to :meth:`requests.Session.get`
+    :raises requests.RequestException: The request failed or returned an error status
+    """
+    response_cache = _cache
+    if response_cache is None:
+        trace.annotate(cache="off", requests=1)
+        with _sent(url, auth, stream=True, **kwargs) as response, response:
+            response.raw.decode_content = True
+            try:
+                yield response.raw
+            finally:
+                # Bytes received so far, compressed
+                trace.annotate(bytes=response.raw.tell())
+        return
+
+    key = _cache_key(url, auth)
+    entry = response_cache.get(key)
+    headers = _conditional_headers(entry, kwargs.pop("headers", None))
+
+    trace.annotate(cache="miss", requests=1)
+    with _sent(url, auth, stream=True, headers=headers, **kwargs) as response, response:
+        if response.status_code == 304 and entry is not None:
+            trace.annotate(cache="revalidated")
+            response_cache.touch(key)
+            yield io.BytesIO(entry.body)
+            return
+
+        response.raw.decode_content = True
+        etag = response.headers.get("ETag", "")
+        last_modified = response.headers.get("Last-Modified", "")
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as copy:
+            body = _Tee(response.raw, copy)
+            try:
+                yield body
+            finally:
+                trace.annotate(bytes=response.raw.tell())
+            if not (etag or last_modified):
+                return
+            try:
+                # The parser can stop before the end of the body
+                body.drain()
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                logging.debug("Not caching '%s': %s", url, e)
+                return
+            copy.seek(0)
+            response_cache.put(key, cache.Entry(copy.read(), etag, last_modified))
+
+
+class _Tee(io.RawIOBase):
+    """Read from `source` and write a copy of everything that was read to `copy`."""
+
+    def __init__(self, source: BinaryIO, copy: BinaryIO):
+        self._source = source
+        self._copy = copy
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._source.read(len(buffer))
+        buffer[: len(data)] = data
+        self._copy.write(data)
+        return len(data)
+
+    def drain(self) -> None:
+        while self.read(io.DEFAULT_BUFFER_SIZE):
+            pass
+
+
+def _send(url: str, auth: Optional[Tuple[str, str]], **kwargs) -> requests.Response:
+    """Send a GET request, retrying transient failures.
+
+    :raises requests.RequestException: The request failed or returned an error status
+    """
+    with _sent(url, auth, **kwargs) as response:
+        return response
+
+
+@contextmanager
+def _sent(
+    url: str, auth: Optional[Tuple[str, str]], **kwargs
+) -> Iterator[requests.Response]:
+    """Send a GET request, retrying transient failures.
+
+    Every attempt takes a slot of the requests in flight to the host, the backoff
+    between attempts doesn't. The slot of the successful attempt is kept until the
+    context is left, so that streamed bodies count until they are read.
+
+    :raises requests.RequestException: The request failed or returned an error status
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    host = _host(url)
+    limiter = ratelimit.bucket(host)
+    slot = _slot(url)
+
+    def send_once():
+        limiter.acquire()
+        slot.acquire()
+        try:
+            response = session(url).get(url, auth=auth, **kwargs)
+            ratelimit.observe(
+                host,
+                response.status_code,
+                response.headers,
+                ratelimit.parse_retry_after(response.headers.get("Retry-After")),
+            )
+            try:
+                response.raise_for_status()
+            except requests.HTTPError:
+                response.close()
+                raise
+        except BaseException:
+            slot.release()
+            raise
+        return response
+
+    try:
+        response = retry.call(
+            host, send_once, is_transient=_is_transient, retry_after=_retry_after
+        )
+    except retry.CircuitOpenError as e:
+        raise requests.ConnectionError(str(e)) from e
+    try:
+        yield response
+    finally:
+        slot.release()
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in RETRY_STATUS_CODES
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    return ratelimit.parse_retry_after(response.headers.get("Retry-After"))
+
+
+def _slot(url: str) -> threading.BoundedSemaphore:
+    """Semaphore limiting the requests in flight to the host of `url`."""
+    host = _host(url)
+    with _lock:
+        return _in_flight.setdefault(host, threading.BoundedSemaphore(_max_in_flight))
+
+
+def _conditional_headers(
+    entry: Optional[cache.Entry], headers: Optional[Dict[str, str]]
+) -> Dict[str, str]:
+    headers = dict(headers or {})
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+def _cache_key(url: str, auth: Optional[Tuple[str, str]]) -> str:
+    # Responses can differ between users, e.g. for hidden projects.
+    user = auth[0] if auth else ""
+    return f"{user} {url}"
+
+
+def _host(url: str) -> str:
+    parsed = urllib.parse.urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
@@ -0,0 +1,133 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+
+import pytest
+import requests
+
+from lubed import cache, transport
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    c = cache.ResponseCache(tmp_path / "http.sqlite")
+    yield c
+    c.close()
+
+
+class FakeSession:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.sent_headers = None
+
+    def get(self, url, auth=None, headers=None, **kwargs):
+        self.sent_headers = headers
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = self.body
+        response.raw = io.BytesIO(self.body)
+        response.headers.update(self.headers)
+        response.url = url
+        return response
+
+
+def test_entry_roundtrip(response_cache):
+    response_cache.put("k", cache.Entry(b"<directory/>", '"abc"', ""))
+
+    assert response_cache.get("k") == cache.Entry(b"<directory/>", '"abc"', "")
+    assert response_cache.get("missing") is None
+
+
+def test_evict_by_size(tmp_path):
+    c = cache.ResponseCache(tmp_path / "http.sqlite", max_size=10)
+    c.put("old", cache.Entry(b"x" * 8, "1", ""))
+    c.put("new", cache.Entry(b"y" * 8, "2", ""))
+    c.evict()
+
+    assert c.get("old") is None or c.get("new") is None
+    c.close()
+
+
+def test_put_evicts_over_max_size(tmp_path):
+    c = cache.ResponseCache(tmp_path / "http.sqlite", max_size=10)
+    c.put("old", cache.Entry(b"x" * 8, "1", ""))
+    c.put("new", cache.Entry(b"y" * 8, "2", ""))
+
+    assert c.get("old") is None or c.get("new") is None
+    c.close()
+
+
+def test_evict_by_ttl(tmp_path):
+    c = cache.ResponseCache(tmp_path / "http.sqlite", ttl=-1)
+    c.put("k", cache.Entry(b"x", "1", ""))
+    c.evict()
+
+    assert c.get("k") is None
+    c.close()
+
+
+def test_get_revalidates(response_cache, monkeypatch):
+    url = "https://api.opensuse.org/source/openSUSE:Factory/salt"
+    monkeypatch.setattr(transport, "_cache", response_cache)
+    response_cache.put(
+        transport._cache_key(url, ("user", "pass")),
+        cache.Entry(b"<directory/>", '"abc"', ""),
+    )
+    fake = FakeSession(304)
+    monkeypatch.setattr(transport, "session", lambda _: fake)
+
+    response = transport.get(url, auth=("user", "pass"))
+
+    assert fake.sent_headers == {"If-None-Match": '"abc"'}
+    assert response.status_code == 200
+    assert response.text == "<directory/>"
+
+
+def test_get_stores_validated_response(response_cache, monkeypatch):
+    url = "https://api.opensuse.org/source/openSUSE:Factory/salt"
+    monkeypatch.setattr(transport, "_cache", response_cache)
+    monkeypatch.setattr(
+        transport,
+        "session",
+        lambda _: FakeSession(200, b"<directory/>", {"ETag": '"abc"'}),
+    )
+
+    transport.get(url, auth=("user", "pass"))
+
+    assert response_cache.get(transport._cache_key(url, ("user", "pass"))) == (
+        cache.Entry(b"<directory/>", '"abc"', "")
+    )
+
+
+def test_stream_stores_whole_body(response_cache, monkeypatch):
+    url = "https://api.opensuse.org/source/openSUSE:Factory"
+    monkeypatch.setattr(transport, "_cache", response_cache)
+    monkeypatch.setattr(
+        transport,
+        "session",
+        lambda _: FakeSession(200, b"<directory/>", {"ETag": '"abc"'}),
+    )
+
+    with transport.stream(url, auth=("user", "pass")) as body:
+        # Consumers can stop reading early
+        assert body.read(5) == b"<dire"
+
+    assert response_cache.get(transport._cache_key(url, ("user", "pass"))) == (
+        cache.Entry(b"<directory/>", '"abc"', "")
+    )
+
+
+def test_stream_revalidates(response_cache, monkeypatch):
+    url = "https://api.opensuse.org/source/openSUSE:Factory"
+    monkeypatch.setattr(transport, "_cache", response_cache)
+    response_cache.put(
+        transport._cache_key(url, ("user", "pass")),
+        cache.Entry(b"<directory/>", '"abc"', ""),
+    )
+    fake = FakeSession(304)
+    monkeypatch.setattr(transport, "session", lambda _: fake)
+
+    with transport.stream(url, auth=("user", "pass")) as body:
+        assert body.read() == b"<directory/>"
+    assert fake.sent_headers == {"If-None-Match": '"abc"'}
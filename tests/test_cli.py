@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import subprocess
+import sys
+import time
+
+# Loaded by 'lubed create-issue' or commands that talk to OBS, but not before
+HEAVY_MODULES = ("aiohttp", "github", "gql", "requests", "rich")
+# Microseconds 'import lubed.cli' may take, a multiple of what it takes today
+IMPORT_BUDGET = 250_000
+
+
+def _imported_modules(code):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_time():
+    modules = _imported_modules("import lubed.cli")
+
+    assert not [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+    assert modules["lubed.cli"] < IMPORT_BUDGET
+
+
+def test_init_loads_no_heavy_modules(tmp_path):
+    modules = _imported_modules(
+        "from lubed import cli; "
+        f"cli.cli(['init', '--last-timestamp-file', '{tmp_path}/.last_execution', "
+        f"'--state-file', '{tmp_path}/state.json'], standalone_mode=False)"
+    )
+
+    assert (tmp_path / "state.json").exists()
+    assert not [m for m in modules if m.split(".")[0] in HEAVY_MODULES]
+
+
+def test_not_in_conf_keeps_project_order(monkeypatch):
+    from click.testing import CliRunner
+
+    from lubed import OBSCredentials, cli, config, obs
+
+    bundle = "systemsmanagement:saltstack:bundle"
+    subprojects = [f"{bundle}:{name}" for name in ("a", "b", "c")]
+    listings = {
+        bundle: ["saltbundlepy-new"],
+        subprojects[0]: ["saltbundlepy-zzz", "saltbundlepy-aaa"],
+        subprojects[2]: ["saltbundlepy-c"],
+    }
+
+    def list_packages(project, *_):
+        if project not in listings:
+            raise RuntimeError("unexpected response")
+        # The project listed first arrives last
+        time.sleep(0.05 if project == bundle else 0)
+        return listings[project]
+
+    monkeypatch.setattr(config, "credentials", lambda _: OBSCredentials("user", "pass"))
+    monkeypatch.setattr(obs, "list_subprojects", lambda *_: [bundle, *subprojects])
+    monkeypatch.setattr(obs, "list_packages", list_packages)
+
+    result = CliRunner().invoke(
+        cli.cli,
+        ["--no-cache", "not-in-conf", "--search-subprojects", "--format", "csv"],
+    )
+
+    assert result.stdout.splitlines() == [
+        "project,package",
+        f"{bundle},saltbundlepy-new",
+        f"{subprojects[0]},saltbundlepy-aaa",
+        f"{subprojects[0]},saltbundlepy-zzz",
+        f"{subprojects[2]},saltbundlepy-c",
+    ]
+    # Errors don't end up in the CSV
+    assert f"Could not list the packages of {subprojects[1]}" in result.stderr
+    assert result.exit_code == 1
+
+
+def test_shards_commit_once(monkeypatch, tmp_path):
+    from click.testing import CliRunner
+
+    from lubed import Package, cli, core, results, state
+
+    state_file = str(tmp_path / "state.json")
+    timestamp_file = str(tmp_path / ".last_execution")
+    state.StateStore(state_file, 1700000000).save()
+    package = Package("SUSE:SLE-15-SP6:Update", "python311", False)
+
+    def calculate(last_execution, conf, state, shard, **_):
+        assert last_execution == 1700000000
+        # saltbundlepy of the default config
+        if results.in_shard("saltbundlepy", shard):
+            state.record(package, "abc", 1710000000, 1720000000, False)
+        return [], []
+
+    monkeypatch.setattr(core, "calculate_updated_packages", calculate)
+    runner = CliRunner()
+    for index in (1, 2):
+        result = runner.invoke(
+            cli.cli,
+            [
+                "--no-cache",
+                "updates",
+                "--state-file",
+                state_file,
+                "--last-timestamp-file",
+                timestamp_file,
+                "--shard",
+                f"{index}/2",
+                "--results",
+                str(tmp_path / f"shard-{index}.json"),
+            ],
+        )
+        assert result.exit_code == 0, result.output
+
+    # The shards check against the same last execution
+    assert state.StateStore.load(state_file).last_execution == 1700000000
+
+    result = runner.invoke(
+        cli.cli,
+        [
+            "--no-cache",
+            "merge",
+            "--state-file",
+            state_file,
+            "--last-timestamp-file",
+            timestamp_file,
+            str(tmp_path / "shard-1.json"),
+            str(tmp_path / "shard-2.json"),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    store = state.StateStore.load(state_file)
+    assert 1700000000 < store.last_execution <= time.time()
+    assert store.get(package).fingerprint == "abc"
@@ -1,9 +1,16 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
-from lubed import config
+from lubed import OBSCredentials, Package, config
+import base64
+import bz2
+import os
+import sys
 import textwrap
+import types
 import pytest
 import functools
 
+import tomli
+
 
 @pytest.fixture
 def oscrc_file(tmp_path):
@@ -51,3 +58,134 @@ def test_oscrc_missing_credentials(oscrc_file_missing_password, monkeypatch):
     with pytest.raises(config.OSCError):
         config.oscrc("https://api.opensuse.org", "user")
         config.oscrc("https://api.opensuse.org", "pass")
+
+
+def test_oscrc_parsed_once(oscrc_file, monkeypatch):
+    monkeypatch.setenv("OSC_CONFIG", oscrc_file)
+    config._parse_oscrc.cache_clear()
+
+    config.oscrc("https://api.opensuse.org", "user")
+    config.oscrc("https://api.opensuse.org", "pass")
+
+    assert config._parse_oscrc.cache_info().misses == 1
+
+
+def test_credentials_cached(oscrc_file, monkeypatch):
+    monkeypatch.setenv("OSC_CONFIG", oscrc_file)
+    monkeypatch.delenv("OBSUSER", raising=False)
+    monkeypatch.delenv("OBSPASSWD", raising=False)
+
+    credentials = config.credentials("https://api.opensuse.org")
+
+    assert credentials == OBSCredentials("myusername", "mypassword")
+    assert config.credentials("https://api.opensuse.org") is credentials
+    monkeypatch.setenv("OBSPASSWD", "frompassword")
+    assert config.credentials("https://api.opensuse.org") == OBSCredentials(
+        "myusername", "frompassword"
+    )
+
+
+def test_credentials_obfuscated(tmp_path, monkeypatch):
+    oscrc = tmp_path / ".oscrc"
+    obfuscated = base64.b64encode(bz2.compress(b"secret")).decode()
+    oscrc.write_text(
+        "[https://api.opensuse.org]\n"
+        "user=myusername\n"
+        f"pass={obfuscated}\n"
+        "credentials_mgr_class=osc.credentials.ObfuscatedConfigFileCredentialsManager\n"
+    )
+    monkeypatch.setenv("OSC_CONFIG", str(oscrc))
+    monkeypatch.delenv("OBSUSER", raising=False)
+    monkeypatch.delenv("OBSPASSWD", raising=False)
+
+    assert config.credentials("https://api.opensuse.org").password == "secret"
+
+
+def test_credentials_keyring(tmp_path, monkeypatch):
+    oscrc = tmp_path / ".oscrc"
+    oscrc.write_text(
+        "[https://api.opensuse.org]\n"
+        "user=myusername\n"
+        "credentials_mgr_class=osc.credentials.KeyringCredentialsManager:"
+        "keyring.backends.SecretService.Keyring\n"
+    )
+    monkeypatch.setenv("OSC_CONFIG", str(oscrc))
+    monkeypatch.delenv("OBSUSER", raising=False)
+    monkeypatch.delenv("OBSPASSWD", raising=False)
+    passwords = {("api.opensuse.org", "myusername"): "fromkeyring"}
+    backends = []
+
+    def load_keyring(name):
+        backends.append(name)
+        return types.SimpleNamespace(get_password=lambda *key: passwords.get(key))
+
+    keyring = types.SimpleNamespace(
+        core=types.SimpleNamespace(load_keyring=load_keyring)
+    )
+    monkeypatch.setitem(sys.modules, "keyring", keyring)
+    monkeypatch.setitem(sys.modules, "keyring.core", keyring.core)
+
+    assert config.credentials("https://api.opensuse.org").password == "fromkeyring"
+    # the password is read from the backend osc uses
+    assert backends == ["keyring.backends.SecretService.Keyring"]
+
+    monkeypatch.setitem(sys.modules, "keyring", None)
+    with pytest.raises(config.OSCError):
+        config._oscrc_password("https://api.opensuse.org", "myusername")
+
+
+CONFIG = """\
+[obs]
+git_managed_projects = ["SUSE:SLFO:1.2"]
+[origins.saltbundlepy]
+project = "SUSE:SLFO:1.2"
+package = "python311"
+[origins.saltbundle-libyaml]
+project = "openSUSE:Factory"
+package = "libyaml"
+[origins.saltbundlepy-yaml]
+project = "openSUSE:Factory"
+package = "python-PyYAML"
+"""
+
+
+def test_load_caches_parsed_config(tmp_path, monkeypatch):
+    path = tmp_path / "config.toml"
+    path.write_text(CONFIG)
+    cache_dir = tmp_path / "cache"
+
+    conf = config.load(str(path), cache_dir)
+    assert config.load(str(path)) == conf
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # unchanged files are not parsed again
+    monkeypatch.setattr(config.tomli, "loads", None)
+    assert config.load(str(path), cache_dir) == conf
+    os.utime(path, ns=(0, 0))
+    assert config.load(str(path), cache_dir) == conf
+
+    monkeypatch.undo()
+    path.write_text(CONFIG.replace("libyaml", "libyaml-0-2"))
+    assert config.load(str(path), cache_dir)["origins"]["saltbundle-libyaml-0-2"]
+
+
+def test_load_validates_origins(tmp_path):
+    path = tmp_path / "config.toml"
+    path.write_text('[origins.saltbundlepy]\nproject = "SUSE:SLFO:1.2"\n')
+
+    with pytest.raises(config.ConfigError):
+        config.load(str(path))
+
+
+def test_origins():
+    origins = config.origins(tomli.loads(CONFIG))
+
+    assert list(origins) == ["saltbundlepy", "saltbundle-libyaml", "saltbundlepy-yaml"]
+    assert origins["saltbundlepy"] == Package("SUSE:SLFO:1.2", "python311", True)
+    assert "saltbundle-libyaml" in origins
+    assert "libyaml" not in origins
+    assert origins.git_managed_projects == {"SUSE:SLFO:1.2"}
+    assert origins.by_project["openSUSE:Factory"] == (
+        Package("openSUSE:Factory", "libyaml", False),
+        Package("openSUSE:Factory", "python-PyYAML", False),
+    )
@@ -0,0 +1,312 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import threading
+import time
+
+import pytest
+
+from lubed import OBSCredentials, Package, core, state
+
+
+def _packages():
+    return [
+        Package(project="openSUSE:Factory", name=f"obs-{i}", git_managed=False)
+        for i in range(6)
+    ] + [
+        Package(project="SUSE:SLFO:1.2", name=f"git-{i}", git_managed=True)
+        for i in range(3)
+    ]
+
+
+def test_run_checks_keeps_order():
+    packages = _packages()
+
+    def check(package):
+        # finish in reverse order of submission
+        time.sleep(0.01 * (len(packages) - packages.index(package)))
+        return package.name.endswith(("0", "2")), package.name == "obs-5"
+
+    results = core._run_checks(
+        packages,
+        check,
+        core._Limits({}),
+        hosts={"obs": "api.example.org", "git": "src.example.org"},
+    )
+
+    assert results == [
+        (p.name.endswith(("0", "2")), p.name == "obs-5") for p in packages
+    ]
+
+
+def test_run_checks_reports_as_completed():
+    packages = _packages()
+    completed = []
+
+    def check(package):
+        # obs-0 is the slowest check
+        time.sleep(0.2 if package.name == "obs-0" else 0.0)
+        return True, False
+
+    core._run_checks(
+        packages,
+        check,
+        core._Limits({}),
+        hosts={"obs": "api.example.org", "git": "src.example.org"},
+        on_result=lambda index, result: completed.append(packages[index].name),
+    )
+
+    assert sorted(completed) == sorted(p.name for p in packages)
+    assert completed[-1] == "obs-0"
+
+
+def test_run_checks_respects_backend_limit():
+    running = {"git": 0}
+    peak = {"git": 0}
+    lock = threading.Lock()
+
+    def check(package):
+        if package.git_managed:
+            with lock:
+                running["git"] += 1
+                peak["git"] = max(peak["git"], running["git"])
+            time.sleep(0.02)
+            with lock:
+                running["git"] -= 1
+        return False, False
+
+    core._run_checks(
+        _packages(),
+        check,
+        core._Limits({"git_clones": 1}),
+        hosts={"obs": "api.example.org", "git": "src.example.org"},
+    )
+
+    assert peak["git"] == 1
+
+
+CONF = {
+    "obs": {
+        "api_baseurl": "https://api.opensuse.org",
+        "gitserver_baseurl": "https://src.opensuse.org",
+        "git_managed_projects": ["SUSE:SLFO:1.2"],
+    },
+    "origins": {
+        "saltbundlepy": {"project": "SUSE:SLFO:1.2", "package": "python311"},
+        "saltbundle-libyaml": {"project": "openSUSE:Factory", "package": "libyaml"},
+    },
+}
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        core.config, "credentials", lambda _: OBSCredentials("user", "pass")
+    )
+    monkeypatch.setattr(core.git, "fingerprint", lambda package, **_: "abc")
+    monkeypatch.setattr(core.obs, "fingerprint", lambda package, **_: "")
+
+    def git_mtime(package, **_):
+        calls.append(package.name)
+        return 1750000000, False
+
+    def obs_mtime(package, **_):
+        calls.append(package.name)
+        return -1, True
+
+    monkeypatch.setattr(core.git, "package_mtime", git_mtime)
+    monkeypatch.setattr(core.obs, "package_mtime", obs_mtime)
+    return calls
+
+
+def test_state_skips_unchanged_fingerprint(backends, tmp_path):
+    store = state.StateStore(str(tmp_path / "state.json"))
+
+    first = core.calculate_updated_packages(1700000000, CONF, state=store)
+    second = core.calculate_updated_packages(1700000000, CONF, state=store)
+
+    expected = (
+        [("saltbundlepy", "SUSE:SLFO:1.2", "python311")],
+        [("saltbundle-libyaml", "openSUSE:Factory", "libyaml")],
+    )
+    assert first == second == expected
+    # python311 is only checked once, libyaml failed and is checked again
+    assert sorted(backends) == ["libyaml", "libyaml", "python311"]
+
+
+def test_on_result(backends):
+    results = []
+
+    updates, failures = core.calculate_updated_packages(
+        1700000000, CONF, on_result=lambda status, row: results.append((status, row))
+    )
+
+    assert sorted(results) == sorted(
+        [("updated", row) for row in updates] + [("failed", row) for row in failures]
+    )
+
+
+def test_resolve_links(backends, monkeypatch):
+    conf = {
+        "obs": {**CONF["obs"], "resolve_links": True},
+        "origins": {
+            "saltbundlepy-yaml": {"project": "SUSE:SLE-15:GA", "package": "libyaml"},
+            "saltbundle-libyaml": {"project": "openSUSE:Factory", "package": "libyaml"},
+        },
+    }
+    factory = Package("openSUSE:Factory", "libyaml", False)
+    monkeypatch.setattr(
+        core.links.obs,
+        "resolve_link",
+        lambda package, *_: (package, None)
+        if package == factory
+        else (package, factory),
+    )
+    monkeypatch.setattr(
+        core.obs,
+        "package_mtime",
+        lambda package, *_, **__: backends.append(package.project)
+        or (1750000000 if package == factory else 1600000000, False),
+    )
+    sources = {}
+
+    updates, _ = core.calculate_updated_packages(1700000000, conf, sources=sources)
+
+    assert len(updates) == 2
+    # libyaml in Factory is only checked once
+    assert sorted(backends) == ["SUSE:SLE-15:GA", "openSUSE:Factory"]
+    # The update of saltbundlepy-yaml comes from the linked package in Factory
+    assert sources == {"saltbundlepy-yaml": factory}
+
+
+def test_retry_failed(backends, tmp_path):
+    store = state.StateStore(str(tmp_path / "state.json"))
+    core.calculate_updated_packages(1700000000, CONF, state=store)
+    backends.clear()
+
+    core.calculate_updated_packages(1700000000, CONF, state=store, retry_failed=True)
+
+    assert backends == ["libyaml"]
+
+
+def test_bulk_retry_failed(backends, monkeypatch, tmp_path):
+    conf = {**CONF, "obs": {**CONF["obs"], "bulk_queries": True}}
+    libyaml = Package("openSUSE:Factory", "libyaml", False)
+    store = state.StateStore(str(tmp_path / "state.json"))
+    store.record(libyaml, "abc", 1600000000, 1650000000, False)
+    store.record(libyaml, "", -1, 1700000000, True)
+    monkeypatch.setattr(
+        core.obs, "unchanged_packages", lambda packages, **_: set(packages)
+    )
+    monkeypatch.setattr(core.obs, "fingerprints", lambda packages, **_: {})
+
+    result = core.calculate_updated_packages(
+        1700000000, conf, state=store, retry_failed=True
+    )
+
+    assert result == ([], [])
+    assert backends == []
+    # cleared in bulk, the package is not retried again
+    assert not store.failed(libyaml)
+    assert store.get(libyaml).fingerprint == "abc"
+    assert store.get(libyaml).last_checked > 1700000000
+
+
+def test_revision_detection(backends, monkeypatch, tmp_path):
+    conf = {**CONF, "obs": {**CONF["obs"], "change_detection": "revision"}}
+    store = state.StateStore(str(tmp_path / "state.json"))
+    core.calculate_updated_packages(1700000000, conf, state=store)
+    store.commit(1700000000)
+    backends.clear()
+
+    # the commit time is older than the last execution, the new revision counts
+    monkeypatch.setattr(core.git, "fingerprint", lambda package, **_: "def")
+    updates, _ = core.calculate_updated_packages(1800000000, conf, state=store)
+
+    assert updates == [("saltbundlepy", "SUSE:SLFO:1.2", "python311")]
+    assert backends == ["libyaml"]
+
+
+def test_bulk_revision_detection_skips_chains(backends, monkeypatch, tmp_path):
+    conf = {
+        **CONF,
+        "obs": {
+            **CONF["obs"],
+            "bulk_queries": True,
+            "change_detection": "revision",
+            "resolve_links": True,
+        },
+    }
+    libyaml = Package("openSUSE:Factory", "libyaml", False)
+    store = state.StateStore(str(tmp_path / "state.json"))
+    store.record(libyaml, "abc", 1600000000, 1700000000, False)
+    store.commit(1700000000)
+
+    def fail(*_, **__):
+        raise AssertionError("not needed to compare revisions")
+
+    monkeypatch.setattr(core.links.obs, "resolve_link", fail)
+    monkeypatch.setattr(core.obs, "unchanged_packages", fail)
+    # the source MD5 of a link changes with the sources it links to
+    monkeypatch.setattr(
+        core.obs, "fingerprints", lambda packages, **_: {libyaml: "def"}
+    )
+
+    updates, _ = core.calculate_updated_packages(1800000000, conf, state=store)
+
+    assert ("saltbundle-libyaml", "openSUSE:Factory", "libyaml") in updates
+    assert "libyaml" not in backends
+
+
+def test_shard_keeps_other_mirrors(backends, tmp_path):
+    conf = {
+        "obs": {**CONF["obs"], "git_mirror_dir": str(tmp_path)},
+        "origins": {
+            "saltbundlepy": {"project": "SUSE:SLFO:1.2", "package": "python311"},
+            "saltbundlepy-yaml": {"project": "SUSE:SLFO:1.2", "package": "libyaml"},
+        },
+    }
+    for name in ("python311", "libyaml", "removed"):
+        (tmp_path / f"{name}.git").mkdir()
+
+    for shard in ((1, 2), (2, 2)):
+        core.calculate_updated_packages(1700000000, conf, shard=shard)
+
+    # only mirrors of packages that are not an origin in any shard are removed
+    assert sorted(p.name for p in tmp_path.glob("*.git")) == [
+        "libyaml.git",
+        "python311.git",
+    ]
+
+
+def test_feed_only_checks_touched_packages(backends, monkeypatch, tmp_path):
+    events = tmp_path / "events.jsonl"
+    conf = {**CONF, "feed": {"enabled": True, "events_file": str(events)}}
+    fingerprints = []
+    monkeypatch.setattr(
+        core.git,
+        "fingerprint",
+        lambda package, **_: fingerprints.append(package.name) or "abc",
+    )
+    store = state.StateStore(str(tmp_path / "state.json"))
+
+    # without a cursor, all packages are checked
+    core.calculate_updated_packages(1700000000, conf, state=store)
+    assert store.cursor == 0
+    store.commit(1700000000)
+    assert store.cursor > 0
+    assert fingerprints == ["python311"]
+
+    events.write_text(
+        f'{{"time": {store.cursor + 1}, "project": "openSUSE:Factory",'
+        f' "package": "libyaml"}}\n'
+    )
+    backends.clear()
+    python311 = state._key(Package("SUSE:SLFO:1.2", "python311", True))
+    store.packages[python311].last_checked = 1
+    updates, _ = core.calculate_updated_packages(1700000000, conf, state=store)
+
+    assert updates == [("saltbundlepy", "SUSE:SLFO:1.2", "python311")]
+    assert fingerprints == ["python311"]
+    assert backends == ["libyaml"]
+    # Untouched packages count as checked
+    assert store.packages[python311].last_checked > 1
@@ -0,0 +1,90 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import requests
+
+from lubed import OBSCredentials, Package, feed
+
+CREDENTIALS = OBSCredentials("user", "pass")
+PACKAGES = [
+    Package(project="SUSE:SLE-15-SP6:Update", name="python311", git_managed=False),
+    Package(project="SUSE:SLE-15-SP6:Update", name="libffi", git_managed=False),
+    Package(project="SUSE:SLFO:1.2", name="libyaml", git_managed=True),
+    Package(project="SUSE:SLFO:1.2", name="zeromq", git_managed=True),
+]
+BY_PROJECT = {
+    "SUSE:SLE-15-SP6:Update": PACKAGES[:2],
+    "SUSE:SLFO:1.2": PACKAGES[2:],
+}
+
+
+def _activity(repo, ref, created):
+    return {"repo": {"name": repo}, "ref_name": ref, "created": created}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_touched_packages_from_servers(monkeypatch):
+    monkeypatch.setattr(
+        feed.obs, "changed_packages", lambda project, since, *_: {"python311"}
+    )
+    monkeypatch.setattr(feed.obs, "packages_in_project", lambda *_: {"python311"})
+    pages = [
+        [
+            _activity("libyaml", "refs/heads/slfo-main", "2023-11-15T00:00:00Z"),
+            _activity("zeromq", "refs/heads/slfo-1.2", "2023-11-15T00:00:00Z"),
+        ]
+        + [_activity("other", "", "2023-11-15T00:00:00Z")] * 48,
+        [_activity("libyaml", "refs/heads/slfo-1.2", "2023-01-01T00:00:00Z")],
+    ]
+    urls = []
+
+    def fake_get(url, *_, **__):
+        urls.append(url)
+        return FakeResponse(pages[len(urls) - 1])
+
+    monkeypatch.setattr(feed.git.transport, "get", fake_get)
+
+    touched = feed.touched_packages(
+        1700000000, BY_PROJECT, CREDENTIALS, "https://api.example.org", "https://src"
+    )
+
+    # libffi is inherited and not covered by the statistics. libyaml was only
+    # pushed to before the cursor and on another branch.
+    assert touched == {PACKAGES[0], PACKAGES[1], PACKAGES[3]}
+    assert urls[1] == "https://src/api/v1/orgs/pool/activities/feeds?limit=50&page=2"
+
+
+def test_feed_failure(monkeypatch):
+    monkeypatch.setattr(feed.obs, "changed_packages", lambda *_: set())
+    monkeypatch.setattr(feed.obs, "packages_in_project", lambda *_: set())
+
+    def fail(*_, **__):
+        raise requests.ConnectionError
+
+    monkeypatch.setattr(feed.git.transport, "get", fail)
+
+    assert (
+        feed.touched_packages(1700000000, BY_PROJECT, CREDENTIALS, "https://api", "")
+        is None
+    )
+
+
+def test_events_file(tmp_path):
+    events = tmp_path / "events.jsonl"
+    events.write_text(
+        '{"time": 1690000000, "project": "SUSE:SLFO:1.2", "package": "zeromq"}\n'
+        "\n"
+        '{"time": 1710000000, "project": "SUSE:SLFO:1.2", "package": "libyaml"}\n'
+    )
+
+    touched = feed.touched_packages(
+        1700000000, BY_PROJECT, CREDENTIALS, "", "", events_file=str(events)
+    )
+
+    assert touched == {PACKAGES[2]}
+    assert feed.touched_packages(0, BY_PROJECT, CREDENTIALS, "", "", "missing") is None
@@ -1,5 +1,9 @@
-from lubed import gh
 import textwrap
+import time
+
+import pytest
+
+from lubed import gh, ratelimit
 
 
 def test_format_table_md():
@@ -23,3 +27,154 @@ def test_format_table_md():
         |---------------------|---------------------|---------------------|
         |saltbundlepy-docker-pycreds|openSUSE:Factory|python-docker-pycreds|"""
     )
+
+
+class FakeIssue:
+    raw_data = {"node_id": "I_kwDOABBK1c5"}
+
+
+class FakeRepo:
+    def __init__(self):
+        self.created = []
+
+    def create_issue(self, **kwargs):
+        self.created.append(kwargs)
+        return FakeIssue()
+
+
+class FakeGithub:
+    # no response recorded
+    rate_limiting = (-1, -1)
+    rate_limiting_resettime = 0
+
+    def __init__(self):
+        self.repo = FakeRepo()
+        self.lazy = None
+
+    def get_repo(self, name, lazy=False):
+        self.lazy = lazy
+        return self.repo
+
+
+class FakeGqlTransport:
+    response_headers = {"X-RateLimit-Remaining": "4999", "X-RateLimit-Reset": "0"}
+
+
+class FakeGqlSession:
+    transport = FakeGqlTransport()
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, document, variable_values):
+        self.executed.append(variable_values)
+        return {}
+
+
+def test_create_issue_in_board(monkeypatch):
+    client = FakeGithub()
+    session = FakeGqlSession()
+    monkeypatch.setattr(gh, "_get_github_client", lambda token: client)
+    monkeypatch.setattr(gh, "_get_gql_session", lambda token: session)
+
+    gh.create_issue_in_board(
+        "SUSE/spacewalk", "Title", "Body", "token", "PVT_kwDOABBK1c4AO0-4", ["a", "b"]
+    )
+
+    # labels are passed by name, without fetching the repository or the labels
+    assert client.lazy
+    assert client.repo.created == [
+        {"title": "Title", "body": "Body", "labels": ["a", "b"]}
+    ]
+    # the node ID comes from the REST response, only the board needs GraphQL
+    assert session.executed == [
+        {"issue_id": "I_kwDOABBK1c5", "board_id": "PVT_kwDOABBK1c4AO0-4"}
+    ]
+
+
+def test_snapshot_round_trip():
+    snapshot = gh.Snapshot(
+        since=1700000000,
+        updates=[("saltbundlepy", "SUSE:SLE-15-SP6:Update", "python311")],
+        failures=[("saltbundle-libffi", "SUSE:SLE-15-SP5:GA", "libffi_3_4")],
+    )
+
+    body = gh.embed_snapshot("Some updates:\n\n|table|\n", snapshot)
+
+    assert body.startswith("Some updates:\n\n|table|\n\n<!-- lubed-snapshot: ")
+    assert gh.extract_snapshot(body) == snapshot
+    assert gh.extract_snapshot("Some updates") is None
+    assert gh.extract_snapshot("<!-- lubed-snapshot: {} -->") is None
+    assert gh.extract_snapshot(None) is None
+
+
+def test_merge_snapshot():
+    python = ("saltbundlepy", "SUSE:SLE-15-SP6:Update", "python311")
+    cython = ("saltbundlepy-cython", "SUSE:SLFO:Main", "python-Cython")
+    libffi = ("saltbundle-libffi", "SUSE:SLE-15-SP5:GA", "libffi_3_4")
+    previous = gh.Snapshot(since=1700000000, updates=[python], failures=[libffi])
+
+    merged, delta = gh.merge_snapshot(previous, [cython, python, cython], [])
+
+    # updates stay until the issue is closed, failures are replaced
+    assert merged == gh.Snapshot(since=1700000000, updates=[python, cython])
+    assert delta == gh.Snapshot(since=1700000000, updates=[cython])
+
+    merged, delta = gh.merge_snapshot(merged, [python], [libffi])
+
+    assert merged.updates == [python, cython]
+    assert delta.updates == []
+    assert delta.failures == [libffi]
+
+    _, delta = gh.merge_snapshot(merged, [cython], [libffi])
+
+    assert not delta
+
+
+class FakeSearchResult:
+    def __init__(self, title):
+        self.title = title
+
+
+class FakeSearchResults:
+    def __init__(self, issues):
+        self.issues = issues
+        self.pages = []
+
+    def get_page(self, page):
+        self.pages.append(page)
+        return self.issues
+
+
+def test_find_open_issue(monkeypatch):
+    results = FakeSearchResults(
+        [
+            FakeSearchResult("Update Salt Bundle Dependencies (old)"),
+            FakeSearchResult("Title"),
+        ]
+    )
+    queries = []
+
+    class FakeSearchGithub:
+        rate_limiting = (10, 30)
+        rate_limiting_resettime = time.time() + 100
+
+        def search_issues(self, query, **kwargs):
+            queries.append(query)
+            return results
+
+    monkeypatch.setattr(gh, "_get_github_client", lambda token: FakeSearchGithub())
+    monkeypatch.setattr(ratelimit, "_buckets", {})
+
+    issue = gh.find_open_issue("SUSE/spacewalk", "Title", "token", ["a", "b c"])
+
+    assert issue is results.issues[1]
+    assert queries == [
+        'repo:SUSE/spacewalk is:issue is:open in:title "Title" label:"a" label:"b c"'
+    ]
+    assert results.pages == [0]
+    # the quota of the response spreads the calls until it resets
+    assert ratelimit.bucket(gh.REST_HOST).rate == pytest.approx(0.1, rel=0.05)
+
+    results.issues = results.issues[:1]
+    assert gh.find_open_issue("SUSE/spacewalk", "Title", "token") is None
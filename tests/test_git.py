@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import requests
+
+from lubed import Package, git
+
+
+def test_branch():
+    package = Package(project="SUSE:SLFO:1.2", name="python311", git_managed=True)
+
+    assert git._branch(package) == "slfo-1.2"
+
+
+def test_api_last_commit_time(monkeypatch):
+    requested = []
+
+    def fake_get(url, auth=None, **kwargs):
+        requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"commit": {"timestamp": "2023-11-14T22:13:20Z"}}'
+        return response
+
+    monkeypatch.setattr(git.transport, "get", fake_get)
+    package = Package(project="SUSE:SLFO:1.2", name="python311", git_managed=True)
+
+    assert git._api_last_commit_time("https://src.opensuse.org", package) == 1700000000
+    assert requested == [
+        "https://src.opensuse.org/api/v1/repos/pool/python311/branches/slfo-1.2"
+    ]
+
+
+def test_prune_mirror(tmp_path):
+    for name in ("python311", "libyaml"):
+        (tmp_path / f"{name}.git").mkdir()
+        (tmp_path / f"{name}.git.lock").touch()
+    package = Package(project="SUSE:SLFO:1.2", name="python311", git_managed=True)
+
+    git.prune_mirror(str(tmp_path), [package])
+
+    # Lock files are kept for processes that may wait on them
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "libyaml.git.lock",
+        "python311.git",
+        "python311.git.lock",
+    ]
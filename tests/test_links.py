@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import threading
+
+import pytest
+
+from lubed import OBSCredentials, Package, links
+
+CREDENTIALS = OBSCredentials("user", "pass")
+
+
+def _package(project, name):
+    return Package(project=project, name=name, git_managed=False)
+
+
+# python311 in SP6:Update is inherited from SP6:GA, which links to Factory.
+# python311-docs is a link to python311 in SP6:Update.
+UPDATE = _package("SUSE:SLE-15-SP6:Update", "python311")
+GA = _package("SUSE:SLE-15-SP6:GA", "python311")
+FACTORY = _package("openSUSE:Factory", "python311")
+DOCS = _package("SUSE:SLE-15-SP6:Update", "python311-docs")
+LINKS = {
+    UPDATE: (GA, FACTORY),
+    GA: (GA, FACTORY),
+    FACTORY: (FACTORY, None),
+    DOCS: (DOCS, UPDATE),
+}
+MTIMES = {GA: 1700000000, FACTORY: 1800000000, DOCS: 1600000000}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    requests = {"resolve": [], "mtime": []}
+    lock = threading.Lock()
+
+    def resolve_link(package, credentials, api_url):
+        with lock:
+            requests["resolve"].append(package)
+        return LINKS[package]
+
+    def package_mtime(package, credentials, api_url):
+        with lock:
+            requests["mtime"].append(package)
+        return MTIMES[package], False
+
+    monkeypatch.setattr(links.obs, "resolve_link", resolve_link)
+    monkeypatch.setattr(links.obs, "package_mtime", package_mtime)
+    yield requests
+    links.use_cache(None)
+
+
+def test_chain(server):
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org")
+
+    assert resolver.chain(UPDATE) == (GA, FACTORY)
+    assert resolver.chain(DOCS) == (DOCS, GA, FACTORY)
+
+
+def test_shared_sources_are_checked_once(server):
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org")
+    threads = [
+        threading.Thread(target=resolver.mtime, args=(package,))
+        for package in (UPDATE, DOCS) * 4
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert resolver.mtime(DOCS) == (1800000000, False)
+    assert len(server["mtime"]) == 3
+    assert set(server["mtime"]) == {GA, FACTORY, DOCS}
+    assert resolver.changed_source(DOCS, 1700000000) == FACTORY
+    assert resolver.changed_source(DOCS, 1800000000) is None
+
+
+def test_chains_are_cached(server, tmp_path):
+    links.use_cache(tmp_path / "links.json")
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org")
+    resolver.chain(DOCS)
+    resolver.save()
+    server["resolve"].clear()
+
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org")
+    assert resolver.chain(DOCS) == (DOCS, GA, FACTORY)
+    assert server["resolve"] == []
+
+    # expired chains are resolved again
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org", ttl=0)
+    assert resolver.chain(DOCS) == (DOCS, GA, FACTORY)
+    assert server["resolve"] == [DOCS, UPDATE, FACTORY]
+
+
+def test_unresolved_links_are_not_cached(server, monkeypatch, tmp_path):
+    links.use_cache(tmp_path / "links.json")
+    monkeypatch.setattr(links.obs, "resolve_link", lambda *args: None)
+    resolver = links.Resolver(CREDENTIALS, "https://api.opensuse.org")
+
+    assert resolver.chain(UPDATE) == (UPDATE,)
+    resolver.save()
+    assert not (tmp_path / "links.json").exists()
@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import urllib.request
+
+from lubed import metrics, trace
+
+
+def _check_span(backend, seconds):
+    return trace.Span(
+        name="check",
+        span_id="",
+        parent_id="",
+        start=0,
+        duration=int(seconds * 1e9),
+        attributes={"package": "a/b", "backend": backend},
+    )
+
+
+def test_render():
+    collected = metrics.Metrics()
+    collected.record_cycle(
+        ["SUSE:SLE-15-SP6:Update", "SUSE:SLE-15-SP6:Update", "SUSE:SLFO:1.2"],
+        updates=[("saltbundlepy", "SUSE:SLE-15-SP6:Update", "python311")],
+        failures=[("saltbundle-libyaml", "SUSE:SLFO:1.2", "libyaml")],
+        spans=[_check_span("obs", 0.07), _check_span("git", 3)],
+        duration=3.5,
+    )
+    collected.record_error()
+
+    lines = collected.render().splitlines()
+
+    assert (
+        'lubed_packages_pending_update{origin_project="SUSE:SLE-15-SP6:Update"} 1'
+        in lines
+    )
+    assert 'lubed_packages_pending_update{origin_project="SUSE:SLFO:1.2"} 0' in lines
+    assert 'lubed_check_failures_total{origin_project="SUSE:SLFO:1.2"} 1' in lines
+    assert 'lubed_check_duration_seconds_bucket{backend="obs",le="0.05"} 0' in lines
+    assert 'lubed_check_duration_seconds_bucket{backend="obs",le="0.1"} 1' in lines
+    assert 'lubed_check_duration_seconds_bucket{backend="git",le="+Inf"} 1' in lines
+    assert "lubed_cycles_total 2" in lines
+    assert "lubed_cycle_errors_total 1" in lines
+    assert "lubed_cycle_duration_seconds 3.5" in lines
+
+
+def test_server():
+    collected = metrics.Metrics()
+    server = metrics.start_server(collected, port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "# TYPE lubed_cycles_total counter" in body
+    assert "lubed_last_success_age_seconds" not in body
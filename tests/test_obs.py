@@ -1,8 +1,12 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import contextlib
+import io
 import textwrap
+import urllib.parse
 
 import pytest
-from lubed import obs
+import requests
+from lubed import OBSCredentials, Package, obs
 
 
 def test_parse_packages_response():
@@ -48,3 +52,220 @@ def test_package_was_update(last_check, expected):
     ]
 
     assert obs._any_timestamp_is_newer(timestamps, last_check) == expected
+
+
+def test_parse_empty_body():
+    assert obs._parse_packages_list(io.BytesIO(b"")) == []
+    with pytest.raises(obs.ElementTree.ParseError):
+        obs._parse_packages_list(io.BytesIO(b"<directory><entry"))
+
+
+def test_unchanged_packages(monkeypatch):
+    responses = {
+        "/search/package/id": """\
+            <collection matches="2">
+              <package name="python311" project="SUSE:SLE-15-SP6:Update"/>
+              <package name="libyaml" project="SUSE:SLE-15-SP6:Update"/>
+            </collection>""",
+        "/statistics/latest_updated": """\
+            <latest_updated>
+              <package name="python311" project="SUSE:SLE-15-SP6:Update" updated="2024-01-01T00:00:00Z"/>
+            </latest_updated>""",
+    }
+
+    def fake_get(url, auth=None, **kwargs):
+        path = urllib.parse.urlparse(url).path
+        response = requests.Response()
+        response.status_code = 200
+        response._content = textwrap.dedent(responses[path]).encode()
+        return response
+
+    @contextlib.contextmanager
+    def fake_stream(url, auth=None, **kwargs):
+        yield io.BytesIO(fake_get(url).content)
+
+    monkeypatch.setattr(obs.transport, "get", fake_get)
+    monkeypatch.setattr(obs.transport, "stream", fake_stream)
+    packages = [
+        Package(project="SUSE:SLE-15-SP6:Update", name=name, git_managed=False)
+        for name in ("python311", "libyaml", "libffi")
+    ]
+
+    unchanged = obs.unchanged_packages(
+        1700000000, packages, OBSCredentials("user", "pass")
+    )
+
+    # python311 was changed, libffi is inherited and needs to be checked by itself
+    assert unchanged == {packages[1]}
+
+
+def test_latest_updated(monkeypatch):
+    requested = []
+
+    def fake_get(url, auth=None, **kwargs):
+        requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = textwrap.dedent(
+            """\
+            <latest_updated>
+              <package name="python311" project="SUSE:SLE-15-SP6:Update" updated="2024-01-02T00:00:00Z"/>
+              <package name="libyaml" project="SUSE:SLE-15-SP6:Update" updated="2023-12-31T00:00:00Z"/>
+            </latest_updated>"""
+        ).encode()
+        return response
+
+    monkeypatch.setattr(obs.transport, "get", fake_get)
+    # Noon on 2024-01-03, 2.5 days after the last check
+    monkeypatch.setattr(obs.time, "time", lambda: 1704283200)
+    credentials = OBSCredentials("user", "pass")
+
+    changed = obs._latest_updated(
+        "SUSE:SLE-15-SP6:Update",
+        ["python311", "libyaml", "libffi"],
+        1704067200,
+        credentials,
+        "https://api.example.org",
+    )
+
+    # libyaml is within the days OBS lists, but was changed before the last check
+    assert changed == {"python311"}
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(requested[0]).query)
+    assert query["timelimit"] == ["3"]
+    assert query["limit"] == ["4"]
+    assert query["prjfilter"] == ["^SUSE:SLE\\-15\\-SP6:Update$"]
+    assert query["pkgfilter"] == ["^(python311|libyaml|libffi)$"]
+
+    # A listing that is as long as the limit may be cut off
+    assert (
+        obs._latest_updated(
+            "SUSE:SLE-15-SP6:Update", ["python311"], 1704067200, credentials, ""
+        )
+        is None
+    )
+
+
+def test_fingerprints(monkeypatch):
+    requested = []
+
+    def fake_get(url, auth=None, **kwargs):
+        requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = textwrap.dedent(
+            """\
+            <sourceinfolist>
+              <sourceinfo package="python311" rev="42" srcmd5="0123"/>
+              <sourceinfo package="libffi">
+                <error>unknown package</error>
+              </sourceinfo>
+            </sourceinfolist>"""
+        ).encode()
+        return response
+
+    monkeypatch.setattr(obs.transport, "get", fake_get)
+    packages = [
+        Package(project="SUSE:SLE-15-SP6:Update", name=name, git_managed=False)
+        for name in ("python311", "libffi")
+    ]
+
+    result = obs.fingerprints(packages, OBSCredentials("user", "pass"))
+
+    assert result == {packages[0]: "0123"}
+    assert requested == [
+        "https://api.opensuse.org/source/SUSE:SLE-15-SP6:Update"
+        "?view=info&package=python311&package=libffi"
+    ]
+
+
+def test_parse_streamed_packages_list():
+    entries = "".join(f'<entry name="package-{i}"/>' for i in range(1000))
+    body = io.BytesIO(f'<directory count="1000">{entries}</directory>'.encode())
+
+    packages = obs._parse_packages_list(body)
+
+    assert len(packages) == 1000
+    assert packages[-1] == "package-999"
+
+
+def test_projects_containing(monkeypatch):
+    requested = []
+
+    @contextlib.contextmanager
+    def fake_stream(url, auth=None, **kwargs):
+        requested.append(urllib.parse.unquote(url))
+        yield io.BytesIO(
+            textwrap.dedent(
+                """\
+                <collection matches="3">
+                  <package name="saltbundlepy" project="systemsmanagement:saltstack:bundle:SLE15"/>
+                  <package name="saltbundlepy" project="systemsmanagement:saltstack:bundle"/>
+                  <package name="saltbundlepy-six" project="systemsmanagement:saltstack:bundle"/>
+                </collection>"""
+            ).encode()
+        )
+
+    monkeypatch.setattr(obs.transport, "stream", fake_stream)
+
+    result = obs.projects_containing(
+        ["saltbundlepy", "saltbundlepy-cffi"],
+        "systemsmanagement:saltstack:bundle",
+        OBSCredentials("user", "pass"),
+    )
+
+    assert result == {
+        "saltbundlepy": [
+            "systemsmanagement:saltstack:bundle",
+            "systemsmanagement:saltstack:bundle:SLE15",
+        ],
+        "saltbundlepy-cffi": [],
+    }
+    assert requested == [
+        "https://api.opensuse.org/search/package/id?match="
+        "starts_with(@project, 'systemsmanagement:saltstack:bundle') and "
+        "(@name='saltbundlepy' or @name='saltbundlepy-cffi')"
+    ]
+
+
+def test_resolve_link(monkeypatch):
+    responses = {
+        "/source/SUSE:SLE-15-SP6:Update/python311/_meta": """\
+            <package name="python311" project="SUSE:SLE-15-SP6:GA">
+              <title>Python 3.11</title>
+            </package>""",
+        "/source/SUSE:SLE-15-SP6:GA/python311": """\
+            <directory name="python311" srcmd5="0123">
+              <linkinfo project="openSUSE:Factory" package="python311" srcmd5="4567"/>
+              <entry name="_link" md5="89ab" mtime="1700000000"/>
+            </directory>""",
+        "/source/openSUSE:Factory/python311/_meta": """\
+            <package name="python311" project="openSUSE:Factory"/>""",
+        "/source/openSUSE:Factory/python311": """\
+            <directory name="python311" srcmd5="4567">
+              <entry name="python311.spec" md5="cdef" mtime="1700000000"/>
+            </directory>""",
+    }
+
+    def fake_get(url, auth=None, **kwargs):
+        path = urllib.parse.urlparse(url).path
+        if path not in responses:
+            raise requests.HTTPError("404 Client Error")
+        response = requests.Response()
+        response.status_code = 200
+        response._content = textwrap.dedent(responses[path]).encode()
+        return response
+
+    @contextlib.contextmanager
+    def fake_stream(url, auth=None, **kwargs):
+        yield io.BytesIO(fake_get(url).content)
+
+    monkeypatch.setattr(obs.transport, "get", fake_get)
+    monkeypatch.setattr(obs.transport, "stream", fake_stream)
+    credentials = OBSCredentials("user", "pass")
+    update = Package("SUSE:SLE-15-SP6:Update", "python311", False)
+    ga = Package("SUSE:SLE-15-SP6:GA", "python311", False)
+    factory = Package("openSUSE:Factory", "python311", False)
+
+    assert obs.resolve_link(update, credentials) == (ga, factory)
+    assert obs.resolve_link(factory, credentials) == (factory, None)
+    assert obs.resolve_link(Package("SUSE:SLFO:Main", "x", False), credentials) is None
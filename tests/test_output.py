@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+import json
+
+import pytest
+
+from lubed import output
+
+ROWS = [
+    (
+        "updated",
+        "saltbundlepy",
+        "SUSE:SLE-15-SP6:Update",
+        "python311",
+        "SUSE:SLE-15-SP6:GA/python311",
+    ),
+    ("failed", "saltbundle-libffi", "SUSE:SLE-15-SP5:GA", "libffi_3_4"),
+]
+
+
+def _write(output_format, rows):
+    stream = io.StringIO()
+    writer = output.Writer(output_format, output.UPDATE_FIELDS, stream)
+    for row in rows:
+        writer.write(*row)
+    writer.close()
+    return stream.getvalue()
+
+
+def test_json():
+    assert json.loads(_write("json", ROWS)) == [
+        dict(zip(output.UPDATE_FIELDS, row + ("",))) for row in ROWS
+    ]
+    assert json.loads(_write("json", [])) == []
+
+
+def test_ndjson_streams_records():
+    stream = io.StringIO()
+    writer = output.Writer("ndjson", output.UPDATE_FIELDS, stream)
+
+    writer.write(*ROWS[0])
+
+    # written before the writer is closed
+    assert json.loads(stream.getvalue()) == {
+        "status": "updated",
+        "bundle_package": "saltbundlepy",
+        "origin_project": "SUSE:SLE-15-SP6:Update",
+        "origin_package": "python311",
+        "changed_source": "SUSE:SLE-15-SP6:GA/python311",
+    }
+
+
+def test_csv():
+    assert _write("csv", ROWS) == (
+        "status,bundle_package,origin_project,origin_package,changed_source\n"
+        "updated,saltbundlepy,SUSE:SLE-15-SP6:Update,python311,"
+        "SUSE:SLE-15-SP6:GA/python311\n"
+        "failed,saltbundle-libffi,SUSE:SLE-15-SP5:GA,libffi_3_4,\n"
+    )
+    assert _write("csv", []) == (
+        "status,bundle_package,origin_project,origin_package,changed_source\n"
+    )
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        output.Writer("table", output.UPDATE_FIELDS)
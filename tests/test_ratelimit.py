@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import io
+import time
+
+import pytest
+import requests
+
+from lubed import ratelimit, retry, transport
+
+HOST = "https://api.opensuse.org"
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """A clock that only advances when the limiter sleeps."""
+    now = [1000.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(ratelimit, "_clock", lambda: now[0])
+    monkeypatch.setattr(ratelimit, "_sleep", sleep)
+    ratelimit.configure(rate=10.0, burst=2, min_rate=1.0, backoff=0.5, increase=1.0)
+    yield now
+    ratelimit.configure()
+
+
+def test_bucket_limits_rate(clock):
+    bucket = ratelimit.bucket(HOST)
+    start = clock[0]
+
+    for _ in range(12):
+        bucket.acquire()
+
+    # two calls from the burst, then 10 calls per second
+    assert clock[0] - start == pytest.approx(1.0)
+
+
+def test_throttling_cuts_rate_and_success_restores_it(clock):
+    bucket = ratelimit.bucket(HOST)
+
+    ratelimit.observe(HOST, 429, {}, retry_after=5.0)
+    assert bucket.rate == 5.0
+    start = clock[0]
+    bucket.acquire()
+    assert clock[0] - start >= 5.0
+
+    ratelimit.observe(HOST, 200, {})
+    assert bucket.rate == 6.0
+    for _ in range(10):
+        ratelimit.observe(HOST, 200, {})
+    assert bucket.rate == 10.0
+
+
+def test_unlimited_until_throttled(clock):
+    ratelimit.configure(rate=0.0, burst=2, min_rate=1.0)
+    bucket = ratelimit.bucket(HOST)
+    start = clock[0]
+
+    for _ in range(100):
+        bucket.acquire()
+    assert clock[0] == start
+
+    ratelimit.observe(HOST, 503, {})
+    assert bucket.rate == 1.0
+
+
+def test_quota_headers(clock):
+    bucket = ratelimit.bucket(HOST)
+
+    ratelimit.observe(
+        HOST,
+        200,
+        {"x-ratelimit-remaining": "60", "x-ratelimit-reset": str(time.time() + 60)},
+    )
+    assert bucket.rate == pytest.approx(1.0, rel=0.05)
+
+    ratelimit.observe(
+        HOST,
+        200,
+        {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(time.time() + 30)},
+    )
+    start = clock[0]
+    bucket.acquire()
+    assert clock[0] - start == pytest.approx(30, abs=1)
+
+
+def test_host_rates(clock):
+    ratelimit.configure(rate=10.0, hosts={"https://api.github.com": 2.0})
+
+    assert ratelimit.bucket("https://api.github.com").rate == 2.0
+    assert ratelimit.bucket(HOST).rate == 10.0
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after("120") == 120.0
+    assert ratelimit.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert ratelimit.parse_retry_after("soon") is None
+    assert ratelimit.parse_retry_after(None) is None
+
+
+def test_transport_adapts_to_throttling(monkeypatch):
+    responses = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            response = requests.Response()
+            response.status_code = 429 if not responses else 200
+            response.headers["Retry-After"] = "2"
+            response.raw = io.BytesIO(b"")
+            responses.append(response)
+            return response
+
+    monkeypatch.setattr(transport, "session", lambda url: FakeSession())
+    monkeypatch.setattr(retry, "_sleep", lambda _: None)
+
+    response = transport._send(f"{HOST}/source/openSUSE:Factory", None)
+
+    assert response.status_code == 200
+    assert len(responses) == 2
+    # cut to half of 10 calls per second, grown back by one successful call
+    assert ratelimit.bucket(HOST).rate == 6.0
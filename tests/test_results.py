@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import pytest
+
+from lubed import results
+
+NAMES = [f"saltbundlepy-{i}" for i in range(200)]
+
+
+def test_parse_shard():
+    assert results.parse_shard("2/4") == (2, 4)
+    for spec in ("0/4", "5/4", "2", "a/b", "1/2/3"):
+        with pytest.raises(ValueError):
+            results.parse_shard(spec)
+
+
+def test_shards_partition_origins():
+    shards = [(index, 3) for index in range(1, 4)]
+    assigned = [[n for n in NAMES if results.in_shard(n, shard)] for shard in shards]
+
+    assert sorted(n for names in assigned for n in names) == sorted(NAMES)
+    assert all(names for names in assigned)
+    # stable across runs and hosts
+    assert results.in_shard("saltbundlepy", (2, 3))
+
+
+def test_save_and_merge(tmp_path):
+    python = ("saltbundlepy", "SUSE:SLE-15-SP6:Update", "python311")
+    cython = ("saltbundlepy-cython", "SUSE:SLFO:Main", "python-Cython")
+    libffi = ("saltbundle-libffi", "SUSE:SLE-15-SP5:GA", "libffi_3_4")
+    results.save(
+        str(tmp_path / "1.json"), results.Results(1700000000, (1, 2), [cython], [])
+    )
+    results.save(
+        str(tmp_path / "2.json"),
+        results.Results(1700000000, (2, 2), [python], [libffi]),
+    )
+    partial = [results.load(str(tmp_path / f"{i}.json")) for i in (1, 2)]
+
+    merged = results.merge(partial, order=["saltbundlepy", "saltbundlepy-cython"])
+
+    assert merged == results.Results(1700000000, (1, 1), [python, cython], [libffi])
+    with pytest.raises(results.ResultsError):
+        results.merge(partial[:1])
+    with pytest.raises(results.ResultsError):
+        results.merge(partial + partial[1:])
+    with pytest.raises(results.ResultsError):
+        results.load(str(tmp_path / "missing.json"))
+
+
+def test_merge_state(tmp_path):
+    python = {"fingerprint": "abc", "mtime": 1710000000}
+    libffi = {"fingerprint": "def", "mtime": 1690000000}
+    partial = [
+        results.Results(1700000000, (1, 2), checked_at=1720000100, cursor=1719999800),
+        results.Results(1700000000, (2, 2), checked_at=1720000000, cursor=1719999700),
+    ]
+    partial[0].packages["SUSE:SLE-15-SP6:Update/python311"] = python
+    partial[1].packages["SUSE:SLE-15-SP5:GA/libffi_3_4"] = libffi
+
+    merged = results.merge(partial)
+
+    # The next run covers everything since the first shard started
+    assert merged.checked_at == 1720000000
+    assert merged.cursor == 1719999700
+    assert merged.packages == {
+        "SUSE:SLE-15-SP6:Update/python311": python,
+        "SUSE:SLE-15-SP5:GA/libffi_3_4": libffi,
+    }
+    partial[1].cursor = None
+    assert results.merge(partial).cursor is None
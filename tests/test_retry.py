@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import contextlib
+import io
+
+import pytest
+import requests
+
+from lubed import OBSCredentials, Package, obs, retry, transport
+
+
+@pytest.fixture(autouse=True)
+def policy(monkeypatch):
+    monkeypatch.setattr(retry, "_sleep", lambda _: None)
+    retry.configure(attempts=3, failure_threshold=4, reset_timeout=60)
+    yield
+    retry.configure()
+
+
+def _failing(times, exception):
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) <= times:
+            raise exception
+        return "ok"
+
+    return func, calls
+
+
+def test_retries_transient_failures():
+    func, calls = _failing(2, retry.TransientError("502"))
+
+    assert retry.call("https://api.opensuse.org", func) == "ok"
+    assert len(calls) == 3
+    assert retry.stats()["https://api.opensuse.org"].retries == 2
+
+
+def test_latencies_are_bounded(monkeypatch):
+    monkeypatch.setattr(retry, "LATENCY_SAMPLES", 3)
+
+    for _ in range(5):
+        retry.call("https://api.opensuse.org", lambda: "ok")
+
+    host_stats = retry.stats()["https://api.opensuse.org"]
+    # the counters keep growing, only the latest latencies are kept
+    assert host_stats.calls == 5
+    assert len(host_stats.latencies) == 3
+
+
+def test_does_not_retry_other_failures():
+    func, calls = _failing(1, ValueError("404"))
+
+    with pytest.raises(ValueError):
+        retry.call("https://api.opensuse.org", func)
+    assert len(calls) == 1
+
+
+def test_circuit_breaker_opens():
+    retry.configure(attempts=3, failure_threshold=3, reset_timeout=60)
+    func, _ = _failing(10, retry.TransientError("502"))
+
+    with pytest.raises(retry.TransientError):
+        retry.call("https://api.opensuse.org", func)
+    with pytest.raises(retry.CircuitOpenError):
+        retry.call("https://api.opensuse.org", func)
+    assert retry.stats()["https://api.opensuse.org"].rejected == 1
+
+
+def test_retry_after_header():
+    response = requests.Response()
+    response.status_code = 429
+    response.headers["Retry-After"] = "7"
+
+    assert transport._retry_after(requests.HTTPError(response=response)) == 7.0
+    assert transport._is_transient(requests.HTTPError(response=response))
+
+
+def test_failures_are_not_cached(monkeypatch):
+    attempts = []
+
+    @contextlib.contextmanager
+    def flaky_stream(url, auth=None, **kwargs):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise requests.ConnectionError("502")
+        yield io.BytesIO(b'<directory><entry name="a" mtime="1700000000"/></directory>')
+
+    monkeypatch.setattr(obs.transport, "stream", flaky_stream)
+    package = Package(project="openSUSE:Factory", name="flaky", git_managed=False)
+    credentials = OBSCredentials("user", "pass")
+
+    assert obs.package_mtime(package, credentials) == (-1, True)
+    assert obs.package_mtime(package, credentials) == (1700000000, False)
+
+
+def test_backoff_holds_no_slot(monkeypatch):
+    url = "https://obs.example.org/source/openSUSE:Factory"
+    free_during_backoff = []
+
+    class FakeSession:
+        def get(self, url, **kwargs):
+            response = requests.Response()
+            response.status_code = 502
+            response.raw = io.BytesIO(b"")
+            return response
+
+    def sleep(_):
+        semaphore = transport._slot(url)
+        free_during_backoff.append(semaphore.acquire(blocking=False))
+        semaphore.release()
+
+    transport.configure(max_in_flight=1)
+    monkeypatch.setattr(transport, "session", lambda _: FakeSession())
+    monkeypatch.setattr(retry, "_sleep", sleep)
+    try:
+        with pytest.raises(requests.HTTPError):
+            transport.get(url)
+        assert free_during_backoff == [True, True]
+        # All slots are free again after the last attempt
+        assert transport._slot(url).acquire(blocking=False)
+    finally:
+        transport.configure(max_in_flight=8)
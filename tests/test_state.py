@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+
+import pytest
+
+from lubed import Package, state
+
+PACKAGE = Package(project="SUSE:SLFO:1.2", name="python311", git_managed=True)
+
+
+def test_migrate_timestamp_file(tmp_path):
+    legacy = tmp_path / ".last_execution"
+    legacy.write_text("1700000000")
+
+    store = state.StateStore.load(str(tmp_path / "state.json"), str(legacy))
+
+    assert store.last_execution == 1700000000
+    assert store.packages == {}
+
+
+def test_missing_files(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        state.StateStore.load(str(tmp_path / "state.json"), str(tmp_path / "missing"))
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = state.StateStore(path, 1700000000)
+    store.record(PACKAGE, "abc", 1650000000, 1700000000, err=False)
+    store.save()
+
+    loaded = state.StateStore.load(path)
+
+    assert loaded.last_execution == 1700000000
+    assert loaded.get(PACKAGE) == state.PackageState("abc", 1650000000, 1700000000, 0)
+
+
+def test_newer_timestamp_file_wins(tmp_path):
+    path = str(tmp_path / "state.json")
+    state.StateStore(path, 1700000000).save()
+    legacy = tmp_path / ".last_execution"
+    legacy.write_text("1600000000")
+    os.utime(legacy, (os.path.getmtime(path) + 10,) * 2)
+
+    assert state.StateStore.load(path, str(legacy)).last_execution == 1600000000
+
+
+def test_failed_check_keeps_previous_values(tmp_path):
+    store = state.StateStore(str(tmp_path / "state.json"))
+    store.record(PACKAGE, "abc", 1650000000, 1700000000, err=False)
+    store.record(PACKAGE, "", -1, 1700000100, err=True)
+
+    assert store.get(PACKAGE) == state.PackageState("abc", 1650000000, 1700000100, 1)
+    assert store.failed(PACKAGE)
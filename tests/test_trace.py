@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+
+import pytest
+
+from lubed import trace
+
+
+@pytest.fixture
+def tracing():
+    trace.enable()
+    yield
+    trace.disable()
+
+
+def test_disabled_records_nothing():
+    trace.disable()
+    with trace.span("obs.package", package="a/b") as attributes:
+        trace.annotate(bytes=10)
+
+    assert attributes == {"package": "a/b"}
+    assert trace.spans() == []
+
+
+def test_nested_spans(tracing):
+    with trace.span("check", package="a/b"):
+        with trace.span("obs.package") as attributes:
+            trace.annotate(bytes=10, cache="miss")
+            trace.annotate(bytes=5)
+        with pytest.raises(ValueError), trace.span("obs.sourceinfo"):
+            raise ValueError
+
+    package, sourceinfo, check = trace.spans()
+    assert attributes == {"bytes": 15, "cache": "miss"}
+    assert package.parent_id == sourceinfo.parent_id == check.span_id
+    assert sourceinfo.attributes["error"] == "ValueError"
+    assert check.duration >= package.duration
+
+
+def test_percentile():
+    values = [0.1 * i for i in range(1, 21)]
+
+    assert trace.percentile(values, 50) == pytest.approx(1.0)
+    assert trace.percentile(values, 95) == pytest.approx(1.9)
+    assert trace.percentile([], 95) == 0.0
+
+
+def test_export(tracing, tmp_path):
+    with trace.span("git.clone", package="python311"):
+        pass
+
+    trace.export_chrome(tmp_path / "chrome.json")
+    trace.export_otel(tmp_path / "otel.json")
+
+    (event,) = json.loads((tmp_path / "chrome.json").read_text())["traceEvents"]
+    assert event["name"] == "git.clone"
+    assert event["ph"] == "X"
+    assert event["args"] == {"package": "python311"}
+    otel = json.loads((tmp_path / "otel.json").read_text())
+    (span,) = otel["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert span["name"] == "git.clone"
+    assert span["attributes"] == [
+        {"key": "package", "value": {"stringValue": "python311"}}
+    ]
+    assert int(span["endTimeUnixNano"]) >= int(span["startTimeUnixNano"])
@@ -0,0 +1,19 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from lubed import transport
+
+
+def test_session_is_shared_per_host():
+    first = transport.session("https://api.opensuse.org/source/openSUSE:Factory")
+    second = transport.session("https://api.opensuse.org/search/project/id")
+    other = transport.session("https://src.opensuse.org/pool/python311")
+
+    assert first is second
+    assert first is not other
+
+
+def test_configure_resizes_pool():
+    transport.configure(max_in_flight=3)
+    s = transport.session("https://api.opensuse.org/source")
+
+    assert s.get_adapter("https://api.opensuse.org")._pool_maxsize == 3
+    transport.configure(max_in_flight=8)